@@ -0,0 +1,204 @@
+"""Typed columns for the bool, int and float tags of a project.
+
+A `TypedColumn` stores its values in an `array` along with a mask of the
+missing (None) values instead of a list of Python objects, this takes 1 or 8
+bytes a value plus a byte for the mask instead of a pointer and a boxed
+object for each value.  It behaves like the list it replaces so the rest of
+the project code does not need to care.
+
+A value that does not fit the type of the column, say a string set on an
+integer tag, turns the column back into a plain list so that no value is
+ever lost.
+
+String and text tags are stored as lists.
+"""
+
+from array import array
+import sys
+
+from .storage import TYPECODES
+
+
+if sys.version_info[0] > 2:
+    int_types = (int,)
+    imap = map
+else:
+    int_types = (int, long)  # noqa: F821
+    from itertools import imap
+
+
+def _is_bool(value):
+    return type(value) is bool
+
+
+def _is_int(value):
+    return isinstance(value, int_types) and type(value) is not bool
+
+
+def _is_float(value):
+    return isinstance(value, float) or _is_int(value)
+
+
+# The tag types stored in typed columns and the check for the values which
+# can be stored in them.
+CHECKS = dict(bool=_is_bool, int=_is_int, float=_is_float)
+
+
+def _mask_value(value, valid):
+    return value if valid else None
+
+
+def make_column(type, values=()):
+    """Return a new column for a tag of the given type with the given values.
+
+    This is a `TypedColumn` for the types stored in arrays and a list for
+    the others.
+    """
+    if type in CHECKS and TYPECODES[type] is not None:
+        return TypedColumn(type, values)
+    else:
+        return list(values)
+
+
+def pack(column):
+    """Return the array of the values of the column if they can be saved as
+    an array and a list of them otherwise, see `storage.encode_column`.
+    """
+    if isinstance(column, TypedColumn):
+        values = column.to_array()
+        return column.tolist() if values is None else values
+    return column
+
+
+class TypedColumn(object):
+    """A list like column of bool, int or float values stored in an array.
+    """
+
+    __slots__ = ('type', '_values', '_valid')
+
+    def __init__(self, type, values=()):
+        self.type = type
+        typecode = TYPECODES[type]
+        if isinstance(values, array) and values.typecode == typecode:
+            self._values = values
+            self._valid = bytearray(b'\x01') * len(values)
+        else:
+            self._values = array(typecode)
+            # A byte for each value which is 0 when the value is None.
+            self._valid = bytearray()
+            self.extend(values)
+
+    def __repr__(self):
+        return 'TypedColumn(%r, %r)' % (self.type, self.tolist())
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        if self._valid is None:
+            return iter(self._values)
+        values = self._values
+        values = imap(bool, values) if self.type == 'bool' else iter(values)
+        if b'\x00' in self._valid:
+            return imap(_mask_value, values, self._valid)
+        else:
+            return values
+
+    def __eq__(self, other):
+        if isinstance(other, (TypedColumn, list)):
+            return self.tolist() == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.tolist()[index]
+        if self._valid is None:
+            return self._values[index]
+        if not self._valid[index]:
+            return None
+        value = self._values[index]
+        return bool(value) if self.type == 'bool' else value
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            values = self.tolist()
+            values[index] = value
+            self._reset(values)
+        elif self._valid is None:
+            self._values[index] = value
+        elif value is None:
+            self._values[index] = 0
+            self._valid[index] = 0
+        elif CHECKS[self.type](value):
+            try:
+                self._values[index] = value
+            except OverflowError:
+                self._unpack()
+                self._values[index] = value
+            else:
+                self._valid[index] = 1
+        else:
+            self._unpack()
+            self._values[index] = value
+
+    def __delitem__(self, index):
+        del self._values[index]
+        if self._valid is not None:
+            del self._valid[index]
+
+    def append(self, value):
+        self.extend((value,))
+
+    def extend(self, values):
+        values = list(values)
+        if self._valid is not None and all(map(CHECKS[self.type], values)):
+            try:
+                self._values.extend(values)
+            except OverflowError:
+                # The array may be partially extended.
+                del self._values[len(self._valid):]
+            else:
+                self._valid.extend(b'\x01' * len(values))
+                return
+        for value in values:
+            if self._valid is None:
+                self._values.append(value)
+            else:
+                self._values.append(0)
+                self._valid.append(0)
+                self[-1] = value
+
+    def to_array(self):
+        """Return the array of the values or None if any value is missing
+        or the values are not stored in an array.
+        """
+        if self._valid is None or b'\x00' in self._valid:
+            return None
+        return self._values
+
+    def tolist(self):
+        """Return a list of the values."""
+        if self._valid is None:
+            return list(self._values)
+        values = self._values.tolist()
+        if self.type == 'bool':
+            values = list(map(bool, values))
+        if b'\x00' in self._valid:
+            values = list(map(_mask_value, values, self._valid))
+        return values
+
+    def _reset(self, values):
+        self._values = array(TYPECODES[self.type])
+        self._valid = bytearray()
+        self.extend(values)
+
+    def _unpack(self):
+        """Store the values in a list from now on."""
+        self._values = self.tolist()
+        self._valid = None
@@ -1,8 +1,88 @@
+from multiprocessing.pool import ThreadPool
 import os
 from os.path import basename, join
+import stat
+import time
 
 from traits.api import Any, HasTraits, Instance, List, Property, Str
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# Number of threads used to list the subdirectories when scanning a tree.
+SCAN_THREADS = 8
+
+# The modification time of a directory that changed less than this many
+# seconds before it was listed is not remembered as the directory may change
+# again without its modification time changing.
+MTIME_RESOLUTION = 2.0
+
+
+def _list_directory(path, accept):
+    """Return the names of the subdirectories and a list of (name, stat) for
+    the files in the directory for which `accept(name)` is True.
+
+    Symbolic links are followed.  Only the accepted files are stat'ed when
+    `scandir` is available.
+    """
+    dirs = []
+    files = []
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.is_file() and accept(entry.name):
+                    files.append((entry.name, entry.stat()))
+            except OSError:
+                pass
+    else:
+        for name in os.listdir(path):
+            try:
+                st = os.stat(join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                dirs.append(name)
+            elif stat.S_ISREG(st.st_mode) and accept(name):
+                files.append((name, st))
+    return dirs, files
+
+
+def _scan_tree(root, incremental=False):
+    """List the directory and all its subdirectories.
+
+    If `incremental` is True, only the directories whose modification time
+    changed are listed again and the files of the others are stat'ed.
+
+    The directories at each level of the tree are processed in parallel
+    using a thread pool which is only created if needed and is closed when
+    the scan is done.
+    """
+    pool = None
+    pending = [root]
+    try:
+        while len(pending) > 0:
+            if len(pending) == 1:
+                result = [pending[0]._update(incremental)]
+            else:
+                if pool is None:
+                    pool = ThreadPool(SCAN_THREADS)
+                result = pool.map(
+                    lambda d: d._update(incremental), pending, chunksize=1
+                )
+            pending = [d for dirs in result for d in dirs]
+    finally:
+        if pool is not None:
+            # The idle workers exit by themselves, no need to wait for them.
+            pool.close()
+
 
 class File(HasTraits):
     path = Str
@@ -10,8 +90,13 @@ class File(HasTraits):
     name = Str
     relpath = Str
 
-    def __init__(self, path, parent, relpath=None, name=None):
+    # The stat result of the file found when it was last scanned.  This is
+    # not persisted.
+    stat = Any
+
+    def __init__(self, path, parent, relpath=None, name=None, stat=None):
         self.path = path
+        self.stat = stat
         self.parent = parent
         self.name = basename(path) if name is None else name
         if relpath is None:
@@ -33,6 +118,10 @@ class Directory(HasTraits):
 
     extensions = List(Str)
 
+    # The modification time of the directory when it was last listed, None
+    # if it is not known.
+    mtime = Any
+
     _directories = List(Instance('Directory'))
     _directory_state = Any
 
@@ -44,12 +133,13 @@ class Directory(HasTraits):
             dirs = self._directory_state
         result = dict(path=self.path, files=files, directories=dirs,
                       extensions=self.extensions, relpath=self.relpath,
-                      name=self.name)
+                      name=self.name, mtime=self.mtime)
         return result
 
     def __setstate__(self, state):
         extensions = state.get('extensions', [])
         path = state['path']
+        self.mtime = state.get('mtime')
         if 'relpath' in state:
             self.__dict__.update(dict(
                 relpath=state['relpath'], path=path,
@@ -75,36 +165,101 @@ class Directory(HasTraits):
     def __repr__(self):
         return 'Directory(path=%r)' % self.path
 
+    def find(self, relpath):
+        """Return the directory in the tree with the given path relative to
+        this directory or None if there is no such directory.
+        """
+        d = self
+        for name in relpath.split(os.sep):
+            if len(name) == 0 or name == '.':
+                continue
+            for sub in d.directories:
+                if sub.name == name:
+                    d = sub
+                    break
+            else:
+                return None
+        return d
+
     def refresh(self):
         self._path_changed(self.path)
 
+    def rescan(self):
+        """Update the tree, only listing the directories which changed since
+        they were last listed.
+
+        The `stat` of all the files in the tree is updated.
+        """
+        _scan_tree(self, incremental=True)
+
     def _path_changed(self, new):
-        dirs = []
-        files = []
-        extensions = self.extensions
         self.name = basename(new)
         if self.parent is None:
             self.relpath = ''
         else:
             self.relpath = join(self.parent.relpath, self.name)
+        _scan_tree(self)
+
+    def _accept(self, name):
+        extensions = self.extensions
+        return (len(extensions) == 0 or
+                os.path.splitext(name.lower())[1] in extensions)
+
+    def _update(self, incremental=False):
+        """List the directory and return the subdirectories to process next.
+
+        If `incremental` is True and the directory has not changed since it
+        was last listed, only its files are stat'ed and the existing
+        subdirectories are returned.
+        """
+        path = self.path
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if incremental and mtime is not None and mtime == self.mtime:
+            self._stat_files()
+            return self.directories
+
         try:
-            for pth in os.listdir(new):
-                full_path = os.path.join(new, pth)
-                if os.path.isdir(full_path):
-                    d = Directory(extensions=extensions, parent=self)
-                    d.path = full_path
-                    dirs.append(d)
-                elif os.path.isfile(full_path):
-                    if len(extensions) == 0:
-                        files.append(File(path=full_path, parent=self))
-                    elif os.path.splitext(pth.lower())[1] in extensions:
-                        files.append(File(path=full_path, parent=self))
-
-        except IOError:
-            pass
+            dir_names, file_info = _list_directory(path, self._accept)
+        except (IOError, OSError):
+            dir_names, file_info = [], []
+        if incremental:
+            existing = dict((d.name, d) for d in self.directories)
+        else:
+            existing = {}
+        extensions = self.extensions
+        dirs = []
+        for name in dir_names:
+            d = existing.get(name)
+            if d is None:
+                d = Directory(
+                    extensions=extensions, parent=self, name=name,
+                    relpath=join(self.relpath, name)
+                )
+                # Set the path quietly so the directory is not listed right
+                # away.
+                d.trait_setq(path=join(path, name))
+            dirs.append(d)
+        files = [
+            File(path=join(path, name), parent=self, name=name, stat=st)
+            for name, st in file_info
+        ]
+        if mtime is not None and time.time() - mtime < MTIME_RESOLUTION:
+            mtime = None
+        self.mtime = mtime
         self._directory_state = None
         self._directories = dirs
         self.files = files
+        return dirs
+
+    def _stat_files(self):
+        for f in self.files:
+            try:
+                f.stat = os.stat(f.path)
+            except OSError:
+                f.stat = None
 
     def _extensions_changed(self, new, old):
         if len(self.path) > 0:
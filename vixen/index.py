@@ -0,0 +1,238 @@
+"""Indexes over the project columns that speed up searching.
+
+Try to keep this module simple: no non-standard library imports.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+
+def get_trigrams(text):
+    """Return the set of all three character substrings of the text."""
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TextIndex(object):
+    """An inverted index over the values of string columns.
+
+    For each field, the distinct lower-cased values are mapped to the set of
+    record indices having that value and the trigrams of each distinct value
+    are mapped to the values containing them.  A substring search therefore
+    only looks at the distinct values sharing all the trigrams of the text.
+    This makes searching columns with few distinct values (like the type or
+    most tags) very cheap and narrows down the values that need checking for
+    the others.
+
+    The index is kept up to date by calling `add` and `discard` whenever a
+    value in an indexed column changes.
+    """
+
+    def __init__(self):
+        # field -> {lower cased value: set of record indices}
+        self._values = {}
+        # field -> {trigram: set of lower cased values}
+        self._trigrams = {}
+
+    def __getstate__(self):
+        return dict(
+            (field, dict((value, sorted(indices))
+                         for value, indices in values.items()))
+            for field, values in self._values.items()
+        )
+
+    def __setstate__(self, state):
+        self._values = {}
+        self._trigrams = {}
+        for field, values in state.items():
+            values = dict(
+                (value, set(indices)) for value, indices in values.items()
+            )
+            self._values[field] = values
+            self._trigrams[field] = self._make_trigrams(values)
+
+    def __contains__(self, field):
+        return field in self._values
+
+    def fields(self):
+        return list(self._values.keys())
+
+    def add_field(self, field, column):
+        """Index all the values of the given column."""
+        values = {}
+        for index, value in enumerate(column):
+            key = value.lower()
+            indices = values.get(key)
+            if indices is None:
+                values[key] = set((index,))
+            else:
+                indices.add(index)
+        self._values[field] = values
+        self._trigrams[field] = self._make_trigrams(values)
+
+    def remove_field(self, field):
+        self._values.pop(field, None)
+        self._trigrams.pop(field, None)
+
+    def add(self, field, index, value):
+        """Add a record index having the given value for the field."""
+        key = value.lower()
+        values = self._values[field]
+        indices = values.get(key)
+        if indices is None:
+            values[key] = set((index,))
+            trigrams = self._trigrams[field]
+            for gram in get_trigrams(key):
+                trigrams.setdefault(gram, set()).add(key)
+        else:
+            indices.add(index)
+
+    def add_many(self, field, start, values):
+        """Add the values of consecutive records starting at index `start`,
+        None values are skipped.
+        """
+        field_values = self._values[field]
+        trigrams = self._trigrams[field]
+        for index, value in enumerate(values, start):
+            if value is None:
+                continue
+            key = value.lower()
+            indices = field_values.get(key)
+            if indices is None:
+                field_values[key] = set((index,))
+                for gram in get_trigrams(key):
+                    keys = trigrams.get(gram)
+                    if keys is None:
+                        trigrams[gram] = set((key,))
+                    else:
+                        keys.add(key)
+            else:
+                indices.add(index)
+
+    def discard(self, field, index, value):
+        """Remove a record index having the given value for the field."""
+        key = value.lower()
+        values = self._values[field]
+        indices = values.get(key)
+        if indices is None:
+            return
+        indices.discard(index)
+        if len(indices) == 0:
+            self._remove_value(field, key)
+
+    def renumber(self, new_indices):
+        """Renumber the records after some are removed, `new_indices` gives
+        the new index of each record or -1 if it was removed.
+        """
+        renumber = new_indices.__getitem__
+        for field, values in self._values.items():
+            for key in list(values):
+                indices = set(map(renumber, values[key]))
+                indices.discard(-1)
+                if len(indices) == 0:
+                    self._remove_value(field, key)
+                else:
+                    values[key] = indices
+
+    def lookup_text(self, field, text):
+        """Return the set of record indices whose value for the field contains
+        the given lower-cased text.
+
+        Returns None if the field is not indexed.
+        """
+        values = self._values.get(field)
+        if values is None:
+            return None
+        if len(text) < 3:
+            candidates = values
+        else:
+            trigrams = self._trigrams[field]
+            postings = []
+            for gram in get_trigrams(text):
+                keys = trigrams.get(gram)
+                if keys is None:
+                    return set()
+                postings.append(keys)
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+
+        result = set()
+        for key in candidates:
+            if text in key:
+                result |= values[key]
+        return result
+
+    def _remove_value(self, field, key):
+        del self._values[field][key]
+        trigrams = self._trigrams[field]
+        for gram in get_trigrams(key):
+            keys = trigrams[gram]
+            keys.discard(key)
+            if len(keys) == 0:
+                del trigrams[gram]
+
+    def _make_trigrams(self, values):
+        trigrams = defaultdict(set)
+        for key in values:
+            for gram in get_trigrams(key):
+                trigrams[gram].add(key)
+        return dict(trigrams)
+
+
+class RangeIndex(object):
+    """Sorted copies of numeric columns used to look up ranges by bisection.
+
+    A column is only sorted when a range on it is first looked up and the
+    sorted copy is thrown away by `invalidate` whenever the column changes.
+    """
+
+    def __init__(self, get_column, fields=()):
+        # A function returning the column given the field name.
+        self.get_column = get_column
+        self.fields = set(fields)
+        # field -> (sorted values, record indices in the same order)
+        self._sorted = {}
+
+    def invalidate(self, field=None):
+        """Throw away the sorted data for the field or for all fields if no
+        field is given.
+        """
+        if field is None:
+            self._sorted.clear()
+        else:
+            self._sorted.pop(field, None)
+
+    def lookup_range(self, field, start, end, startexcl=False,
+                     endexcl=False):
+        """Return the set of record indices whose value for the field is
+        inside the given range.  Either of `start` or `end` may be None.
+
+        Returns None if the field is not indexed.
+        """
+        if field not in self.fields:
+            return None
+        values, order = self._get_sorted(field)
+        if start is None:
+            lo = 0
+        elif startexcl:
+            lo = bisect_right(values, start)
+        else:
+            lo = bisect_left(values, start)
+        if end is None:
+            hi = len(values)
+        elif endexcl:
+            hi = bisect_left(values, end)
+        else:
+            hi = bisect_right(values, end)
+        return set(order[lo:hi])
+
+    def _get_sorted(self, field):
+        data = self._sorted.get(field)
+        if data is None:
+            # A list as the tag columns may be arrays, see `columns`.
+            column = list(self.get_column(field))
+            # Missing values are not in any range.
+            order = [i for i, x in enumerate(column) if x is not None]
+            order.sort(key=column.__getitem__)
+            values = [column[i] for i in order]
+            data = self._sorted[field] = (values, order)
+        return data
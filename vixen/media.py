@@ -53,9 +53,25 @@ def find_type(path):
     return result
 
 
-def get_media_data(path, relpath):
-    if os.path.exists(path):
-        stat = os.stat(path)
+def get_mtime_long(stat):
+    """Return the modification time in the stat result as stored in the
+    `mtime_` field of `MediaData`.
+    """
+    return datetime_to_long(datetime.datetime.fromtimestamp(stat.st_mtime))
+
+
+def get_media_data(path, relpath, stat=None):
+    """Return the `MediaData` for the file or None if it does not exist.
+
+    If the `stat` result of the file is already available it can be passed so
+    the file is not stat'ed again.
+    """
+    if stat is None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+    if stat is not None:
         _mtime = datetime.datetime.fromtimestamp(stat.st_mtime)
         _ctime = datetime.datetime.fromtimestamp(stat.st_ctime)
         size = stat.st_size
@@ -148,3 +164,50 @@ class Media(HasTraits):
 
     def _get_file_name(self):
         return os.path.basename(self.path)
+
+
+def _column_property(key):
+    def _get(self):
+        return self._project._get_value(self.relpath, key)
+    return property(_get)
+
+
+class MediaView(object):
+    """A light weight, read-only view of a media in a project.
+
+    The attributes are read from the columns of the project when accessed so
+    the view is always up to date.  Use `Project.get` for a `Media` whose tags
+    can be changed.
+    """
+
+    __slots__ = ('relpath', '_project')
+
+    type = _column_property('type')
+    file_name = _column_property('file_name')
+    path = _column_property('path')
+    mtime = _column_property('mtime')
+    ctime = _column_property('ctime')
+    size = _column_property('size')
+    _ctime = _column_property('ctime_')
+    _mtime = _column_property('mtime_')
+
+    def __init__(self, project, relpath):
+        self.relpath = relpath
+        self._project = project
+
+    def __repr__(self):
+        return 'MediaView(relpath=%r)' % self.relpath
+
+    @property
+    def tags(self):
+        """A copy of the tags of the media.
+        """
+        return self._project._get_tags(self.relpath)
+
+    def to_dict(self):
+        data = dict(
+            (key, getattr(self, key)) for key in
+            ('type', 'path', 'relpath', 'mtime', 'ctime', 'size', '_ctime',
+             '_mtime', 'tags')
+        )
+        return data
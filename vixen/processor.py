@@ -1,19 +1,301 @@
+from collections import deque
+from functools import partial
+import hashlib
+import heapq
+import io
+import itertools
+import json
 import logging
 import multiprocessing
 import os
 import shlex
 import shutil
+import signal
 import subprocess
+import sys
+import tempfile
+from threading import Event, Lock, Thread, Timer, local
 import time
-from threading import Thread
 from traceback import format_exc
 
-from traits.api import (Any, Bool, Callable, Dict, Enum, HasTraits, Instance,
-                        Int, List, Str)
+from traits.api import (Any, Bool, Callable, Dict, Enum, Float, HasTraits,
+                        Instance, Int, List, Str)
+
+from .media import Media, MediaData
+from .storage import Journal
 
 
 logger = logging.getLogger(__name__)
 
+if sys.version_info[0] > 2:
+    from queue import Empty, Full, Queue
+    string_types = (str,)
+    import csv
+else:
+    from Queue import Empty, Full, Queue
+    string_types = (basestring,)  # noqa: F821
+    import backports.csv as csv
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+# Keyword arguments to `subprocess.Popen` to start a command in a new process
+# group so that any processes it starts are also killed on a timeout, see
+# `_start_killer`.
+if os.name != 'posix':
+    NEW_GROUP = {}
+elif sys.version_info[0] > 2:
+    NEW_GROUP = dict(start_new_session=True)
+else:
+    NEW_GROUP = dict(preexec_fn=os.setsid)
+
+# Printed by a persistent tagger after the tags of each media.
+END_OF_RECORD = '---'
+
+# Seconds between checks for being stopped while waiting on a full queue.
+FEED_TIMEOUT = 0.1
+
+# Name of the file in the destination directory of a CommandFactory which
+# records the inputs each output was made from.
+COMMAND_CACHE = '.vixen_cache.jsonl'
+
+# The columns of `Processor.job_stats`.
+STATS_FIELDS = ('group', 'info', 'status', 'started', 'queue_wait',
+                'wall_time', 'cpu_time', 'child_cpu_time', 'child_rss')
+
+# Holds the job run by the current thread so the resource usage of the
+# commands it runs is added to it.
+_running = local()
+
+# Serializes the writes to the command caches.
+_cache_lock = Lock()
+
+
+class RemoteError(Exception):
+    """Raised when a job fails in a worker process, the message has the
+    traceback from the worker.
+    """
+    pass
+
+
+class WorkerError(Exception):
+    """Raised when a persistent tagger process exits unexpectedly.
+    """
+    pass
+
+
+class JobTimeout(Exception):
+    """Raised when a command is killed for running too long.
+    """
+    pass
+
+
+def _start_killer(process, timeout):
+    """Kill the process after `timeout` seconds, unless the returned timer
+    is cancelled first.  Returns None if the timeout is not positive.
+
+    The process group of the process is killed where the process is
+    started with `NEW_GROUP`, this kills the processes it started too which
+    may otherwise keep its output open.  The timer's `killed` list is not
+    empty if the process was killed.
+    """
+    if timeout <= 0:
+        return None
+
+    def _kill():
+        timer.killed.append(True)
+        try:
+            if len(NEW_GROUP) > 0:
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            pass
+
+    timer = Timer(timeout, _kill)
+    timer.killed = []
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def _run_command(command, timeout=0.0, stdin=None, stderr=subprocess.PIPE):
+    """Run the command and return its exit status, output and error output.
+
+    The command is killed and `JobTimeout` is raised if it runs for more
+    than `timeout` seconds (when positive).
+    """
+    p = subprocess.Popen(
+        command, stdin=subprocess.PIPE if stdin is not None else None,
+        stdout=subprocess.PIPE, stderr=stderr, **NEW_GROUP
+    )
+    timer = _start_killer(p, timeout)
+    try:
+        stdout, stderr, usage = _communicate(p, stdin)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    _add_child_usage(usage)
+    if timer is not None and timer.killed and p.returncode != 0:
+        raise JobTimeout(
+            '%r was killed after %s seconds' % (' '.join(command), timeout)
+        )
+    return p.returncode, stdout, stderr
+
+
+def _communicate(process, stdin=None):
+    """Like `Popen.communicate` but also return the resource usage of the
+    process, None where it is not available.
+
+    The process is waited for with `os.wait4` which gives the usage of that
+    process alone, unlike the usage of all the children of ViXeN.
+    """
+    if not hasattr(os, 'wait4'):
+        stdout, stderr = process.communicate(stdin)
+        return stdout, stderr, None
+
+    output = {}
+
+    def _read(name):
+        output[name] = getattr(process, name).read()
+
+    readers = []
+    for name in ('stdout', 'stderr'):
+        if getattr(process, name) is not None:
+            t = Thread(target=_read, args=(name,))
+            t.daemon = True
+            t.start()
+            readers.append(t)
+    if process.stdin is not None:
+        try:
+            if stdin is not None:
+                process.stdin.write(stdin)
+            process.stdin.close()
+        except (IOError, OSError):
+            # The process exited without reading all its input.
+            pass
+    for t in readers:
+        t.join()
+    for name in ('stdout', 'stderr'):
+        stream = getattr(process, name)
+        if stream is not None:
+            stream.close()
+    status, usage = os.wait4(process.pid, 0)[1:]
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return output.get('stdout'), output.get('stderr'), usage
+
+
+def _get_maxrss(usage):
+    """Return the peak resident memory in KiB from a resource usage.
+    """
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss//1024
+    return usage.ru_maxrss
+
+
+def _add_child_usage(usage):
+    """Add the resource usage of a command to the job run by the current
+    thread.
+    """
+    job = getattr(_running, 'job', None)
+    if job is not None and usage is not None:
+        job.child_cpu_time += usage.ru_utime + usage.ru_stime
+        job.child_rss = max(job.child_rss, _get_maxrss(usage))
+
+
+def _thread_cpu_time():
+    """Return the CPU time used by the calling thread, always 0 where this
+    is not available (e.g. Python 2).
+    """
+    if hasattr(time, 'thread_time'):
+        return time.thread_time()
+    elif resource is not None and hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+    else:
+        return 0.0
+
+
+def _get_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return -1
+
+
+def _stat_inputs(paths):
+    """Return the size and modification time of each of the paths, None
+    for the ones which do not exist.
+    """
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stats.append(None)
+        else:
+            stats.append([stat.st_size, stat.st_mtime])
+    return stats
+
+
+def _hash_file(path, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        while True:
+            data = fp.read(block_size)
+            if len(data) == 0:
+                break
+            sha.update(data)
+    return sha.hexdigest()
+
+
+def _call_remote(func, args):
+    """Call the function in a worker process.
+
+    Returns the result along with the CPU time used by the worker, the CPU
+    time used by its children and the peak memory of the worker in KiB.
+    Any error is re-raised as a `RemoteError` so the traceback from the worker
+    is not lost.
+    """
+    start = os.times()
+    try:
+        result = func(*args)
+    except Exception:
+        raise RemoteError(format_exc())
+    end = os.times()
+    cpu = end[0] + end[1] - start[0] - start[1]
+    child_cpu = end[2] + end[3] - start[2] - start[3]
+    rss = 0
+    if resource is not None:
+        rss = _get_maxrss(resource.getrusage(resource.RUSAGE_SELF))
+    return result, cpu, child_cpu, rss
+
+
+# The process functions compiled in a worker, keyed on their code.
+_functions = {}
+
+
+def _run_python_function(code, relpath, data, tags, dest):
+    """Run the `process` function in the given code on the media made from
+    the data and tags, in a worker process.  Returns the tags changed by the
+    function so that only these are merged into the project.
+    """
+    func = _functions.get(code)
+    if func is None:
+        ns = {}
+        exec(compile(code, '<string>', 'exec'), ns)
+        func = _functions[code] = ns['process']
+    old = dict(tags)
+    media = Media.from_data(data, tags)
+    func(relpath, media, dest)
+    return dict((k, v) for k, v in media.tags.items() if old.get(k) != v)
+
 
 class Job(HasTraits):
     func = Callable
@@ -33,9 +315,52 @@ class Job(HasTraits):
 
     thread = Instance(Thread)
 
-    def run(self):
+    # An optional picklable (function, args) pair which is run in a worker
+    # process instead of `func` when a process pool is used.  The function
+    # should be importable from a module.
+    remote = Any
+
+    # Called in this process with the result of the remote function, its
+    # return value is the result of the job.
+    merge = Callable
+
+    # The files read and written by the job.  A job is only run after the
+    # jobs writing its inputs have finished successfully.
+    inputs = List(Str)
+    outputs = List(Str)
+
+    # When the job could be run (as from `time.time`), set by the
+    # `Processor`.
+    ready_time = Float
+
+    # Measurements of the last run of the job: the seconds it waited to be
+    # started once it could be run, its wall and CPU time and the CPU time
+    # and peak memory, in KiB, of the commands it ran.  The CPU time is that
+    # of the worker process when the job runs in a process pool.
+    queue_wait = Float
+    wall_time = Float
+    cpu_time = Float
+    child_cpu_time = Float
+    child_rss = Int
+
+    # The process pool the job is currently run in.
+    _pool = Any(transient=True)
+
+    def run(self, pool=None):
+        """Run the job in its thread.
+
+        If a process pool is given and the job has a remote function, the
+        remote function is run in the pool.
+        """
+        self._pool = pool
         self.thread.start()
 
+    def execute(self, pool=None):
+        """Run the job in the calling thread.
+        """
+        self._pool = pool
+        self._run()
+
     def reset(self):
         self.status = 'none'
         self.error = ''
@@ -44,8 +369,25 @@ class Job(HasTraits):
     def _run(self):
         self.status = 'running'
         logger.info("Running: %s", self.info)
+        pool = self._pool
+        start = time.time()
+        if self.ready_time > 0:
+            self.queue_wait = max(start - self.ready_time, 0.0)
+        self.child_cpu_time = 0.0
+        self.child_rss = 0
+        cpu = _thread_cpu_time()
+        remote_cpu = 0.0
+        _running.job = self
         try:
-            self.result = self.func(*self.args, **self.kw)
+            if pool is not None and self.remote is not None:
+                result, remote_cpu, child_cpu, rss = pool.apply(
+                    _call_remote, self.remote
+                )
+                self.child_cpu_time = child_cpu
+                self.child_rss = rss
+                self.result = self.merge(result)
+            else:
+                self.result = self.func(*self.args, **self.kw)
             self.status = 'success'
         except Exception as e:
             if hasattr(e, 'output'):
@@ -53,6 +395,10 @@ class Job(HasTraits):
             self.error += format_exc()
             self.status = 'error'
             logger.info(self.error)
+        finally:
+            _running.job = None
+            self.cpu_time = _thread_cpu_time() - cpu + remote_cpu
+            self.wall_time = time.time() - start
 
     def _thread_default(self):
         t = Thread(target=self._run)
@@ -60,6 +406,140 @@ class Job(HasTraits):
         return t
 
 
+class JobRecord(object):
+    """A job waiting to be run.
+
+    This is a much lighter version of a `Job` and is made into one when it is
+    run, only the running and failed jobs are shown in the UI.
+    """
+
+    __slots__ = ('func', 'args', 'kw', 'info', 'remote', 'merge', 'inputs',
+                 'outputs', 'status', 'key')
+
+    def __init__(self, func, args=(), kw=None, info='', remote=None,
+                 merge=None, inputs=(), outputs=(), key=None):
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.info = info
+        self.remote = remote
+        self.merge = merge
+        self.inputs = inputs
+        self.outputs = outputs
+        self.status = 'none'
+        # Identifies the job in a `JobLedger`, see `iter_pipeline_jobs`.
+        self.key = key
+
+    def __repr__(self):
+        return 'JobRecord(info=%r)' % self.info
+
+    def to_job(self):
+        """Return a new `Job` to run this job.
+        """
+        job = Job(
+            func=self.func, args=list(self.args), kw=dict(self.kw or {}),
+            info=self.info, remote=self.remote, inputs=list(self.inputs),
+            outputs=list(self.outputs)
+        )
+        if self.merge is not None:
+            job.merge = self.merge
+        return job
+
+
+class _JobGraph(object):
+    """The jobs which can be run and the ones waiting on the jobs making
+    their inputs.
+    """
+
+    def __init__(self, jobs=()):
+        # The jobs that can be run now.
+        self.ready = deque()
+        # When each job in `ready` could be run.
+        self.ready_time = {}
+        # The unfinished jobs by the paths they write.
+        self._producers = {}
+        # The number of jobs each job is waiting on.
+        self._waiting = {}
+        # The jobs waiting on each job.
+        self._dependents = {}
+        self.add(jobs)
+
+    def add(self, jobs):
+        producers = self._producers
+        for job in jobs:
+            for path in job.outputs:
+                producers[path] = job
+        for job in jobs:
+            depends_on = set(
+                producers[path] for path in job.inputs if path in producers
+            )
+            depends_on.discard(job)
+            if len(depends_on) == 0:
+                self.ready.append(job)
+                self.ready_time[job] = time.time()
+            else:
+                self._waiting[job] = len(depends_on)
+                for other in depends_on:
+                    self._dependents.setdefault(other, []).append(job)
+
+    def finished(self, job):
+        """Called when a job is done, the jobs waiting on it are run next if
+        it succeeded.
+        """
+        if job.status != 'success':
+            return
+        for path in job.outputs:
+            if self._producers.get(path) is job:
+                del self._producers[path]
+        for dependent in self._dependents.pop(job, []):
+            self._waiting[dependent] -= 1
+            if self._waiting[dependent] == 0:
+                del self._waiting[dependent]
+                self.ready.appendleft(dependent)
+                self.ready_time[dependent] = time.time()
+
+
+def _summarize(rows, elapsed):
+    """Summarize the given rows of `Processor.job_stats` for a run which
+    took `elapsed` seconds.
+    """
+    n = len(rows)
+    wall_time = sum(row[5] for row in rows)
+    cpu_time = sum(row[6] for row in rows)
+    child_cpu_time = sum(row[7] for row in rows)
+    return dict(
+        jobs=n,
+        errors=sum(1 for row in rows if row[2] == 'error'),
+        throughput=n/elapsed if elapsed > 0 else 0.0,
+        wall_time=wall_time,
+        cpu_time=cpu_time,
+        child_cpu_time=child_cpu_time,
+        child_rss=max([row[8] for row in rows] or [0]),
+        mean_wall_time=wall_time/n if n > 0 else 0.0,
+        mean_queue_wait=sum(row[4] for row in rows)/n if n > 0 else 0.0,
+        cpu_use=(cpu_time + child_cpu_time)/wall_time if wall_time > 0
+        else 0.0
+    )
+
+
+# Put on the queue of jobs made from `Processor.job_source` when all of them
+# have been made.
+_NO_MORE_JOBS = 'no more jobs'
+
+
+def _put(queue, item, stop):
+    """Put the item on the bounded queue unless stopped while waiting for
+    space, returns False if stopped.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=FEED_TIMEOUT)
+            return True
+        except Full:
+            pass
+    return False
+
+
 class Processor(HasTraits):
     jobs = List(Job)
 
@@ -73,57 +553,273 @@ class Processor(HasTraits):
 
     max_processes = Int
 
+    # How the jobs are run: each job in its own thread, the jobs that support
+    # it in a pool of worker processes (the others in threads), or one after
+    # the other in the calling thread.
+    backend = Enum('thread', 'process', 'inline')
+
     status = Enum('none', 'running', 'success', 'error')
 
     interrupt = Enum('', 'pause', 'stop')
 
+    # The number of times a failed job is run again.  The first retry is
+    # after `retry_delay` seconds and the delay doubles after each one.
+    retries = Int(0)
+    retry_delay = Float(1.0)
+
+    # Keep running the other jobs when a job fails, the failed jobs are
+    # collected in `errored_jobs`.
+    continue_on_error = Bool(False)
+
+    # Progress of the current run: the number of jobs to run, the number
+    # finished (successfully or not), the jobs finished per second and the
+    # estimated number of seconds left.
+    number_of_jobs = Int
+    jobs_done = Int
+    throughput = Float
+    eta = Float
+
+    # The thread running the jobs in the background, see `start`.
+    thread = Instance(Thread, transient=True)
+
+    # An iterator of more jobs to run.  These are made while the jobs run,
+    # at most `queue_size` ahead of time, and are not kept once they
+    # succeed.  It is used up by `process`.
+    job_source = Any(transient=True)
+
+    queue_size = Int(1000)
+
+    # An optional `JobLedger` in which the state of the jobs from the job
+    # source is recorded so an interrupted run can be resumed.
+    ledger = Any(transient=True)
+
+    # The measurements of each job run by the last `process`, a tuple with
+    # the `STATS_FIELDS` of each job.  The jobs which are retried have a row
+    # for each attempt.  The group of a job is the name of its factory,
+    # prefixed with the index of the factory for the jobs of a pipeline.
+    job_stats = Instance(list, (), transient=True)
+
+    # A summary of the `job_stats` of all the jobs and of each group of
+    # jobs, see `export_report`.
+    summary = Dict(transient=True)
+
+    # True while jobs are being made from the job source, the number of jobs
+    # is not final then.
+    making_jobs = Bool(False)
+
+    # The queue the finished jobs are put on while processing.
+    _finished = Any(transient=True)
+
+    _start_time = Float
+
     def process(self):
+        """Run the jobs which have not been run and the ones which failed
+        earlier.
+
+        At most `number_of_processes` jobs are run at a time by a pool of
+        worker threads which put the jobs on a queue when they finish.  No
+        new jobs are started while paused, after a job fails (unless
+        `continue_on_error` is set) or after the processing is stopped.
+        Failed jobs are first retried `retries` times, waiting a little
+        longer before each attempt.
+
+        A job which reads the outputs of other jobs is started once those
+        have finished, before any other job, so each file goes through all
+        the stages of a pipeline as soon as possible.  Jobs waiting on a job
+        which failed are left to be run the next time.
+        """
         self.running = []
         self.interrupt = ''
         running = self.running
-        error = None
         self.status = 'running'
         jobs = [job for job in self.jobs if job.status == 'none']
         self._reset_errored_jobs()
         jobs.extend(self.errored_jobs)
         self.errored_jobs = []
-        for job in jobs:
-            while len(running) == self.number_of_processes:
-                for j in running:
-                    if not j.thread.is_alive():
-                        if j.status == 'error':
-                            error = j
-                        else:
-                            self.completed.append(j)
-                        running.remove(j)
-                time.sleep(0.01)
-
-            while self.interrupt == 'pause':
-                time.sleep(0.5)
-
-            if error is not None:
-                self.status = 'error'
-                self.errored_jobs.append(error)
+        source = self.job_source
+        self.job_source = None
+        self.job_stats = []
+        self.summary = {}
+        self._start_progress(len(jobs))
+        pool = None
+        if self.backend == 'process' and \
+                (source is not None or any(j.remote for j in jobs)):
+            pool = multiprocessing.Pool(self.number_of_processes)
+
+        todo = Queue()
+        done = self._finished = Queue()
+        feeder = None
+        if source is not None:
+            feed = Queue(self.queue_size)
+            stop_feed = Event()
+            self.making_jobs = True
+            feeder = Thread(
+                target=self._feed, args=(source, feed, done, stop_feed)
+            )
+            feeder.daemon = True
+            feeder.start()
+        workers = []
+        if self.backend != 'inline':
+            n_workers = self.number_of_processes
+            if source is None:
+                n_workers = min(n_workers, len(jobs))
+            for i in range(max(1, n_workers)):
+                t = Thread(target=self._work, args=(todo, done, pool))
+                t.daemon = True
+                t.start()
+                workers.append(t)
+        slots = max(1, len(workers))
+
+        kept = set(jobs)
+        graph = _JobGraph(jobs)
+        ready = graph.ready
+        # The records of the running jobs which were made from one.
+        records = {}
+        # A heap of (time, count, job) of the failed jobs to run again.
+        retrying = []
+        attempts = {}
+        counter = itertools.count()
+        while True:
+            while len(retrying) > 0 and retrying[0][0] <= time.time():
+                job = heapq.heappop(retrying)[2]
+                job.reset()
+                ready.append(job)
+                graph.ready_time[job] = time.time()
+            if self.status != 'error' and self.interrupt == '':
+                while len(running) < slots:
+                    if len(ready) == 0 and self.making_jobs:
+                        self._take_jobs(feed, graph)
+                    if len(ready) == 0:
+                        break
+                    job = ready.popleft()
+                    ready_time = graph.ready_time.pop(job, 0.0)
+                    if isinstance(job, JobRecord):
+                        record = job
+                        job = record.to_job()
+                        records[job] = record
+                        self._record_state(record, 'running')
+                    job.ready_time = ready_time
+                    running.append(job)
+                    if len(workers) > 0:
+                        todo.put(job)
+                    else:
+                        job.execute()
+                        done.put(job)
+            finished = ((len(ready) == 0 and not self.making_jobs and
+                         len(retrying) == 0) or
+                        self.status == 'error' or self.interrupt == 'stop')
+            if len(running) == 0 and finished:
                 break
 
-            if self.interrupt == 'stop':
-                break
-            else:
-                running.append(job)
-                job.run()
-
-        # Wait for all remaining jobs to complete.
-        for job in running:
-            job.thread.join()
+            self._flush_ledger()
+            # None is put on the queue to wake us up when resumed/stopped or
+            # when more jobs are made.
+            timeout = None
+            if len(retrying) > 0 and self.interrupt == '':
+                timeout = max(retrying[0][0] - time.time(), 0)
+            try:
+                job = done.get(timeout=timeout)
+            except Empty:
+                continue
+            if job is None:
+                continue
             running.remove(job)
+            self._add_stats(job, records.get(job, job))
+            if job.status == 'error':
+                count = attempts.get(job, 0)
+                if count < self.retries:
+                    attempts[job] = count + 1
+                    delay = self.retry_delay*2**count
+                    logger.warning(
+                        'Retrying in %.1f seconds: %s', delay, job.info
+                    )
+                    heapq.heappush(
+                        retrying, (time.time() + delay, next(counter), job)
+                    )
+                    continue
+                attempts.pop(job, None)
+            record = records.pop(job, job)
+            record.status = job.status
+            graph.finished(record)
+            if job.status == 'success':
+                self._record_state(record, 'done', job.result)
+            else:
+                self._record_state(record, 'failed')
             if job.status == 'error':
                 self.errored_jobs.append(job)
-                self.status = 'error'
-            elif job.status == 'success':
+                if not self.continue_on_error:
+                    self.status = 'error'
+            elif job.status == 'success' and job in kept:
                 self.completed.append(job)
-
+            self._update_progress()
+
+        # The jobs still waiting to be retried have failed.
+        for item in retrying:
+            job = item[2]
+            self._record_state(records.get(job, job), 'failed')
+            self.errored_jobs.append(job)
+        self._flush_ledger()
+        self._finished = None
+        if feeder is not None:
+            stop_feed.set()
+            feeder.join()
+            self.making_jobs = False
+        for t in workers:
+            todo.put(None)
+        for t in workers:
+            t.join()
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        self.summary = self._make_summary()
         if self.status != 'error':
-            self.status = 'success'
+            if len(self.errored_jobs) > 0:
+                self.status = 'error'
+            else:
+                self.status = 'success'
+
+    def export_report(self, fname):
+        """Export the measurements of the jobs of the last run.
+
+        A file name ending in ".csv" gets a row with the `STATS_FIELDS` of
+        each job, any other name gets a JSON object with the `summary` and
+        the list of jobs.
+        """
+        logger.info('Exporting processing report: %s', fname)
+        if fname.lower().endswith('.csv'):
+            with io.open(fname, 'w', newline='', encoding='utf-8') as fp:
+                writer = csv.writer(fp)
+                writer.writerow(STATS_FIELDS)
+                writer.writerows(self.job_stats)
+        else:
+            data = dict(
+                summary=self.summary,
+                jobs=[dict(zip(STATS_FIELDS, row)) for row in self.job_stats]
+            )
+            with io.open(fname, 'w', encoding='utf-8') as fp:
+                fp.write(u'%s\n' % json.dumps(data, indent=2))
+
+    def start(self):
+        """Process the jobs in a background thread and return immediately.
+
+        Returns False if the jobs are already being processed.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return False
+        # Set the status here so it is running as soon as we return.
+        self.status = 'running'
+        self.thread = Thread(target=self._process)
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        """Wait for the jobs started by `start` to finish.
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
 
     def stop(self):
         if self.status == 'running':
@@ -137,6 +833,112 @@ class Processor(HasTraits):
         if self.status == 'running' and self.interrupt == 'pause':
             self.interrupt = ''
 
+    def _process(self):
+        try:
+            self.process()
+        except Exception:
+            logger.exception('Error while processing jobs.')
+            self.status = 'error'
+
+    def _start_progress(self, number_of_jobs):
+        self._start_time = time.time()
+        self.number_of_jobs = number_of_jobs
+        self.jobs_done = 0
+        self.throughput = 0.0
+        self.eta = 0.0
+
+    def _update_progress(self):
+        self.jobs_done += 1
+        elapsed = time.time() - self._start_time
+        if elapsed > 0:
+            self.throughput = self.jobs_done/elapsed
+            self.eta = (self.number_of_jobs - self.jobs_done)/self.throughput
+
+    def _feed(self, source, feed, done, stop):
+        """Make the jobs from the source and put them on the feed.
+        """
+        try:
+            for job in source:
+                if not _put(feed, job, stop):
+                    return
+                done.put(None)
+        except Exception:
+            logger.exception('Error while making the jobs.')
+            self.status = 'error'
+        _put(feed, _NO_MORE_JOBS, stop)
+        done.put(None)
+
+    def _take_jobs(self, feed, graph):
+        """Take the made jobs until one of them can be run.
+        """
+        while len(graph.ready) == 0:
+            try:
+                job = feed.get_nowait()
+            except Empty:
+                return
+            if job is _NO_MORE_JOBS:
+                self.making_jobs = False
+                return
+            self.number_of_jobs += 1
+            graph.add([job])
+            self._record_state(job, 'queued')
+
+    def _add_stats(self, job, record):
+        owner = getattr(job.func, '__self__', None)
+        group = owner.name if isinstance(owner, FactoryBase) else 'jobs'
+        key = getattr(record, 'key', None)
+        if key is not None:
+            group = '%s:%s' % (key.split(':', 1)[0], group)
+        started = time.time() - job.wall_time - self._start_time
+        self.job_stats.append((
+            group, job.info, job.status, started, job.queue_wait,
+            job.wall_time, job.cpu_time, job.child_cpu_time, job.child_rss
+        ))
+
+    def _make_summary(self):
+        """Summarize the `job_stats`.
+
+        Along with the totals, the summary has the number of jobs finished per
+        second, the mean time the jobs waited to be started and the share of
+        their wall time spent using the CPU by them and their commands.  A
+        CPU use much less than 1 means the jobs are mostly waiting on I/O and
+        a long wait means there are not enough workers.
+        """
+        elapsed = time.time() - self._start_time
+        groups = {}
+        for row in self.job_stats:
+            groups.setdefault(row[0], []).append(row)
+        summary = _summarize(self.job_stats, elapsed)
+        summary['elapsed'] = elapsed
+        summary['groups'] = dict(
+            (group, _summarize(rows, elapsed))
+            for group, rows in groups.items()
+        )
+        return summary
+
+    def _record_state(self, job, state, result=None):
+        key = getattr(job, 'key', None)
+        if self.ledger is not None and key is not None:
+            inputs = _stat_inputs(job.inputs) if state == 'done' else None
+            self.ledger.add(key, state, result, inputs)
+
+    def _flush_ledger(self):
+        if self.ledger is not None:
+            self.ledger.flush()
+
+    def _work(self, todo, done, pool):
+        while True:
+            job = todo.get()
+            if job is None:
+                break
+            job.execute(pool)
+            done.put(job)
+
+    def _interrupt_changed(self):
+        done = self._finished
+        if done is not None:
+            done.put(None)
+
     def _reset_errored_jobs(self):
         for job in self.errored_jobs:
             job.reset()
@@ -161,11 +963,48 @@ class FactoryBase(HasTraits):
     # The name of this factory.
     name = Str
 
+    # The index of an earlier processor of the project whose output files are
+    # processed instead of the media, -1 processes the media.
+    source = Int(-1)
+
+    def make_jobs(self, media_keys, project, input_paths=None):
+        """Return a list of the jobs to process the given media.
+
+        `input_paths` maps the media keys to the files to process instead of
+        the media, see `source`.
+        """
+        jobs = self.iter_jobs(media_keys, project, input_paths)
+        return [job.to_job() for job in jobs]
+
+    def iter_jobs(self, media_keys, project, input_paths=None):
+        """Yield the `JobRecord` of each job to process the given media, one
+        at a time.  Subclasses override this, the base factory makes no jobs.
+        """
+        return iter(())
+
+    def get_output(self, media):
+        """Return the path of the file made from the media or None if
+        nothing is made.
+        """
+        return None
+
+    def restore(self, project, result):
+        """Apply the result of a job which finished in an earlier run that
+        was interrupted, see `JobLedger`.
+        """
+        pass
+
     def clear(self):
         """Clear out any old file information.
         """
         self._done.clear()
 
+    def close(self):
+        """Release any resources used to run the jobs, called once the jobs
+        have been processed.
+        """
+        pass
+
 
 class CommandFactory(FactoryBase):
 
@@ -179,34 +1018,78 @@ class CommandFactory(FactoryBase):
 
     command = Str
 
+    # Compare the content of the inputs and not only their size and
+    # modification time to find the outputs to make again.
+    use_hash = Bool(False)
+
+    # Kill the command if it runs for more than this many seconds, 0 waits
+    # for ever.
+    timeout = Float(0.0)
+
     name = 'CommandFactory'
 
-    def make_jobs(self, media_keys, project):
-        jobs = []
-        ext = self.output_extension
-        if len(ext) > 0:
-            ext = ext if '.' in ext else '.' + ext
+    # The output cache last read or written, as (path, size of the file,
+    # cache), so it is read again only when the file changed elsewhere.
+    _cache_memo = Any(transient=True)
 
+    def iter_jobs(self, media_keys, project, input_paths=None):
+        ext = self._get_extension()
+
+        cache = self._read_cache()
+        updated = []
         for key in media_keys:
-            media = project.get(key)
+            media = project.view(key)
             relpath = media.relpath
-            if os.path.splitext(relpath.lower())[1] != self.input_extension:
-                continue
-            if not os.path.exists(media.path):
+            if input_paths is None:
+                in_file = media.path
+            else:
+                in_file = input_paths[key]
+            if os.path.splitext(in_file.lower())[1] != self.input_extension:
                 continue
+            try:
+                stat = os.stat(in_file)
+            except OSError:
+                if input_paths is None:
+                    continue
+                # The input is made by another job so it is out of date.
+                stat = None
             out_file = self._get_output(relpath, media, ext)
-            if not self._done.get(out_file, False):
-                cmd = self._get_command(media, out_file)
-                job = Job(
-                    func=self._run, args=[cmd, media.path, out_file],
-                    info=' '.join(cmd)
+            entry = cache.get(self._cache_key(out_file))
+            if stat is not None and entry is None and \
+                    self._done.get(out_file, False):
+                # Made before the cache existed, assume it is current.
+                updated.append(self._make_entry(in_file, out_file, stat))
+            elif stat is None or entry is None or \
+                    not self._is_current(entry, in_file, stat):
+                cmd = self._get_command(in_file, out_file)
+                kw = dict(stale=True) if entry is not None else {}
+                yield JobRecord(
+                    func=self._run, args=[cmd, in_file, out_file], kw=kw,
+                    info=' '.join(cmd), inputs=[in_file], outputs=[out_file]
                 )
-                jobs.append(job)
+                continue
+            elif entry['mtime'] != stat.st_mtime:
+                # Same content, remember the new time to not hash it again.
+                updated.append(dict(entry, mtime=stat.st_mtime))
+            self._done[out_file] = True
+            if len(updated) >= 1000:
+                self._write_cache(updated)
+                updated = []
+
+        if len(updated) > 0:
+            self._write_cache(updated)
 
-        return jobs
+    def get_output(self, media):
+        return self._get_output(media.relpath, media, self._get_extension())
 
-    def _get_command(self, media, out_file):
-        cmd = [c.replace('$input', media.path).replace('$output', out_file).
+    def _get_extension(self):
+        ext = self.output_extension
+        if len(ext) > 0:
+            ext = ext if '.' in ext else '.' + ext
+        return ext
+
+    def _get_command(self, in_file, out_file):
+        cmd = [c.replace('$input', in_file).replace('$output', out_file).
                replace('\\', '\\\\')
                for c in shlex.split(self.command)]
         return cmd
@@ -222,26 +1105,97 @@ class CommandFactory(FactoryBase):
             output = output_base
         return output
 
-    def _run(self, command, in_file, out_file):
+    def _run(self, command, in_file, out_file, stale=False):
         basedir = os.path.dirname(out_file)
         if not os.path.exists(basedir):
             os.makedirs(basedir)
+        # Stat the input before running the command so any changes made
+        # while the command runs are picked up the next time.
+        entry = self._make_entry(in_file, out_file, os.stat(in_file))
         lock = out_file + '.lck'
-        if os.path.exists(lock):
+        if os.path.exists(lock) or stale:
             if os.path.exists(out_file):
                 os.remove(out_file)
 
         open(lock, 'w').close()
 
         if not os.path.exists(out_file):
-            subprocess.check_output(command, stderr=subprocess.STDOUT)
+            code, output, _ = _run_command(
+                command, self.timeout, stderr=subprocess.STDOUT
+            )
+            if code != 0:
+                raise subprocess.CalledProcessError(code, command, output)
 
         if self.copy_timestamps:
             shutil.copystat(in_file, out_file)
 
         os.remove(lock)
+        self._write_cache([entry])
         self._done[out_file] = True
 
+    # #### Output cache ####################################################
+
+    def _get_cache(self):
+        return Journal(os.path.join(self.dest, COMMAND_CACHE))
+
+    def _cache_key(self, out_file):
+        return os.path.relpath(out_file, self.dest or os.curdir)
+
+    def _read_cache(self):
+        """Return a dictionary of the latest cache entry of each output.
+        """
+        journal = self._get_cache()
+        with _cache_lock:
+            size = _get_size(journal.path)
+            memo = self._cache_memo
+            if memo is not None and memo[:2] == (journal.path, size):
+                return memo[2]
+            entries = journal.read()
+            cache = dict((x['output'], x) for x in entries)
+            if len(entries) > 2*len(cache) + 1000:
+                journal.rewrite(list(cache.values()))
+                size = _get_size(journal.path)
+            self._cache_memo = (journal.path, size, cache)
+        return cache
+
+    def _write_cache(self, entries):
+        if len(self.dest) > 0 and not os.path.isdir(self.dest):
+            os.makedirs(self.dest)
+        journal = self._get_cache()
+        with _cache_lock:
+            size = _get_size(journal.path)
+            journal.append(entries)
+            memo = self._cache_memo
+            self._cache_memo = None
+            if memo is not None and memo[:2] == (journal.path, size):
+                cache = memo[2]
+                for entry in entries:
+                    cache[entry['output']] = entry
+                self._cache_memo = (
+                    journal.path, _get_size(journal.path), cache
+                )
+
+    def _make_entry(self, in_file, out_file, stat):
+        return dict(
+            output=self._cache_key(out_file), input=in_file,
+            size=stat.st_size, mtime=stat.st_mtime,
+            hash=_hash_file(in_file) if self.use_hash else None,
+            command=self.command
+        )
+
+    def _is_current(self, entry, in_file, stat):
+        """Return True if the output of the cache entry was made from the
+        input as it is now and with the current command.
+        """
+        if (entry['input'] != in_file or entry['command'] != self.command or
+                entry['size'] != stat.st_size):
+            return False
+        if entry['mtime'] == stat.st_mtime:
+            return True
+        if self.use_hash and entry['hash'] is not None:
+            return entry['hash'] == _hash_file(entry['input'])
+        return False
+
 
 class PythonFunctionFactory(FactoryBase):
 
@@ -255,20 +1209,33 @@ class PythonFunctionFactory(FactoryBase):
 
     name = 'PythonFunctionFactory'
 
-    def make_jobs(self, media_keys, project):
+    def iter_jobs(self, media_keys, project, input_paths=None):
         self._setup_func()
-        jobs = []
         for key in media_keys:
-            media = project.get(key)
-            relpath = media.relpath
-            if not self._done.get(media.path, False):
-                info = "Processing %s" % media.path
-                job = Job(
-                    func=self._run, args=[relpath, media, self.dest],
-                    info=info
+            view = project.view(key)
+            if input_paths is None:
+                inputs = [view.path]
+            else:
+                inputs = [input_paths[key]]
+            if not self._done.get(view.path, False):
+                relpath = view.relpath
+                info = "Processing %s" % view.path
+                data = MediaData(
+                    view.path, relpath, view.file_name, view.size,
+                    view.ctime, view._ctime, view.mtime, view._mtime,
+                    view.type
+                )
+                remote = (
+                    _run_python_function,
+                    (self.code, relpath, data, view.tags, self.dest)
+                )
+                # The media is only made editable when the job is run.
+                yield JobRecord(
+                    func=self._run, args=[project, relpath, self.dest],
+                    info=info, remote=remote,
+                    merge=partial(self._merge, project, relpath),
+                    inputs=inputs
                 )
-                jobs.append(job)
-        return jobs
 
     def _setup_func(self):
         ns = {}
@@ -276,9 +1243,24 @@ class PythonFunctionFactory(FactoryBase):
         exec(code_obj, ns)
         self._func = ns['process']
 
-    def _run(self, relpath, media, dest):
+    def restore(self, project, result):
+        _restore_tags(self, project, result)
+
+    def _run(self, project, relpath, dest):
+        media = project.get(relpath)
+        old = dict(media.tags)
         self._func(relpath, media, dest)
         self._done[media.path] = True
+        updates = dict(
+            (k, v) for k, v in media.tags.items() if old.get(k) != v
+        )
+        return {media.relpath: updates}
+
+    def _merge(self, project, relpath, updates):
+        media = project.get(relpath)
+        media.tags.update(updates)
+        self._done[media.path] = True
+        return {media.relpath: updates}
 
     def _code_default(self):
         return "def process(relpath, media, dest): pass"
@@ -287,57 +1269,249 @@ class PythonFunctionFactory(FactoryBase):
 class TaggerFactory(FactoryBase):
     command = Str
 
+    # The number of media passed to each invocation of the command.
+    batch_size = Int(1)
+
+    # Pass the paths on standard input, one per line, instead of as
+    # arguments.
+    use_stdin = Bool(False)
+
+    # Either 'text' lines of "tag: value" or 'json' lines with one object
+    # mapping the tags to their values.
+    output_format = Enum('text', 'json')
+
+    # Start the command once per worker thread and send it one path per line
+    # on its standard input.  For each path it prints the tags and then a
+    # line with `END_OF_RECORD`.
+    persistent = Bool(False)
+
+    # Number of times a media is retried with a new tagger process when the
+    # persistent process dies while processing it.
+    worker_retries = Int(1)
+
+    # Kill the command if it takes more than this many seconds for a job, 0
+    # waits for ever.
+    timeout = Float(0.0)
+
     _tag_types = Any(transient=True)
 
+    # The running persistent tagger processes and the ones not in use.
+    _workers = List(transient=True)
+    _idle = Any(transient=True)
+    _lock = Any(transient=True)
+
     name = 'TaggerFactory'
 
-    def make_jobs(self, media_keys, project):
+    def iter_jobs(self, media_keys, project, input_paths=None):
         self._setup_tag_types(project)
-        jobs = []
+        size = 1 if self.persistent else max(self.batch_size, 1)
 
+        pending = []
         for key in media_keys:
-            media = project.get(key)
-            path = media.path
-            if not os.path.exists(media.path):
-                continue
-            if not self._done.get(path, False):
-                cmd = shlex.split(self.command) + [path]
-                job = Job(
-                    func=self._run, args=[cmd, media], info=' '.join(cmd)
+            view = project.view(key)
+            if input_paths is None:
+                path = view.path
+                if not os.path.exists(path):
+                    continue
+            else:
+                path = input_paths[key]
+            if not self._done.get(view.path, False):
+                pending.append((key, path))
+            if len(pending) == size:
+                yield self._make_job(project, pending)
+                pending = []
+
+        if len(pending) > 0:
+            yield self._make_job(project, pending)
+
+    def _make_job(self, project, pending):
+        # The media are only made editable when the job is run.
+        relpaths = [relpath for relpath, path in pending]
+        paths = [path for relpath, path in pending]
+        if self.persistent:
+            info = '%s < %s' % (self.command, paths[0])
+            return JobRecord(
+                func=self._run_persistent,
+                args=[project, relpaths[0], paths[0]], info=info,
+                inputs=paths
+            )
+        cmd = shlex.split(self.command)
+        if self.use_stdin:
+            info = '%s < (%d paths)' % (' '.join(cmd), len(paths))
+        else:
+            cmd.extend(paths)
+            info = ' '.join(cmd)
+        return JobRecord(
+            func=self._run, args=[cmd, project, relpaths, paths], info=info,
+            inputs=paths
+        )
+
+    def restore(self, project, result):
+        _restore_tags(self, project, result)
+
+    def close(self):
+        """Stop the persistent tagger processes.
+        """
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+            self._idle = Queue()
+        for worker in workers:
+            worker.close()
+
+    def _is_batched(self):
+        """Return True if the output of the command is prefixed with the
+        path of the media, i.e. if more than one path may be passed to it.
+        """
+        if self.persistent:
+            return False
+        return self.batch_size > 1 or self.use_stdin
+
+    def _run(self, command, project, relpaths, paths):
+        stdin = None
+        if self.use_stdin:
+            stdin = u''.join(path + u'\n' for path in paths).encode('utf-8')
+        code, stdout, stderr = _run_command(command, self.timeout, stdin)
+        if code == 0:
+            lines = stdout.decode('utf-8').splitlines()
+            media_list = [project.get(relpath) for relpath in relpaths]
+            return self._update_tags(lines, media_list, paths)
+
+    def _run_persistent(self, project, relpath, path):
+        retries = self.worker_retries
+        while True:
+            worker = self._get_worker()
+            try:
+                lines = worker.request(path, self.timeout)
+            except JobTimeout:
+                with self._lock:
+                    self._workers.remove(worker)
+                worker.close()
+                raise
+            except WorkerError:
+                with self._lock:
+                    self._workers.remove(worker)
+                worker.close()
+                if retries <= 0:
+                    raise
+                retries -= 1
+                logger.warning(
+                    'Tagger worker died while processing %s, retrying.', path
                 )
-                jobs.append(job)
+            else:
+                self._idle.put(worker)
+                break
+        return self._update_tags(lines, [project.get(relpath)], [path])
 
-        return jobs
+    def _get_worker(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            worker = TaggerWorker(shlex.split(self.command))
+            with self._lock:
+                self._workers.append(worker)
+            return worker
+
+    def _update_tags(self, lines, media_list, paths):
+        if self._is_batched():
+            by_path = {}
+            for media, path in zip(media_list, paths):
+                by_path[media.relpath] = media
+                by_path[path] = media
+        else:
+            by_path = None
+        updates = dict((m.path, {}) for m in media_list)
+        if self.output_format == 'json':
+            parsed = self._parse_json(lines, by_path)
+        else:
+            parsed = self._parse_text(lines, by_path)
+        tag_types = self._tag_types
+        for media, tag, value in parsed:
+            if media is None:
+                media = media_list[0]
+            if tag in tag_types:
+                updates[media.path][tag] = tag_types[tag](value)
+
+        for media in media_list:
+            media.tags.update(updates[media.path])
+            self._done[media.path] = True
+        return dict((m.relpath, updates[m.path]) for m in media_list)
 
-    def _run(self, command, media):
-        p = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        stdout, stderr = p.communicate()
-        if p.returncode == 0:
-            tag_types = self._tag_types
-            updates = {}
-            for line in stdout.splitlines():
-                line = line.decode('utf-8')
-                if len(line) == 0:
+    def _parse_text(self, lines, by_path):
+        """Yield (media, tag, value) from lines of "tag: value" or, when
+        batched, "path: tag: value".
+        """
+        for line in lines:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            media = None
+            if by_path is not None:
+                media, line = self._split_path(line, by_path)
+                if media is None:
                     continue
-                try:
-                    tag, value = [x.strip() for x in line.split(':', 1)]
-                except ValueError:
-                    pass
-                else:
-                    if tag in tag_types:
-                        updates[tag] = tag_types[tag](value)
-
-            media.tags.update(updates)
-            self._done[media.path] = True
+            try:
+                tag, value = [x.strip() for x in line.split(':', 1)]
+            except ValueError:
+                pass
+            else:
+                yield media, tag, value
+
+    def _split_path(self, line, by_path):
+        # Paths may themselves contain colons so look for the first prefix
+        # which is a known path.
+        index = line.find(':')
+        while index > -1:
+            media = by_path.get(line[:index].strip())
+            if media is not None:
+                return media, line[index + 1:]
+            index = line.find(':', index + 1)
+        return None, line
+
+    def _parse_json(self, lines, by_path):
+        """Yield (media, tag, value) from lines with a JSON object each, when
+        batched the object's "path" key gives the path of the media.
+        """
+        for line in lines:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                logger.warning('Ignoring invalid JSON from tagger: %s', line)
+                continue
+            if not isinstance(data, dict):
+                continue
+            media = None
+            if by_path is not None:
+                media = by_path.get(data.pop('path', None))
+                if media is None:
+                    continue
+            for tag, value in data.items():
+                yield media, tag, value
+
+    def __idle_default(self):
+        return Queue()
+
+    def __lock_default(self):
+        return Lock()
 
     def _setup_tag_types(self, project):
 
         TRUE = ('1', 't', 'true', 'y', 'yes')
+
+        def _bool(x):
+            if isinstance(x, string_types):
+                return x.lower() in TRUE
+            return bool(x)
+
+        def _string(x):
+            return x if isinstance(x, string_types) else str(x)
+
         type_map = {
-            'bool': lambda x: x.lower() in TRUE,
-            'string': lambda x: x,
+            'bool': _bool,
+            'string': _string,
             'int': int,
             'float': float
         }
@@ -345,6 +1519,288 @@ class TaggerFactory(FactoryBase):
         self._tag_types = {x.name: type_map[x.type] for x in project.tags}
 
 
+class TaggerWorker(object):
+    """A persistent tagger process, see `TaggerFactory.persistent`.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=self._stderr, **NEW_GROUP
+        )
+
+    def __repr__(self):
+        return 'TaggerWorker(command=%r)' % self.command
+
+    def request(self, path, timeout=0.0):
+        """Send the path to the process and return the lines it prints for
+        it, raises `WorkerError` if the process exits and `JobTimeout` if it
+        is killed for taking more than `timeout` seconds.
+        """
+        process = self.process
+        timer = _start_killer(process, timeout)
+        try:
+            return self._request(path)
+        except WorkerError:
+            if timer is not None and timer.killed:
+                raise JobTimeout(
+                    'Tagger was killed after %s seconds on %s' % (
+                        timeout, path
+                    )
+                )
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def _request(self, path):
+        process = self.process
+        try:
+            process.stdin.write((path + u'\n').encode('utf-8'))
+            process.stdin.flush()
+        except (IOError, OSError):
+            raise WorkerError(self._exit_message())
+        lines = []
+        while True:
+            line = process.stdout.readline()
+            if len(line) == 0:
+                raise WorkerError(self._exit_message())
+            line = line.decode('utf-8').rstrip('\r\n')
+            if line == END_OF_RECORD:
+                return lines
+            lines.append(line)
+
+    def close(self):
+        process = self.process
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+        process.stdout.close()
+        self._stderr.close()
+
+    def _exit_message(self):
+        if self.process.poll() is None:
+            # The process closed its output but is still running.
+            self.process.kill()
+        code = self.process.wait()
+        self._stderr.seek(0)
+        stderr = self._stderr.read().decode('utf-8', 'replace')
+        return 'Tagger %r exited with status %s:\n%s' % (
+            ' '.join(self.command), code, stderr
+        )
+
+
+def make_pipeline_jobs(factories, media_keys, project):
+    """Return the jobs of all the factories for the given media.
+
+    A factory with a `source` processes the output files of that earlier
+    factory, its jobs depend on the jobs making those files.
+    """
+    records = _make_pipeline_records(factories, media_keys, project)
+    return [record.to_job() for record in records]
+
+
+def _make_pipeline_records(factories, media_keys, project):
+    """Return the `JobRecord` of the jobs of all the factories for the given
+    media, each with a key made of the index and settings of its factory and
+    its files.
+    """
+    media_keys = list(media_keys)
+    all_jobs = []
+    outputs = []
+    for index, factory in enumerate(factories):
+        ident = _factory_id(factory)
+        source = factory.source
+        if 0 <= source < index:
+            made = outputs[source]
+            input_paths = {}
+            for key in media_keys:
+                path = factories[source].get_output(project.view(key))
+                if path is not None and (path in made or
+                                         os.path.exists(path)):
+                    input_paths[key] = path
+            jobs = list(
+                factory.iter_jobs(list(input_paths), project, input_paths)
+            )
+        else:
+            jobs = list(factory.iter_jobs(media_keys, project))
+        for job in jobs:
+            job.key = _job_key(index, ident, job)
+        outputs.append(set(path for job in jobs for path in job.outputs))
+        all_jobs.extend(jobs)
+    return all_jobs
+
+
+def _factory_id(factory):
+    """Return the class of the factory and a hash of its settings, so the
+    jobs of a factory whose settings changed get new keys.
+    """
+    state = dict(
+        (key, value) for key, value in factory.__getstate__().items()
+        if not key.startswith('_')
+    )
+    data = json.dumps(state, sort_keys=True, default=repr).encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()[:16]
+    return u'%s-%s' % (factory.__class__.__name__, digest)
+
+
+def _job_key(index, ident, job):
+    files = list(job.inputs) + [u'>'] + list(job.outputs)
+    return u'%d:%s:%s' % (index, ident, u'|'.join(files))
+
+
+def _restore_tags(factory, project, result):
+    """Set the tags given by relpath in the result of a job and mark the
+    media as done by the factory.
+    """
+    for relpath, tags in (result or {}).items():
+        if project.has_media(relpath):
+            media = project.get(relpath)
+            media.tags.update(tags)
+            factory._done[media.path] = True
+
+
+class JobLedger(object):
+    """A persisted record of the state of the jobs of a project so that
+    processing can be resumed when ViXeN is killed before the project is
+    saved.
+
+    Each change in the state of a job, 'queued', 'running', 'done' or
+    'failed', is appended to a `Journal` along with the result of the jobs
+    which are done, i.e. the tags they set, and the size and modification
+    time of their inputs.  The jobs are identified by the key given to them
+    by `iter_pipeline_jobs`.
+    """
+
+    def __init__(self, path):
+        self.journal = Journal(path)
+        # The latest state of each job by its key.
+        self.states = {}
+        # The results of the jobs which are done by their key.
+        self.results = {}
+        # The stats of the inputs of the jobs which are done by their key,
+        # see `_stat_inputs`.
+        self.inputs = {}
+        # The number of jobs skipped by `resume` as they were done earlier.
+        self.resumed = 0
+        self._pending = []
+
+    def __repr__(self):
+        return 'JobLedger(path=%r)' % self.journal.path
+
+    def load(self):
+        """Read the state of the jobs from the journal.
+        """
+        self.states = {}
+        self.results = {}
+        self.inputs = {}
+        self.resumed = 0
+        entries = self.journal.read()
+        for entry in entries:
+            key, state = entry['key'], entry['state']
+            self.states[key] = state
+            if state == 'done':
+                self.results[key] = entry.get('result')
+                self.inputs[key] = entry.get('inputs')
+            else:
+                self.results.pop(key, None)
+                self.inputs.pop(key, None)
+        if len(entries) > 2*len(self.states) + 1000:
+            self.journal.rewrite([self._make_entry(key, state)
+                                  for key, state in self.states.items()])
+
+    def add(self, key, state, result=None, inputs=None):
+        """Record the new state of a job, written out on `flush`.
+        """
+        self.states[key] = state
+        if state == 'done':
+            self.results[key] = result
+            self.inputs[key] = inputs
+        else:
+            self.results.pop(key, None)
+            self.inputs.pop(key, None)
+        self._pending.append(self._make_entry(key, state))
+
+    def flush(self):
+        if len(self._pending) > 0:
+            pending = self._pending
+            self._pending = []
+            self.journal.append(pending)
+
+    def clear(self):
+        """Forget all the jobs, typically once their results are saved.
+        """
+        self.states = {}
+        self.results = {}
+        self.inputs = {}
+        self._pending = []
+        self.journal.clear()
+
+    def resume(self, jobs, factories, project):
+        """Yield the given jobs except the ones which are done, the results
+        of those are restored by their factory instead.
+
+        A job is only skipped if its factory is at the same position, of the
+        same class and has the same settings as when the job was done and
+        its inputs have the same size and modification time.
+        """
+        idents = [_factory_id(factory) for factory in factories]
+        for job in jobs:
+            key = job.key
+            factory = None
+            if key is not None and self.states.get(key) == 'done':
+                index, ident = key.split(':', 2)[:2]
+                index = int(index)
+                if (index < len(factories) and idents[index] == ident and
+                        self._inputs_unchanged(key, job)):
+                    factory = factories[index]
+            if factory is not None:
+                factory.restore(project, self.results.get(key))
+                self.resumed += 1
+            else:
+                yield job
+
+    def _inputs_unchanged(self, key, job):
+        inputs = self.inputs.get(key)
+        if inputs is None:
+            return False
+        # The stats are lists after being read from the journal.
+        return [x and list(x) for x in inputs] == _stat_inputs(job.inputs)
+
+    def _make_entry(self, key, state):
+        entry = dict(key=key, state=state)
+        if state == 'done':
+            entry['result'] = self.results.get(key)
+            entry['inputs'] = self.inputs.get(key)
+        return entry
+
+
+def iter_pipeline_jobs(factories, media_keys, project, chunk_size=1000):
+    """Yield the `JobRecord` of the jobs of all the factories for the
+    given media.
+
+    The media are taken `chunk_size` at a time so the jobs for the first
+    media are made without going through all of them, see
+    `make_pipeline_jobs`.
+    """
+    chunk = []
+    for key in media_keys:
+        chunk.append(key)
+        if len(chunk) == chunk_size:
+            for job in _make_pipeline_records(factories, chunk, project):
+                yield job
+            chunk = []
+    if len(chunk) > 0:
+        for job in _make_pipeline_records(factories, chunk, project):
+            yield job
+
+
 def dump(factory):
     """Dump a factory instance so it can be safely pickled."""
     name = factory.__class__.__name__
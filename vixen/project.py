@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import datetime
 import io
 import json_tricks
@@ -7,17 +8,25 @@ from os.path import (abspath, basename, dirname, exists, expanduser,
                      join, realpath, relpath, splitext)
 import re
 import shutil
+import stat
 import sys
+from threading import Lock
+from weakref import WeakValueDictionary
 
-from traits.api import (Any, Dict, Enum, HasTraits, Instance, List, Long,
-                        Str)
+from traits.api import (Any, Bool, Dict, Enum, Event, HasTraits, Instance, Int,
+                        List, Long, Property, Str, on_trait_change)
 from whoosh import fields, qparser, query
 from whoosh.util.times import datetime_to_long, long_to_datetime
 
+from . import columns
 from .common import get_project_dir
-from .media import Media, MediaData, get_media_data
-from .directory import Directory
+from .media import (Media, MediaData, MediaView, get_media_data,
+                    get_mtime_long)
+from .directory import Directory, File
+from .index import RangeIndex, TextIndex
+from .query import compile_query
 from . import processor
+from . import storage
 
 
 logger = logging.getLogger(__name__)
@@ -26,9 +35,19 @@ if sys.version_info[0] > 2:
     unicode = str
     string_types = (str,)
     import csv
+    izip = zip
 else:
     string_types = (basestring,)
+    from itertools import izip
     import backports.csv as csv
+# Removing more than this fraction of the media compacts all the columns at
+# once, see `Project.remove`.
+BULK_REMOVE_FRACTION = 0.1
+
+# Number of new media appended to the columns at a time by
+# `Project.update_many`.
+INSERT_BATCH_SIZE = 10000
+
 INT = fields.NUMERIC(numtype=int)
 FLOAT = fields.NUMERIC(numtype=float)
 
@@ -38,6 +57,15 @@ def get_file_saved_time(path):
     return dt.ctime()
 
 
+def _walk_files(directory):
+    """Yield all the files in the directory tree."""
+    for f in directory.files:
+        yield f
+    for d in directory.directories:
+        for f in _walk_files(d):
+            yield f
+
+
 def _get_sample(fname):
     sample = ''
     with io.open(fname, 'r', newline='', encoding='utf-8') as fp:
@@ -92,6 +120,12 @@ def get_non_existing_filename(fname):
         return fname
 
 
+# Tag types which are searched as text.
+TEXT_TYPES = ('string', 'text')
+
+# Tag types which are searched using numeric ranges.
+NUMERIC_TYPES = ('int', 'float')
+
 COMMON_TAGS = dict(
     file_name='string', path='string', relpath='string',
     ctime='string', mtime='string', size='int', type='string'
@@ -112,84 +146,6 @@ def _cleanup_query(q, tag_types):
             term.words = [x.lower() for x in term.words]
 
 
-def _check_value(value, expr):
-    if isinstance(expr, string_types):
-        return expr in value.lower()
-    else:
-        return expr == value
-
-
-def _check_range(x, term):
-    result = True
-    if term.start is not None:
-        if term.startexcl:
-            result &= x > term.start
-        else:
-            result &= x >= term.start
-    if term.end is not None and result:
-        if term.endexcl:
-            result &= x < term.end
-        else:
-            result &= x <= term.end
-    return result
-
-
-def _check_date_range(x, term):
-    result = True
-    if term.startdate is not None:
-        result &= x >= term.start
-    if term.enddate is not None and result:
-        result &= x <= term.end
-    return result
-
-
-def _search_media(expr, m_key, get_tag):
-    """Given search expression, index to media, and a getter to get the attribute
-    check if the media matches expression.
-    """
-    if expr.is_leaf():
-        if isinstance(expr, query.Term):
-            attr = expr.fieldname
-            return _check_value(get_tag(m_key, attr), expr.text)
-        elif isinstance(expr, query.Phrase):
-            attr = expr.fieldname
-            text = " ".join(expr.words)
-            return _check_value(get_tag(m_key, attr), text)
-        elif isinstance(expr, query.DateRange):
-            if expr.fieldname == 'ctime':
-                value = get_tag(m_key, 'ctime_')
-            elif expr.fieldname == 'mtime':
-                value = get_tag(m_key, 'mtime_')
-            return _check_date_range(value, expr)
-        elif isinstance(expr, query.NumericRange):
-            attr = expr.fieldname
-            return _check_range(get_tag(m_key, attr), expr)
-        else:
-            print("Unsupported term: %r" % expr)
-            return False
-    else:
-        if isinstance(expr, query.And):
-            result = True
-            for child in expr.children():
-                result &= _search_media(child, m_key, get_tag)
-                if not result:
-                    break
-            return result
-        elif isinstance(expr, query.Or):
-            result = False
-            for child in expr.children():
-                result |= _search_media(child, m_key, get_tag)
-                if result:
-                    break
-            return result
-        elif isinstance(expr, query.Not):
-            subquery = list(expr.children())[0]
-            return not _search_media(subquery, m_key, get_tag)
-        else:
-            print("Unsupported term: %r" % expr)
-            return False
-
-
 class Project(HasTraits):
     name = Str
     description = Str
@@ -197,7 +153,24 @@ class Project(HasTraits):
     root = Instance(Directory)
     tags = List(TagInfo)
 
-    _media = Dict(Str, Media)
+    # The latest `Media` returned by `get`, at most `media_cache_size` of
+    # them, oldest first.
+    _media = Instance(OrderedDict, ())
+
+    # All the `Media` returned by `get` which are still in use, including the
+    # ones no longer in `_media`, so they are kept in step with the project.
+    _live_media = Instance(WeakValueDictionary, ())
+
+    # Number of `Media` instances kept, see `get`.
+    media_cache_size = Int(1000)
+
+    # Guards `_media` and `_live_media` which are used by the processing
+    # threads too.
+    _lock = Any
+
+    # Fired once by `set_tags` with a dict of the names of the tags set and
+    # the relpaths of the media changed.
+    tags_updated = Event
 
     extensions = List(Str)
 
@@ -205,19 +178,56 @@ class Project(HasTraits):
 
     number_of_files = Long
 
+    # Keep an index of the text fields to speed up searching large projects.
+    index_text = Bool(False)
+
     # Path where the project data is saved.
     save_file = Str
 
+    # Path of the journal of changes which is stored next to the save file.
+    journal_file = Property(Str, depends_on='save_file')
+
+    # Path of the ledger of the processing jobs which is stored next to the
+    # save file, see `processor.JobLedger`.  It is cleared when the project
+    # is saved as the results of the jobs are then saved too.
+    ledger_file = Property(Str, depends_on='save_file')
+
+    # Save the changes to the media and tags by appending them to the journal
+    # instead of rewriting the whole save file each time.
+    journal = Bool(False)
+
+    # Number of changes in the journal after which it is compacted into the
+    # save file.
+    journal_limit = Int(10000)
+
+    # Watch the project directory for changes and update the media while the
+    # project is being viewed.
+    watch = Bool(False)
+
     last_save_time = Str
 
     _data = Dict
 
     _tag_data = Dict
 
-    _relpath2index = Dict()
+    # Not a Dict trait as validating and copying it is slow for many files.
+    _relpath2index = Instance(dict, ())
 
     _query_parser = Instance(qparser.QueryParser)
 
+    _text_index = Instance(TextIndex)
+
+    _range_index = Instance(RangeIndex)
+
+    # Changes to be appended to the journal on the next save.
+    _changes = Instance(list, ())
+
+    # Number of changes already in the journal.
+    _journal_size = Int
+
+    # Set when something that is not recorded in the journal has changed.
+    _needs_full_save = Bool(True)
+
     def add_tags(self, tags):
         tags = list(self.tags) + tags
         self.update_tags(tags)
@@ -238,12 +248,19 @@ class Project(HasTraits):
             if tag.name not in new_tag_names:
                 removed.append(tag)
 
+        text_index = self._text_index
         for tag in removed:
             del self._tag_data[tag.name]
+            if text_index is not None:
+                text_index.remove_field(tag.name)
 
         n_entries = len(self._relpath2index)
         for tag in added:
-            self._tag_data[tag.name] = [tag.default]*n_entries
+            self._tag_data[tag.name] = columns.make_column(
+                tag.type, [tag.default]*n_entries
+            )
+            if text_index is not None and tag.type in TEXT_TYPES:
+                text_index.add_field(tag.name, self._tag_data[tag.name])
 
         # The above can be the first time when self._tag_data is accessed, when
         # creating a new project for example. In this case,
@@ -251,9 +268,10 @@ class Project(HasTraits):
         # removed tags will not exist in _tag_data causing an error. So we only
         # set self.tags below.
         self.tags = new_tags
+        self._reset_range_index()
 
-        # Update the cached media
-        for m in self._media.values():
+        # Update the media in use.
+        for relpath, m in self._get_live_media():
             for tag in removed:
                 del m.tags[tag.name]
             for tag in added:
@@ -270,7 +288,8 @@ class Project(HasTraits):
         """
         name = self.name + ' copy'
         p = Project(name=name)
-        traits = ['description', 'extensions', 'path', 'processors', 'tags']
+        traits = ['description', 'extensions', 'path', 'processors', 'tags',
+                  'index_text', 'journal', 'journal_limit', 'watch']
         p.copy_traits(self, traits, copy='deep')
         # Clear out the _done information from the processors
         for proc in p.processors:
@@ -289,6 +308,8 @@ class Project(HasTraits):
         tags: dict
         """
         relpath = media_data.relpath
+        self._range_index.invalidate()
+        self._record_change('update', list(media_data), tags or {})
         if not self.has_media(relpath):
             index = len(self._relpath2index)
             self._relpath2index[relpath] = index
@@ -298,41 +319,104 @@ class Project(HasTraits):
                 self._tag_data[tag.name].append(tag.default)
 
         index = self._relpath2index[relpath]
+        text_index = self._text_index
+        if text_index is not None:
+            self._unindex_record(index)
         for i, key in enumerate(MediaData._fields):
             self._data[key][index] = media_data[i]
         if tags:
             for key, value in tags.items():
                 self._tag_data[key][index] = value
-        media = self._media.get(relpath)
+        if text_index is not None:
+            self._index_record(index)
+        media = self._live_media.get(relpath)
         if media is not None:
             media.update(media_data, tags)
 
+    def update_many(self, media_data):
+        """Create/update the internal data for many media at once.
+
+        The new media are appended to each column in batches of
+        `INSERT_BATCH_SIZE` instead of one field at a time as `update` does,
+        the others are updated with `update`.
+
+        Parameters
+        ----------
+
+        media_data: iterable of MediaData instances.
+        """
+        relpath2index = self._relpath2index
+        batch = []
+        # The relpaths in the batch and their position in it.
+        pending = {}
+        for data in media_data:
+            relpath = data.relpath
+            if relpath in relpath2index:
+                self.update(data)
+            elif relpath in pending:
+                batch[pending[relpath]] = data
+            else:
+                pending[relpath] = len(batch)
+                batch.append(data)
+                if len(batch) == INSERT_BATCH_SIZE:
+                    self._append_records(batch)
+                    batch = []
+                    pending.clear()
+        if len(batch) > 0:
+            self._append_records(batch)
+
     def get(self, relpath):
         """Given the relative path of some media, return a Media instance.
-        """
-        if relpath in self._media:
-            return self._media[relpath]
-        else:
-            data = {}
-            index = self._relpath2index[relpath]
-            for key in MediaData._fields:
-                data[key] = self._data[key][index]
-            tags = {}
-            for key in self._tag_data:
-                tags[key] = self._tag_data[key][index]
 
-            media = Media.from_data(MediaData(**data), tags)
-            media.on_trait_change(self._media_tag_handler, 'tags_items')
+        Changes to the tags of the media are saved in the project right away.
+        The latest `media_cache_size` media are kept, and so are the others
+        which are still in use, so asking for them again returns the same
+        instance.  Use `view` to only read the media.
+        """
+        with self._lock:
+            media = self._media.pop(relpath, None)
+            if media is None:
+                media = self._live_media.get(relpath)
+            if media is None:
+                index = self._relpath2index[relpath]
+                data = MediaData(
+                    *[self._data[key][index] for key in MediaData._fields]
+                )
+                media = Media.from_data(data, self._get_tags(relpath))
+                media.on_trait_change(self._media_tag_handler, 'tags_items')
+                self._live_media[relpath] = media
             self._media[relpath] = media
-            return media
+            while len(self._media) > max(self.media_cache_size, 1):
+                self._media.popitem(last=False)
+        return media
+
+    def view(self, relpath):
+        """Given the relative path of some media, return a read-only
+        `MediaView` of it.  This is much cheaper than `get`.
+        """
+        if not self.has_media(relpath):
+            raise KeyError(relpath)
+        return MediaView(self, relpath)
 
     def remove(self, relpaths):
         """Given a list of relative path of some media, remove them from the
         database.
+
+        A few media are removed by moving the last records into their place.
+        When many are removed, the remaining records are instead compacted in
+        a single pass over each column, keeping their order.
         """
+        relpaths = list(relpaths)
         relpath2index = self._relpath2index
-        indices = [(x, relpath2index[x]) for x in relpaths]
-        for relpath, index in sorted(indices, reverse=True):
+        self._range_index.invalidate()
+        self._record_change('remove', relpaths)
+        indices = sorted(set(relpath2index[x] for x in relpaths), reverse=True)
+        if len(indices) > BULK_REMOVE_FRACTION*len(relpath2index):
+            self._compact(indices)
+            return
+        relpath_column = self._data['relpath']
+        for index in indices:
+            relpath = relpath_column[index]
             last = len(relpath2index) - 1
             if index == last:
                 self._delete_record(last, relpath)
@@ -340,6 +424,52 @@ class Project(HasTraits):
                 self._replace_with_last_record(index, last)
                 self._delete_record(last, relpath)
 
+    def set_tags(self, tags, where=None):
+        """Set the tags of many media at once.
+
+        The tag columns are written directly, without going through the
+        `Media` of each file, and `tags_updated` is fired once.
+
+        Parameters
+        ----------
+
+        tags: dict: maps the tag names to either the value to set for all the
+            selected media or a dict of the values by relpath.
+        where: the media to update: a search query, a sequence of relpaths
+            or of the (filename, relpath) search results, or a sequence of
+            booleans, one for each media in the order of the rows written by
+            `export_csv`.  All the media are selected if not given.
+
+        Returns the number of media changed.
+        """
+        unknown = [tag for tag in tags if tag not in self._tag_data]
+        if len(unknown) > 0:
+            raise ValueError('Unknown tags: %s' % ', '.join(sorted(unknown)))
+        indices = self._select(where)
+        relpaths = self._data['relpath']
+        changed = set()
+        for tag, value in tags.items():
+            if isinstance(value, dict):
+                items = [(i, value[relpaths[i]]) for i in indices
+                         if relpaths[i] in value]
+            else:
+                items = [(i, value) for i in indices]
+            self._set_tag_values(tag, items)
+            changed.update(i for i, v in items)
+
+        # Update the media in use, the values are already in the columns.
+        for relpath, media in self._get_live_media():
+            index = self._relpath2index.get(relpath)
+            if index in changed:
+                media.tags.update(dict(
+                    (tag, self._tag_data[tag][index]) for tag in tags
+                ))
+
+        self.tags_updated = dict(
+            tags=list(tags), relpaths=[relpaths[i] for i in sorted(changed)]
+        )
+        return len(changed)
+
     def has_media(self, relpath):
         """Returns True if the media data is available.
         """
@@ -349,13 +479,15 @@ class Project(HasTraits):
         """Return all the keys for the media relative paths."""
         return self._relpath2index.keys()
 
-    def _get_media_attr(self, index, attr):
-        """Given an index to the media, return its value.
+    def _get_column(self, attr):
+        """Given the name of a field, return the column of its values.
         """
         if attr in self._data:
-            return self._data[attr][index]
+            return self._data[attr]
         elif attr in self._tag_data:
-            return self._tag_data[attr][index]
+            return self._tag_data[attr]
+        else:
+            return [None]*len(self._relpath2index)
 
     # ####  End of CRUD interface to the data ####
 
@@ -399,15 +531,12 @@ class Project(HasTraits):
             # Write the header.
             writer = csv.writer(of)
             writer.writerow(cols)
-            for i in range(len(self._relpath2index)):
-                line = []
-                for col in cols:
-                    if col in data_cols:
-                        elem = self._data[col][i]
-                    else:
-                        elem = self._tag_data[col][i]
-                    line.append(elem)
-                writer.writerow(line)
+            # Write whole columns at a time.
+            values = [
+                self._data[col] if col in data_cols else self._tag_data[col]
+                for col in cols
+            ]
+            writer.writerows(izip(*values))
 
     def import_csv(self, fname):
         """Read tag information from given CSV filename.
@@ -443,6 +572,8 @@ class Project(HasTraits):
 
         count = 0
         total = 0
+        values = dict((tag.name, {}) for tag in tags)
+        found = []
         with io.open(fname, 'r', newline='', encoding='utf-8') as fp:
             reader = csv.reader(fp, dialect)
             next(reader)  # Skip header
@@ -450,20 +581,17 @@ class Project(HasTraits):
                 total += 1
                 path = record[path_idx]
                 rpath = relpath(path, self.path)
-                index = self._relpath2index.get(rpath, None)
-                media = self._media.get(rpath)
-                if index is not None:
+                if self.has_media(rpath):
                     count += 1
+                    found.append(rpath)
                     for tag, header_index in tags.items():
                         data = record[header_index]
                         try:
                             value = type_map[tag.type](data)
-                            if media is not None:
-                                media.tags[tag.name] = value
-                            else:
-                                self._tag_data[tag.name][index] = value
+                            values[tag.name][rpath] = value
                         except ValueError:
                             pass
+        self.set_tags(values, found)
 
         msg = "Read tags for %d paths out of %d entries." % (count, total)
         if count == 0 and total > 0:
@@ -477,7 +605,11 @@ class Project(HasTraits):
 
     def load(self, fp=None):
         """Load media info from opened file object.
+
+        If no file is given, the project is loaded from the save file and any
+        changes in the journal are applied.
         """
+        replay_journal = fp is None
         if fp is None:
             if not exists(self.save_file):
                 return
@@ -485,9 +617,12 @@ class Project(HasTraits):
         else:
             fp = open_file(fp, 'rb')
 
-        data = json_tricks.load(
-            fp, preserve_order=False, ignore_comments=False
-        )
+        if storage.is_columnar(fp):
+            data = storage.load(fp, tag_arrays=True)
+        else:
+            data = json_tricks.load(
+                fp, preserve_order=False, ignore_comments=False
+            )
         fp.close()
         self.name = data.get('name', '')
         self.description = data.get('description', '')
@@ -500,19 +635,60 @@ class Project(HasTraits):
             self._read_version1_media(data['media'])
         else:
             self._data = data['media_data']
-            self._tag_data = data['tag_data']
+            self._tag_data = self._make_tag_columns(data['tag_data'])
             self._relpath2index = data['relpath2index']
+        self._reset_range_index()
+        self.index_text = data.get('index_text', False)
+        if self.index_text and 'text_index' in data:
+            text_index = TextIndex()
+            text_index.__setstate__(data['text_index'])
+            self._text_index = text_index
+        self.journal = data.get('journal', False)
+        self.journal_limit = data.get('journal_limit', 10000)
+        self.watch = data.get('watch', False)
         root = Directory()
         root.__setstate__(data.get('root'))
         self.extensions = root.extensions
         self.root = root
+        if replay_journal:
+            changes = storage.Journal(self.journal_file).read()
+            self._replay_changes(changes)
+            self._journal_size = len(changes)
+            self._needs_full_save = False
+        del self._changes[:]
         self.number_of_files = len(self._relpath2index)
 
     def save(self):
-        """Save current media info to a file object
+        """Save current media info to a file object.
+
+        In journal mode, the changes made since the last save are appended to
+        the journal when possible.  The journal is compacted into the save
+        file when it becomes too large or if anything that is not recorded in
+        the journal has changed.
+        """
+        if len(self.save_file) > 0:
+            if self._can_append_to_journal():
+                storage.Journal(self.journal_file).append(self._changes)
+                self._journal_size += len(self._changes)
+                del self._changes[:]
+                logger.info('Saved changes to journal: %s', self.name)
+                storage.Journal(self.ledger_file).clear()
+                self._update_last_save_time()
+            else:
+                self.compact()
+        else:
+            raise IOError("No valid save file set.")
+
+    def compact(self):
+        """Save the whole project to the save file and clear the journal.
         """
         if len(self.save_file) > 0:
             self.save_as(self.save_file)
+            storage.Journal(self.journal_file).clear()
+            storage.Journal(self.ledger_file).clear()
+            self._journal_size = 0
+            del self._changes[:]
+            self._needs_full_save = False
             self._update_last_save_time()
         else:
             raise IOError("No valid save file set.")
@@ -521,17 +697,7 @@ class Project(HasTraits):
         """Save copy to specified path.
         """
         fp = open_file(fp, 'wb')
-        tags = [(t.name, t.type) for t in self.tags]
-        root = self.root.__getstate__()
-        processors = [processor.dump(x) for x in self.processors]
-        data = dict(
-            version=2, path=self.path, name=self.name,
-            description=self.description, tags=tags,
-            media_data=self._data, tag_data=self._tag_data,
-            relpath2index=self._relpath2index,
-            root=root, processors=processors
-        )
-        json_tricks.dump(data, fp, compression=True)
+        storage.dump(self._get_save_data(), fp)
         fp.close()
         logger.info('Saved project: %s', self.name)
 
@@ -544,18 +710,23 @@ class Project(HasTraits):
         def _scan(dir):
             for f in dir.files:
                 if not self.has_media(f.relpath) or refresh:
-                    data = get_media_data(f.path, f.relpath)
-                    self.update(data)
+                    data = get_media_data(f.path, f.relpath, f.stat)
+                    if data is not None:
+                        yield data
+                # The stat result is not needed anymore.
+                f.stat = None
+            # Refreshing the root above lists the whole tree again.
             for d in dir.directories:
-                if refresh:
-                    d.refresh()
-                _scan(d)
+                for data in _scan(d):
+                    yield data
 
         if refresh:
             self.root.refresh()
-        _scan(self.root)
+        self.update_many(_scan(self.root))
 
         self.number_of_files = len(self._relpath2index)
+        # The directory tree is not recorded in the journal.
+        self._needs_full_save = True
 
     def search(self, q):
         """A generator which yields the (filename, relpath) for each file
@@ -568,16 +739,156 @@ class Project(HasTraits):
             logger.warn("Invalid search expression: %s", q)
             print("Invalid search expression: %s" % q)
             return
+        relpaths = self._data['relpath']
+        for index in self._search_indices(parsed_q):
+            key = relpaths[index]
+            yield basename(key), key
+
+    def _search_indices(self, parsed_q):
+        """Return the sorted indices of the media matching the parsed query.
+        """
         tag_types = self._get_tag_types()
         _cleanup_query(parsed_q, tag_types)
-        for key, index in self._relpath2index.items():
-            if _search_media(parsed_q, index, self._get_media_attr):
-                yield basename(key), key
+        plan = compile_query(parsed_q)
+        matches = plan(
+            self._get_column, len(self._relpath2index),
+            self._get_text_index(), self._range_index
+        )
+        return sorted(matches)
+
+    def _select(self, where):
+        """Return the indices of the media selected by `where`, see
+        `set_tags`.
+        """
+        n = len(self._relpath2index)
+        if where is None:
+            return range(n)
+        elif isinstance(where, string_types):
+            return self._search_indices(self._query_parser.parse(where))
+        where = list(where)
+        if len(where) > 0 and isinstance(where[0], bool):
+            if len(where) != n:
+                raise ValueError(
+                    'Mask has %d entries for %d media' % (len(where), n)
+                )
+            return [i for i, selected in enumerate(where) if selected]
+        relpath2index = self._relpath2index
+        indices = []
+        for item in where:
+            if isinstance(item, tuple):
+                item = item[1]
+            index = relpath2index.get(item)
+            if index is not None:
+                indices.append(index)
+        return indices
 
     def refresh(self):
+        """Rescan the project directory and update the media.
+
+        Only the directories which changed since they were last listed are
+        listed again and only the media whose size or modification time
+        changed are updated.  Returns a dictionary with the number of
+        'added', 'removed' and 'modified' files.
+        """
         logger.info('Refreshing project: %s', self.name)
-        self.clean()
-        self.scan(refresh=True)
+        self._setup_root()
+        self.root.rescan()
+
+        seen = set()
+        counts = dict(added=0, modified=0)
+        for f in _walk_files(self.root):
+            st, f.stat = f.stat, None
+            if st is not None:
+                seen.add(f.relpath)
+                self._update_file(f, st, counts)
+        removed = [x for x in self._relpath2index if x not in seen]
+        self.remove(removed)
+
+        self.number_of_files = len(self._relpath2index)
+        self._needs_full_save = True
+        counts['removed'] = len(removed)
+        logger.info('Refreshed project %s: %s', self.name, counts)
+        return counts
+
+    def update_paths(self, relpaths):
+        """Update the media and the directory tree for the given paths
+        (relative to the project root) which were created, removed or
+        modified.
+
+        Returns a dictionary with the number of 'added', 'removed' and
+        'modified' files.
+        """
+        self._setup_root()
+        root = self.root
+        counts = dict(added=0, modified=0)
+        to_remove = []
+        # Maps the relpath of each directory seen to the directory and a
+        # mapping of its file names to files, the files are updated at the
+        # end.
+        listings = {}
+        # Handle the parents first so new directories are in the tree before
+        # their contents.
+        for path in sorted(set(relpaths), key=lambda x: x.count(os.sep)):
+            parent = root.find(dirname(path))
+            if parent is None:
+                continue
+            listing = listings.get(parent.relpath)
+            if listing is None:
+                files = dict((f.name, f) for f in parent.files)
+                listing = listings[parent.relpath] = (parent, files)
+            files = listing[1]
+            name = basename(path)
+            full_path = join(parent.path, name)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                st = None
+            is_dir = st is not None and stat.S_ISDIR(st.st_mode)
+            is_file = (st is not None and stat.S_ISREG(st.st_mode) and
+                       parent._accept(name))
+
+            subdir = parent.find(name)
+            if subdir is not None and not is_dir:
+                parent.directories.remove(subdir)
+                to_remove.extend(f.relpath for f in _walk_files(subdir))
+            f = files.get(name)
+            if f is not None and not is_file:
+                del files[name]
+                to_remove.append(f.relpath)
+
+            if is_dir and subdir is None:
+                d = Directory(
+                    extensions=parent.extensions, parent=parent, name=name,
+                    relpath=join(parent.relpath, name)
+                )
+                # This lists the whole tree.
+                d.path = full_path
+                parent.directories.append(d)
+                for f in _walk_files(d):
+                    st, f.stat = f.stat, None
+                    if st is not None:
+                        self._update_file(f, st, counts)
+            elif is_file:
+                if f is None:
+                    f = files[name] = File(
+                        path=full_path, parent=parent, name=name
+                    )
+                self._update_file(f, st, counts)
+
+        for parent, files in listings.values():
+            old = set(id(f) for f in parent.files)
+            kept = [f for f in parent.files if files.get(f.name) is f]
+            new = [f for f in files.values() if id(f) not in old]
+            if len(new) > 0 or len(kept) < len(old):
+                parent.files = kept + new
+
+        removed = [x for x in to_remove if self.has_media(x)]
+        self.remove(removed)
+        self.number_of_files = len(self._relpath2index)
+        self._needs_full_save = True
+        counts['removed'] = len(removed)
+        logger.info('Updated paths in project %s: %s', self.name, counts)
+        return counts
 
     # #### Private protocol ################################################
 
@@ -598,24 +909,100 @@ class Project(HasTraits):
         else:
             return ''
 
+    def _update_file(self, f, st, counts):
+        """Update the media for the file given its stat result if it is new
+        or has changed, updating the 'added' or 'modified' counts.
+        """
+        index = self._relpath2index.get(f.relpath)
+        if index is None:
+            counts['added'] += 1
+        elif (self._data['size'][index] != st.st_size or
+              self._data['mtime_'][index] != get_mtime_long(st)):
+            counts['modified'] += 1
+        else:
+            return
+        self.update(get_media_data(f.path, f.relpath, st))
+
     def _update_last_save_time(self):
-        self.last_save_time = get_file_saved_time(self.save_file)
+        self.last_save_time = self._last_save_time_default()
 
     def _last_save_time_default(self):
-        if exists(self.save_file):
+        if exists(self.journal_file):
+            return get_file_saved_time(self.journal_file)
+        elif exists(self.save_file):
             return get_file_saved_time(self.save_file)
         else:
             return ''
 
+    def _get_journal_file(self):
+        if len(self.save_file) > 0:
+            return self.save_file + '.journal'
+        else:
+            return ''
+
+    def _get_ledger_file(self):
+        if len(self.save_file) > 0:
+            return self.save_file + '.jobs'
+        else:
+            return ''
+
+    def _can_append_to_journal(self):
+        return (self.journal and not self._needs_full_save and
+                exists(self.save_file) and
+                self._journal_size + len(self._changes) <= self.journal_limit)
+
+    def _record_change(self, *change):
+        if self.journal:
+            self._changes.append(list(change))
+
+    def _replay_changes(self, changes):
+        for change in changes:
+            kind = change[0]
+            if kind == 'tag':
+                relpath, tag, value = change[1:]
+                index = self._relpath2index.get(relpath)
+                if index is not None and tag in self._tag_data:
+                    self._set_tag(index, tag, value)
+            elif kind == 'tags':
+                tag, relpaths, values = change[1:]
+                if tag in self._tag_data:
+                    relpath2index = self._relpath2index
+                    items = [
+                        (relpath2index[x], value)
+                        for x, value in zip(relpaths, values)
+                        if x in relpath2index
+                    ]
+                    self._set_tag_values(tag, items)
+            elif kind == 'update':
+                self.update(MediaData(*change[1]), change[2])
+            elif kind == 'remove':
+                self.remove([x for x in change[1] if self.has_media(x)])
+
+    @on_trait_change('name, description, path, extensions, extensions_items, '
+                     'tags, tags_items, processors, processors_items, '
+                     'processors:_done_items, index_text, journal, watch')
+    def _settings_changed(self):
+        self._needs_full_save = True
+
     def _name_changed(self, name):
         if len(name) > 0:
             old_save_file = self.save_file
             old_dir = dirname(old_save_file)
             new_save_file = join(old_dir, sanitize_name(name) + '.vxn')
             if new_save_file != old_save_file:
+                old_journal = self.journal_file
+                old_ledger = self.ledger_file
                 self.save_file = new_save_file
                 if exists(old_save_file):
                     shutil.move(old_save_file, self.save_file)
+                if exists(old_journal):
+                    shutil.move(old_journal, self.journal_file)
+                if exists(old_ledger):
+                    shutil.move(old_ledger, self.ledger_file)
+
+    def _index_text_changed(self, value):
+        if not value:
+            self._text_index = None
 
     def _extensions_changed(self, ext):
         if self.root is not None:
@@ -652,6 +1039,12 @@ class Project(HasTraits):
         qp.add_plugin(DateParserPlugin())
         return qp
 
+    def __lock_default(self):
+        return Lock()
+
+    def __range_index_default(self):
+        return RangeIndex(self._get_column, self._get_range_fields())
+
     def __query_parser_default(self):
         return self._make_query_parser()
 
@@ -664,13 +1057,121 @@ class Project(HasTraits):
     def __tag_data_default(self):
         tags = {}
         for key in self.tags:
-            tags[key.name] = []
+            tags[key.name] = columns.make_column(key.type)
         return tags
 
+    def _make_tag_columns(self, tag_data):
+        """Return the given columns of the tags as typed columns, see
+        `columns.make_column`.
+        """
+        types = dict((tag.name, tag.type) for tag in self.tags)
+        return dict(
+            (key, columns.make_column(types.get(key), values))
+            for key, values in tag_data.items()
+        )
+
     def _media_tag_handler(self, obj, tname, old, new):
-        index = self._relpath2index[obj.relpath]
+        # The media may be removed while still used elsewhere.
+        index = self._relpath2index.get(obj.relpath)
+        if index is None:
+            return
         for tag in new.changed:
-            self._tag_data[tag][index] = obj.tags[tag]
+            if tag not in self._tag_data:
+                # The tag was removed from the project.
+                continue
+            value = obj.tags[tag]
+            # Values set by `set_tags` are already saved.
+            if self._tag_data[tag][index] != value:
+                self._set_tag(index, tag, value)
+
+    def _get_live_media(self):
+        """Return a list of (relpath, media) of the `Media` in use."""
+        with self._lock:
+            return list(self._live_media.items())
+
+    def _get_value(self, relpath, key):
+        index = self._relpath2index[relpath]
+        if key in self._data:
+            return self._data[key][index]
+        else:
+            return self._tag_data[key][index]
+
+    def _get_tags(self, relpath):
+        index = self._relpath2index[relpath]
+        return dict(
+            (key, column[index]) for key, column in self._tag_data.items()
+        )
+
+    def _set_tag(self, index, tag, value):
+        column = self._tag_data[tag]
+        text_index = self._text_index
+        if text_index is not None and tag in text_index:
+            text_index.discard(tag, index, column[index])
+            text_index.add(tag, index, value)
+        column[index] = value
+        self._range_index.invalidate(tag)
+        self._record_change('tag', self._data['relpath'][index], tag, value)
+
+    def _set_tag_values(self, tag, items):
+        """Set the tag to the value for each (index, value) in items and
+        record them as a single change.
+        """
+        column = self._tag_data[tag]
+        text_index = self._text_index
+        if text_index is not None and tag not in text_index:
+            text_index = None
+        relpaths = self._data['relpath']
+        for index, value in items:
+            if text_index is not None:
+                text_index.discard(tag, index, column[index])
+                text_index.add(tag, index, value)
+            column[index] = value
+        self._range_index.invalidate(tag)
+        if len(items) > 0:
+            self._record_change(
+                'tags', tag, [relpaths[i] for i, v in items],
+                [v for i, v in items]
+            )
+
+    def _get_text_index(self):
+        """Return the text index, building it if needed.
+
+        Returns None if the text fields are not to be indexed.
+        """
+        if self.index_text and self._text_index is None:
+            text_index = TextIndex()
+            for key in self._get_text_fields():
+                text_index.add_field(key, self._get_column(key))
+            self._text_index = text_index
+        return self._text_index
+
+    def _reset_range_index(self):
+        self._range_index.fields = set(self._get_range_fields())
+        self._range_index.invalidate()
+
+    def _get_range_fields(self):
+        fields = ['size', 'ctime_', 'mtime_']
+        fields.extend(t.name for t in self.tags if t.type in NUMERIC_TYPES)
+        return fields
+
+    def _get_text_fields(self):
+        fields = ['file_name', 'path', 'type']
+        fields.extend(t.name for t in self.tags if t.type in TEXT_TYPES)
+        return fields
+
+    def _index_record(self, index):
+        text_index = self._text_index
+        for key in text_index.fields():
+            value = self._get_column(key)[index]
+            if value is not None:
+                text_index.add(key, index, value)
+
+    def _unindex_record(self, index):
+        text_index = self._text_index
+        for key in text_index.fields():
+            value = self._get_column(key)[index]
+            if value is not None:
+                text_index.discard(key, index, value)
 
     def _read_version1_media(self, media):
         data = self.__data_default()
@@ -695,28 +1196,118 @@ class Project(HasTraits):
         data['mtime_'] = [datetime_to_long(x) for x in data['mtime_']]
         data['ctime_'] = [datetime_to_long(x) for x in data['ctime_']]
         self._data = data
-        self._tag_data = tag_data
+        self._tag_data = self._make_tag_columns(tag_data)
         self._relpath2index = relpath2index
 
     def _delete_record(self, index, relpath):
+        if self._text_index is not None:
+            self._unindex_record(index)
         for key in MediaData._fields:
             del self._data[key][index]
         for key in self._tag_data:
             del self._tag_data[key][index]
-        if relpath in self._media:
-            del self._media[relpath]
+        with self._lock:
+            self._media.pop(relpath, None)
+            self._live_media.pop(relpath, None)
         del self._relpath2index[relpath]
 
+    def _append_records(self, batch):
+        """Append the given new media to the columns.
+        """
+        self._range_index.invalidate()
+        if self.journal:
+            self._changes.extend(['update', list(x), {}] for x in batch)
+        start = len(self._relpath2index)
+        for key, values in zip(MediaData._fields, zip(*batch)):
+            self._data[key].extend(values)
+        n = len(batch)
+        for tag in self.tags:
+            self._tag_data[tag.name].extend([tag.default]*n)
+        indices = range(start, start + n)
+        self._relpath2index.update(zip(self._data['relpath'][start:], indices))
+        text_index = self._text_index
+        if text_index is not None:
+            for field in text_index.fields():
+                column = self._get_column(field)
+                text_index.add_many(field, start, column[start:])
+
+    def _compact(self, indices):
+        """Remove the records at the given indices and renumber the others
+        in the mapping from the relpaths and in the text index.
+        """
+        removed = set(indices)
+        relpath_column = self._data['relpath']
+        with self._lock:
+            for index in removed:
+                self._media.pop(relpath_column[index], None)
+                self._live_media.pop(relpath_column[index], None)
+        keep = [i for i in range(len(relpath_column)) if i not in removed]
+        text_index = self._text_index
+        if text_index is not None:
+            new_indices = [-1]*len(relpath_column)
+            for new, old in enumerate(keep):
+                new_indices[old] = new
+            text_index.renumber(new_indices)
+        for group in (self._data, self._tag_data):
+            for column in group.values():
+                column[:] = list(map(column.__getitem__, keep))
+        relpath2index = self._relpath2index
+        relpath2index.clear()
+        relpath2index.update(zip(relpath_column, range(len(keep))))
+
     def _replace_with_last_record(self, index, last):
         _data = self._data
         _tag_data = self._tag_data
+        text_index = self._text_index
+        if text_index is not None:
+            self._unindex_record(index)
         for key in MediaData._fields:
             _data[key][index] = _data[key][last]
         for key in self._tag_data:
             _tag_data[key][index] = _tag_data[key][last]
+        if text_index is not None:
+            self._index_record(index)
         last_relpath = _data['relpath'][last]
         self._relpath2index[last_relpath] = index
 
+    def _get_save_data(self):
+        tags = [(t.name, t.type) for t in self.tags]
+        root = self.root.__getstate__()
+        processors = [processor.dump(x) for x in self.processors]
+        tag_data = dict(
+            (key, columns.pack(column))
+            for key, column in self._tag_data.items()
+        )
+        data = dict(
+            version=3, path=self.path, name=self.name,
+            description=self.description, tags=tags,
+            media_data=self._data, tag_data=tag_data,
+            root=root, processors=processors, index_text=self.index_text,
+            journal=self.journal, journal_limit=self.journal_limit,
+            watch=self.watch
+        )
+        if self._text_index is not None:
+            data['text_index'] = self._text_index.__getstate__()
+        return data
+
+    def _save_as_v2(self, fp):
+        """Save copy to specified path in the older json_tricks format.
+
+        This mainly exists for testing and making sure we still read the old
+        saved files.
+        """
+        fp = open_file(fp, 'wb')
+        data = self._get_save_data()
+        tag_data = dict(
+            (key, list(column)) for key, column in self._tag_data.items()
+        )
+        data.update(
+            version=2, relpath2index=self._relpath2index, tag_data=tag_data
+        )
+        json_tricks.dump(data, fp, compression=True)
+        fp.close()
+        logger.info('Saved project: %s', self.name)
+
     def _save_as_v1(self, fp):
         """Save copy to specified path.
 
@@ -733,7 +1324,8 @@ class Project(HasTraits):
             return state
 
         fp = open_file(fp, 'wb')
-        media = [(key, self.get(key).to_dict()) for key in self._relpath2index]
+        media = [(key, self.view(key).to_dict())
+                 for key in self._relpath2index]
         tags = [(t.name, t.type) for t in self.tags]
         root = _rewrite_dir(self.root.__getstate__())
         processors = [processor.dump(x) for x in self.processors]
@@ -0,0 +1,210 @@
+"""Compile parsed whoosh queries into plans that run over the project columns.
+
+A plan is compiled once per search and evaluated a column at a time instead
+of walking the query tree for every record.  Each leaf of the query produces
+the set of matching record indices, either by scanning the column or by
+looking it up in an index, and the boolean operators are evaluated using set
+operations.
+
+Try to keep this module simple: no non-standard library imports apart from
+whoosh.
+"""
+
+from functools import partial
+from itertools import compress, repeat
+import logging
+import operator
+import sys
+
+from whoosh import query
+
+
+logger = logging.getLogger(__name__)
+
+if sys.version_info[0] > 2:
+    string_types = (str,)
+    imap = map
+else:
+    string_types = (basestring,)  # noqa: F821
+    from itertools import imap
+
+
+# Fields that are searched using a different column than their name.
+DATE_COLUMNS = dict(ctime='ctime_', mtime='mtime_')
+
+
+def _select(mask, n):
+    """Return the set of indices where the iterable `mask` is true."""
+    return set(compress(range(n), mask))
+
+
+def _contains(text, column):
+    return imap(operator.contains, imap(_lower, column), repeat(text))
+
+
+def _lower(value):
+    return value.lower()
+
+
+def _value_mask(expr, column):
+    """Return an iterable of booleans for a term value check on a column.
+
+    This mirrors checking `expr in value.lower()` for strings and
+    `expr == value` for everything else.
+    """
+    if isinstance(expr, string_types):
+        return _contains(expr, column)
+    else:
+        return imap(operator.eq, repeat(expr), column)
+
+
+def _range_mask(column, start, end, startexcl=False, endexcl=False):
+    """Return an iterable of booleans checking if values in the column are
+    inside the given range.  Either of `start` or `end` may be None.
+    """
+    checks = []
+    if start is not None:
+        # Note that the value is the second argument of the partial.
+        op = operator.lt if startexcl else operator.le
+        checks.append(partial(op, start))
+    if end is not None:
+        op = operator.gt if endexcl else operator.ge
+        checks.append(partial(op, end))
+
+    if len(checks) == 0:
+        return repeat(True, len(column))
+    elif len(checks) == 1:
+        return imap(checks[0], column)
+    else:
+        return imap(operator.and_, imap(checks[0], column),
+                    imap(checks[1], column))
+
+
+def _match_value(attr, text, get_column, n, text_index):
+    if text_index is not None and isinstance(text, string_types):
+        result = text_index.lookup_text(attr, text)
+        if result is not None:
+            return result
+    return _select(_value_mask(text, get_column(attr)), n)
+
+
+def _match_range(attr, args, get_column, n, range_index):
+    if range_index is not None:
+        result = range_index.lookup_range(attr, *args)
+        if result is not None:
+            return result
+    return _select(_range_mask(get_column(attr), *args), n)
+
+
+def _compile_leaf(expr):
+    if isinstance(expr, query.Term):
+        attr, text = expr.fieldname, expr.text
+
+        def _term(get_column, n, text_index=None, range_index=None):
+            return _match_value(attr, text, get_column, n, text_index)
+        return _term
+
+    elif isinstance(expr, query.Phrase):
+        attr, text = expr.fieldname, " ".join(expr.words)
+
+        def _phrase(get_column, n, text_index=None, range_index=None):
+            return _match_value(attr, text, get_column, n, text_index)
+        return _phrase
+
+    elif isinstance(expr, query.DateRange):
+        attr = DATE_COLUMNS.get(expr.fieldname, expr.fieldname)
+        start = expr.start if expr.startdate is not None else None
+        end = expr.end if expr.enddate is not None else None
+
+        def _date_range(get_column, n, text_index=None, range_index=None):
+            return _match_range(
+                attr, (start, end), get_column, n, range_index
+            )
+        return _date_range
+
+    elif isinstance(expr, query.NumericRange):
+        attr = expr.fieldname
+        args = (expr.start, expr.end, expr.startexcl, expr.endexcl)
+
+        def _numeric_range(get_column, n, text_index=None, range_index=None):
+            return _match_range(attr, args, get_column, n, range_index)
+        return _numeric_range
+
+    else:
+        return _compile_unsupported(expr)
+
+
+def _compile_unsupported(expr):
+    logger.info("Unsupported term: %r", expr)
+
+    def _nothing(*args):
+        return set()
+    return _nothing
+
+
+def _compile_and(children):
+    # Negated children are subtracted from the result of the others so we do
+    # not have to build the complement of their results.
+    positive = [compile_query(c) for c in children
+                if not isinstance(c, query.Not)]
+    negative = [compile_query(list(c.children())[0]) for c in children
+                if isinstance(c, query.Not)]
+
+    def _and(get_column, n, *indexes):
+        if positive:
+            result = positive[0](get_column, n, *indexes)
+            for plan in positive[1:]:
+                if not result:
+                    return result
+                result &= plan(get_column, n, *indexes)
+        else:
+            result = set(range(n))
+        for plan in negative:
+            if not result:
+                break
+            result -= plan(get_column, n, *indexes)
+        return result
+    return _and
+
+
+def _compile_or(children):
+    plans = [compile_query(c) for c in children]
+
+    def _or(get_column, n, *indexes):
+        result = set()
+        for plan in plans:
+            result |= plan(get_column, n, *indexes)
+            if len(result) == n:
+                break
+        return result
+    return _or
+
+
+def _compile_not(child):
+    plan = compile_query(child)
+
+    def _not(get_column, n, *indexes):
+        return set(range(n)) - plan(get_column, n, *indexes)
+    return _not
+
+
+def compile_query(expr):
+    """Compile the given (cleaned up) whoosh query into a plan.
+
+    The plan is a function which is passed a function to get a column of
+    values given the field name and the number of records.  The plan returns
+    the set of indices of the records matching the query.  An optional
+    `vixen.index.TextIndex` and `vixen.index.RangeIndex` may also be passed to
+    the plan in which case they are used to look up the text terms and the
+    ranges respectively for the fields they index.
+    """
+    if expr.is_leaf():
+        return _compile_leaf(expr)
+    elif isinstance(expr, query.And):
+        return _compile_and(list(expr.children()))
+    elif isinstance(expr, query.Or):
+        return _compile_or(list(expr.children()))
+    elif isinstance(expr, query.Not):
+        return _compile_not(list(expr.children())[0])
+    else:
+        return _compile_unsupported(expr)
@@ -0,0 +1,371 @@
+"""Reading and writing the columnar (version 3) project file format and the
+journal of changes made since the project file was written.
+
+The file starts with a magic string and the length of a small JSON header.
+The header describes where the typed columns of the project data are stored
+in the rest of the file.  Integer, float and boolean columns are stored as
+compressed arrays, string columns are stored as a compressed pool of the
+distinct strings and an array of indices into the pool.  Everything else
+(the directory tree, the processors etc.) is stored as compressed json_tricks
+data.  Loading decodes each column in one step from its section, without
+parsing the rest of the file, into a list (or an array for the typed tag
+columns).  The file is only read when loading, the loaded project is held in
+memory as usual.
+
+The journal is a text file with one JSON encoded change per line which is
+appended to when a project is saved in journal mode.
+"""
+
+from array import array
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import json_tricks
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'VIXEN\x00\x03\x00'
+
+# The magic is followed by the length of the header as an unsigned 64 bit
+# integer.
+HEADER = struct.Struct('<8sQ')
+
+# Sections are aligned to this many bytes.
+ALIGN = 8
+
+if sys.version_info[0] > 2:
+    unicode = str
+    string_types = (str,)
+    int_types = (int,)
+else:
+    string_types = (unicode,)  # noqa: F821
+    int_types = (int, long)  # noqa: F821
+
+
+def _find_typecode(codes, itemsize):
+    for code in codes:
+        try:
+            if array(code).itemsize == itemsize:
+                return code
+        except ValueError:
+            pass
+
+
+# Type codes of the arrays for each kind of column.  Python 2 has no 'q' type
+# code and on some platforms there is no 64 bit integer array at all in which
+# case integer columns are stored as json.
+TYPECODES = dict(
+    int=_find_typecode('ql', 8), float='d', bool='b',
+    index=_find_typecode('il', 4)
+)
+
+
+# The kinds of the columns stored as arrays given their type codes.
+ARRAY_KINDS = dict(
+    (TYPECODES[kind], kind) for kind in ('bool', 'int', 'float')
+    if TYPECODES[kind] is not None
+)
+
+
+def _pack_array(arr):
+    """Return the compressed bytes of the array."""
+    if hasattr(arr, 'tobytes'):
+        data = arr.tobytes()
+    else:
+        data = arr.tostring()
+    return zlib.compress(data, 1)
+
+
+def _unpack_array(typecode, data, byteswap=False):
+    """Return the array packed by `_pack_array`."""
+    data = zlib.decompress(data)
+    arr = array(typecode)
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    if byteswap:
+        arr.byteswap()
+    return arr
+
+
+def _encode_strings(values):
+    """Return the encoded string pool and the indices of the values into the
+    pool.  Returns None if the strings cannot be stored in a pool.
+    """
+    pool = {}
+    ids = [pool.setdefault(v, len(pool)) for v in values]
+    strings = sorted(pool, key=pool.get)
+    if len(strings) >= 2**31 or any(u'\0' in s for s in strings):
+        return None
+    blob = u'\0'.join(strings).encode('utf-8')
+    ids = array(TYPECODES['index'], ids)
+    return zlib.compress(blob, 1), _pack_array(ids)
+
+
+def encode_column(values):
+    """Encode a column of values.
+
+    `values` is a list or an array of values of one of the kinds stored as
+    arrays.  Returns the kind of the column and a list of byte strings for
+    each of the sections storing it.  A list mixing the types of values, for
+    instance a float in an integer tag, is stored as json so that no value
+    changes its type.
+    """
+    if isinstance(values, array):
+        return ARRAY_KINDS[values.typecode], [_pack_array(values)]
+    types = set(map(type, values))
+    if len(values) > 0:
+        if types == set((bool,)):
+            return 'bool', [_pack_array(array(TYPECODES['bool'], values))]
+        elif types.issubset(int_types):
+            if TYPECODES['int'] is not None:
+                try:
+                    values = array(TYPECODES['int'], values)
+                except OverflowError:
+                    pass
+                else:
+                    return 'int', [_pack_array(values)]
+        elif types == set((float,)):
+            return 'float', [_pack_array(array(TYPECODES['float'], values))]
+        elif types.issubset(string_types):
+            sections = _encode_strings(values)
+            if sections is not None:
+                return 'str', list(sections)
+
+    data = json_tricks.dumps(values).encode('utf-8')
+    return 'json', [zlib.compress(data, 1)]
+
+
+def decode_column(kind, sections, byteswap=False, as_array=False):
+    """Decode a column given its kind and the byte strings of its sections.
+    Returns a list of the values, or the array for the kinds stored as arrays
+    if `as_array` is True.
+    """
+    if kind in ARRAY_KINDS.values():
+        values = _unpack_array(TYPECODES[kind], sections[0], byteswap)
+        if as_array:
+            return values
+        elif kind == 'bool':
+            return list(map(bool, values))
+        else:
+            return values.tolist()
+    elif kind == 'str':
+        blob = zlib.decompress(sections[0]).decode('utf-8')
+        pool = blob.split(u'\0')
+        ids = _unpack_array(TYPECODES['index'], sections[1], byteswap)
+        return list(map(pool.__getitem__, ids))
+    else:
+        data = zlib.decompress(sections[0]).decode('utf-8')
+        return json_tricks.loads(
+            data, preserve_order=False, ignore_comments=False
+        )
+
+
+def is_columnar(fp):
+    """Check if the opened file is in the columnar format.
+
+    The file position is restored.
+    """
+    pos = fp.tell()
+    magic = fp.read(len(MAGIC))
+    fp.seek(pos)
+    return magic == MAGIC
+
+
+def dump(data, fp):
+    """Write the project data to the opened binary file.
+
+    `data` is a dictionary with the columns of the media data and tags in its
+    'media_data' and 'tag_data' entries.  All the other entries are stored as
+    json_tricks data.
+    """
+    meta = dict(data)
+    meta['version'] = 3
+    groups = [('media_data', meta.pop('media_data')),
+              ('tag_data', meta.pop('tag_data'))]
+    n = len(groups[0][1].get('relpath', []))
+
+    blocks = []
+    columns = []
+    # The offset of the next section in a list so it can be updated below.
+    offset = [0]
+
+    def _add_section(block):
+        start, length = offset[0], len(block)
+        block += b'\0' * ((-length) % ALIGN)
+        blocks.append(block)
+        offset[0] += len(block)
+        return [start, length]
+
+    for group, cols in groups:
+        for name, values in cols.items():
+            kind, sections = encode_column(values)
+            columns.append(dict(
+                group=group, name=name, kind=kind,
+                sections=[_add_section(s) for s in sections]
+            ))
+    meta_data = zlib.compress(json_tricks.dumps(meta).encode('utf-8'), 1)
+    meta_section = _add_section(meta_data)
+
+    header = dict(
+        version=3, byteorder=sys.byteorder, length=n, columns=columns,
+        meta=meta_section
+    )
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * ((-len(header) - HEADER.size) % ALIGN)
+    fp.write(HEADER.pack(MAGIC, len(header)))
+    fp.write(header)
+    for block in blocks:
+        fp.write(block)
+
+
+def _map_file(fp):
+    """Return a read-only buffer with the content of the file, a memory map
+    when possible.  The caller closes it once the columns are decoded.
+    """
+    try:
+        fileno = fp.fileno()
+    except (AttributeError, IOError, ValueError):
+        fileno = None
+    if fileno is not None:
+        try:
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            pass
+    fp.seek(0)
+    return fp.read()
+
+
+def load(fp, tag_arrays=False):
+    """Load the project data from the opened binary file.
+
+    Returns a dictionary like the one passed to `dump` along with the
+    'relpath2index' mapping.  If `tag_arrays` is True, the tag columns
+    stored as arrays are returned as arrays instead of lists.
+    """
+    buf = _map_file(fp)
+    try:
+        magic, header_length = HEADER.unpack(buf[:HEADER.size])
+        if magic != MAGIC:
+            raise IOError("Not a ViXeN columnar project file.")
+        base = HEADER.size + header_length
+        header = json.loads(buf[HEADER.size:base].decode('utf-8'))
+        byteswap = header['byteorder'] != sys.byteorder
+
+        def _section(spec):
+            start, length = spec
+            return buf[base + start:base + start + length]
+
+        meta_data = zlib.decompress(_section(header['meta'])).decode('utf-8')
+        data = json_tricks.loads(
+            meta_data, preserve_order=False, ignore_comments=False
+        )
+        data['media_data'] = {}
+        data['tag_data'] = {}
+        for col in header['columns']:
+            sections = [_section(s) for s in col['sections']]
+            data[col['group']][col['name']] = decode_column(
+                col['kind'], sections, byteswap,
+                as_array=tag_arrays and col['group'] == 'tag_data'
+            )
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+    relpaths = data['media_data'].get('relpath', [])
+    data['relpath2index'] = dict(zip(relpaths, range(len(relpaths))))
+    return data
+
+
+def _write_changes(fp, changes):
+    for change in changes:
+        fp.write(unicode(json.dumps(change)) + u'\n')
+
+
+def _ends_line(path):
+    """Return False if the file does not end with a newline, True if it
+    does or if it is empty or does not exist.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            fp.seek(-1, os.SEEK_END)
+            return fp.read(1) == b'\n'
+    except (IOError, OSError):
+        return True
+
+
+if hasattr(os, 'replace'):
+    _replace = os.replace
+else:
+    def _replace(src, dst):
+        # Renaming over an existing file fails on Windows.
+        if sys.platform == 'win32' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+class Journal(object):
+    """An append-only log of JSON records, used for the project journal and
+    the output cache of the command processor.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return 'Journal(path=%r)' % self.path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def append(self, changes):
+        """Append the given list of changes to the journal.
+
+        If the last line was only partially written, it is ended first so the
+        new changes are not joined to it.
+        """
+        complete = _ends_line(self.path)
+        with io.open(self.path, 'a', encoding='utf-8') as fp:
+            if not complete:
+                fp.write(u'\n')
+            _write_changes(fp, changes)
+
+    def rewrite(self, changes):
+        """Replace the journal with the given list of changes.
+
+        The changes are written to a temporary file which then replaces the
+        journal, so a crash never leaves it partially written.
+        """
+        tmp = self.path + '.tmp'
+        with io.open(tmp, 'w', encoding='utf-8') as fp:
+            _write_changes(fp, changes)
+        _replace(tmp, self.path)
+
+    def read(self):
+        """Return the list of all the changes in the journal.
+
+        A line that cannot be parsed, typically one that was only partially
+        written when ViXeN was killed, is skipped.
+        """
+        changes = []
+        if not self.exists():
+            return changes
+        with io.open(self.path, 'r', encoding='utf-8') as fp:
+            for line in fp:
+                try:
+                    changes.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping bad journal entry: %r", line)
+        return changes
+
+    def clear(self):
+        if self.exists():
+            os.remove(self.path)
@@ -0,0 +1,100 @@
+import unittest
+
+from vixen.columns import TypedColumn, make_column, pack
+
+
+class TestTypedColumn(unittest.TestCase):
+    def test_make_column_only_types_numbers_and_bools(self):
+        self.assertIsInstance(make_column('int', [1, 2]), TypedColumn)
+        self.assertIsInstance(make_column('float'), TypedColumn)
+        self.assertIsInstance(make_column('bool', [True]), TypedColumn)
+        self.assertEqual(make_column('string', ['a']), ['a'])
+        self.assertEqual(make_column(None, [1, 'a']), [1, 'a'])
+
+    def test_column_behaves_like_a_list(self):
+        # Given
+        col = TypedColumn('int', [1, 2, 3])
+
+        # When
+        col.append(4)
+        col.extend([5, 6])
+        col[0] = 10
+        del col[1]
+
+        # Then
+        self.assertEqual(len(col), 5)
+        self.assertEqual(col, [10, 3, 4, 5, 6])
+        self.assertEqual(list(col), [10, 3, 4, 5, 6])
+        self.assertEqual(col[-1], 6)
+        self.assertEqual(col[1:3], [3, 4])
+        self.assertIsNotNone(col.to_array())
+
+        # When
+        col[:] = [col[i] for i in (0, 2)]
+
+        # Then
+        self.assertEqual(col, [10, 4])
+
+    def test_bool_and_float_values(self):
+        # Given
+        bools = TypedColumn('bool', [True, False])
+        floats = TypedColumn('float', [1.5, 2])
+
+        # Then
+        self.assertEqual(list(bools), [True, False])
+        self.assertIs(bools[0], True)
+        self.assertEqual(floats.tolist(), [1.5, 2.0])
+        self.assertIsInstance(floats[1], float)
+
+    def test_missing_values_are_masked(self):
+        # Given
+        col = TypedColumn('int', [1, None, 3])
+
+        # Then
+        self.assertEqual(col, [1, None, 3])
+        self.assertEqual(list(col), [1, None, 3])
+        self.assertIsNone(col[1])
+        self.assertIsNone(col.to_array())
+        self.assertEqual(pack(col), [1, None, 3])
+
+        # When
+        col[1] = 2
+        col[2] = None
+
+        # Then
+        self.assertEqual(col, [1, 2, None])
+
+    def test_values_not_fitting_the_type_are_kept(self):
+        # Given
+        col = TypedColumn('int', [1, None, 3])
+
+        # When
+        col[0] = ''
+        col.append(True)
+        col.append(2**70)
+
+        # Then
+        self.assertEqual(col, ['', None, 3, True, 2**70])
+        self.assertIs(col[3], True)
+        self.assertIsNone(col.to_array())
+
+        # When
+        col[:] = [1, 2]
+
+        # Then
+        self.assertEqual(col, [1, 2])
+        self.assertIsNotNone(col.to_array())
+
+    def test_overflow_in_extend_keeps_values(self):
+        # Given
+        col = TypedColumn('int', [1])
+
+        # When
+        col.extend([2, 2**70, 3])
+
+        # Then
+        self.assertEqual(col, [1, 2, 2**70, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -80,9 +80,9 @@ class TestDirectory(unittest.TestCase):
         s = pickle.dumps(d)
 
         # When
-        with mock.patch('os.listdir', mock.Mock()):
+        with mock.patch('vixen.directory._list_directory') as m:
             d1 = pickle.loads(s)
-            n_listdir_calls = os.listdir.call_count
+            n_listdir_calls = m.call_count
 
         # Then.
         self.check_root(d1)
@@ -145,14 +145,40 @@ class TestDirectory(unittest.TestCase):
         d = Directory(path=self.root, extensions=['.py', '.txt'])
 
         # When
-        with mock.patch('os.listdir', mock.Mock()):
+        with mock.patch('vixen.directory._list_directory') as m:
             d.extensions = ['.txt', '.py']
-            n_listdir_calls = os.listdir.call_count
+            n_listdir_calls = m.call_count
 
         # Then.
         self.check_root(d)
         self.assertEqual(n_listdir_calls, 0)
 
+    def test_each_directory_is_listed_once(self):
+        # Given
+        from vixen import directory
+        list_directory = mock.Mock(side_effect=directory._list_directory)
+
+        # When
+        with mock.patch('vixen.directory._list_directory', list_directory):
+            d = Directory(path=self.root)
+
+        # Then
+        self.check_root(d)
+        listed = sorted(x[0][0] for x in list_directory.call_args_list)
+        expect = sorted([
+            self.root, join(self.root, 'sub'), join(self.root, 'sub2'),
+            join(self.root, 'sub', 'subsub')
+        ])
+        self.assertEqual(listed, expect)
+
+    def test_files_have_stat_results(self):
+        # Given/When
+        d = Directory(path=self.root)
+
+        # Then
+        for f in d.files:
+            self.assertEqual(f.stat.st_size, os.stat(f.path).st_size)
+
     def test_repr_file_dir(self):
         # Given/When.
         d = Directory(path=self.root, extensions=['.py', '.txt'])
@@ -0,0 +1,119 @@
+import unittest
+
+from vixen.index import RangeIndex, TextIndex, get_trigrams
+
+
+class TestTextIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = TextIndex()
+        self.index.add_field(
+            'path', ['/a/Hello.py', '/a/root.txt', '/a/hello.txt', 'xy']
+        )
+
+    def test_get_trigrams(self):
+        self.assertEqual(get_trigrams('abcd'), set(['abc', 'bcd']))
+        self.assertEqual(get_trigrams('ab'), set())
+
+    def test_lookup_text_finds_substrings(self):
+        # When/Then
+        self.assertEqual(self.index.lookup_text('path', 'hello'), set([0, 2]))
+        self.assertEqual(self.index.lookup_text('path', '.txt'), set([1, 2]))
+        self.assertEqual(self.index.lookup_text('path', 'xy'), set([3]))
+        self.assertEqual(self.index.lookup_text('path', 'junk'), set())
+        self.assertEqual(self.index.lookup_text('type', 'hello'), None)
+
+    def test_add_and_discard_keep_index_updated(self):
+        # When
+        self.index.discard('path', 0, '/a/Hello.py')
+        self.index.add('path', 0, '/b/other.py')
+
+        # Then
+        self.assertEqual(self.index.lookup_text('path', 'hello'), set([2]))
+        self.assertEqual(self.index.lookup_text('path', 'other'), set([0]))
+        self.assertEqual(self.index.lookup_text('path', '.py'), set([0]))
+
+        # When
+        self.index.discard('path', 0, '/b/other.py')
+
+        # Then
+        self.assertEqual(self.index.lookup_text('path', 'other'), set())
+        self.assertNotIn('oth', self.index._trigrams['path'])
+
+    def test_add_many_adds_consecutive_records(self):
+        # When
+        self.index.add_many('path', 4, ['/b/Other.py', None, '/b/hello'])
+
+        # Then
+        self.assertEqual(self.index.lookup_text('path', 'hello'),
+                         set([0, 2, 6]))
+        self.assertEqual(self.index.lookup_text('path', 'other'), set([4]))
+        self.assertEqual(self.index.lookup_text('path', '.py'), set([0, 4]))
+
+    def test_renumber_drops_removed_records(self):
+        # When
+        self.index.renumber([-1, 0, 1, -1])
+
+        # Then
+        self.assertEqual(self.index.lookup_text('path', 'hello'), set([1]))
+        self.assertEqual(self.index.lookup_text('path', '.txt'), set([0, 1]))
+        self.assertEqual(self.index.lookup_text('path', 'xy'), set())
+        self.assertNotIn('/a/hello.py', self.index._values['path'])
+        self.assertNotIn('.py', self.index._trigrams['path'])
+
+    def test_state_is_restored(self):
+        # Given
+        state = self.index.__getstate__()
+
+        # When
+        index = TextIndex()
+        index.__setstate__(state)
+
+        # Then
+        self.assertEqual(index.fields(), ['path'])
+        self.assertEqual(index.lookup_text('path', 'hello'), set([0, 2]))
+        self.assertEqual(index.lookup_text('path', 'root'), set([1]))
+
+
+
+class TestRangeIndex(unittest.TestCase):
+    def setUp(self):
+        self.columns = dict(size=[30, 10, 20, 10, 40], name=['a'] * 5)
+        self.index = RangeIndex(self.columns.get, fields=['size'])
+
+    def test_lookup_range_handles_open_and_closed_ends(self):
+        lookup = self.index.lookup_range
+        self.assertEqual(lookup('size', 10, 20), set([1, 2, 3]))
+        self.assertEqual(lookup('size', 10, 20, True, False), set([2]))
+        self.assertEqual(lookup('size', 10, 30, False, True),
+                         set([1, 2, 3]))
+        self.assertEqual(lookup('size', None, 20, False, True), set([1, 3]))
+        self.assertEqual(lookup('size', 30, None), set([0, 4]))
+        self.assertEqual(lookup('size', 50, None), set())
+        self.assertEqual(lookup('name', 'a', None), None)
+
+    def test_sorted_data_is_built_lazily_and_invalidated(self):
+        # Given
+        self.assertEqual(self.index._sorted, {})
+        self.assertEqual(self.index.lookup_range('size', 40, 40), set([4]))
+        self.assertIn('size', self.index._sorted)
+
+        # When
+        self.columns['size'][0] = 40
+        self.index.invalidate('size')
+
+        # Then
+        self.assertNotIn('size', self.index._sorted)
+        self.assertEqual(self.index.lookup_range('size', 40, 40),
+                         set([0, 4]))
+
+    def test_missing_values_are_not_in_any_range(self):
+        # Given
+        self.columns['size'][1] = None
+
+        # When/Then
+        self.assertEqual(self.index.lookup_range('size', None, 20),
+                         set([2, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@ import unittest
 import tempfile
 import os
 
+import mock
+
 from vixen.media import get_media_data, find_type, MediaData, Media
 
 
@@ -49,6 +51,26 @@ class TestMedia(unittest.TestCase):
         self.assertEqual(data.path, fname)
         self.assertEqual(data.file_name, relpath)
 
+    def test_get_media_data_uses_given_stat(self):
+        # Given
+        fname = self.fname
+        stat = os.stat(fname)
+
+        # When
+        with mock.patch('os.stat') as m:
+            data = get_media_data(fname, 'test.txt', stat)
+
+        # Then
+        self.assertEqual(m.call_count, 0)
+        self.assertEqual(data.size, stat.st_size)
+
+    def test_get_media_data_for_missing_file(self):
+        # When
+        data = get_media_data(self.fname + 'xxx', 'xxx')
+
+        # Then
+        self.assertIsNone(data)
+
     def test_media_from_path(self):
         # Given
         fname = self.fname
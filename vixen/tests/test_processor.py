@@ -1,3 +1,4 @@
+from itertools import chain
 import mock
 import os
 import shutil
@@ -6,8 +7,9 @@ from threading import Thread
 import time
 import unittest
 
-from vixen.processor import Processor, Job, CommandFactory, \
-    PythonFunctionFactory, TaggerFactory, dump, load
+from vixen.processor import Processor, Job, JobLedger, JobRecord, \
+    CommandFactory, PythonFunctionFactory, TaggerFactory, dump, load, \
+    make_pipeline_jobs, iter_pipeline_jobs
 from vixen.tests.test_directory import make_data
 from vixen.project import Project, TagInfo
 
@@ -50,6 +52,29 @@ class TestJob(unittest.TestCase):
         self.assertTrue(len(j.error) > 1, "Got: %s" % j.error)
 
 
+class TestJobRecord(unittest.TestCase):
+    def test_record_makes_job(self):
+        # Given
+        func = mock.Mock(return_value='hello')
+        merge = mock.Mock()
+        r = JobRecord(func=func, args=(1, 2), kw={'a': 10}, info='info',
+                      merge=merge, inputs=('x',), outputs=('y',))
+        self.assertEqual(r.status, 'none')
+
+        # When
+        j = r.to_job()
+        j.execute()
+
+        # Then
+        self.assertEqual(j.status, 'success')
+        func.assert_called_once_with(1, 2, a=10)
+        self.assertEqual(j.info, 'info')
+        self.assertIs(j.merge, merge)
+        self.assertEqual(j.inputs, ['x'])
+        self.assertEqual(j.outputs, ['y'])
+        self.assertEqual(r.status, 'none')
+
+
 class TestProcessor(unittest.TestCase):
     def test_processor_completes_jobs(self):
         # Given
@@ -111,7 +136,7 @@ class TestProcessor(unittest.TestCase):
     def test_processor_stops_correctly(self):
         # Given
         def _sleep(x):
-            time.sleep(0.01)
+            time.sleep(0.05)
             return x
 
         jobs = [Job(func=mock.Mock(side_effect=_sleep), args=[x])
@@ -180,6 +205,396 @@ class TestProcessor(unittest.TestCase):
         self.assertEqual(p.errored_jobs[0].status, 'error')
         self.assertEqual(f.call_count, 2)
 
+    def test_jobs_are_handed_off_without_polling(self):
+        # Given
+        jobs = [Job(func=mock.Mock(return_value=x), args=[x])
+                for x in range(500)]
+        p = Processor(jobs=jobs, number_of_processes=2)
+
+        # When
+        start = time.time()
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(p.completed), 500)
+        # Polling every 10 ms would take at least 2.5 seconds.
+        self.assertTrue(time.time() - start < 2.5)
+
+    def test_no_jobs_are_started_when_paused(self):
+        # Given
+        def _sleep(x):
+            time.sleep(0.05)
+            return x
+
+        jobs = [Job(func=mock.Mock(side_effect=_sleep), args=[x])
+                for x in range(10)]
+        p = Processor(jobs=jobs, number_of_processes=2)
+        self.addCleanup(p.resume)
+        t = Thread(target=p.process)
+        t.start()
+
+        # When
+        count = 0
+        while len(p.running) < 2 and count < 100:
+            time.sleep(0.005)
+            count += 1
+        p.pause()
+        time.sleep(0.2)
+
+        # Then
+        self.assertEqual(p.status, 'running')
+        self.assertEqual(len(p.completed), 2)
+        self.assertEqual(sum(j.func.call_count for j in jobs), 2)
+
+        # When
+        p.resume()
+        t.join()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(p.completed), 10)
+
+    def test_start_processes_jobs_in_background(self):
+        # Given
+        def _sleep(x):
+            time.sleep(0.05)
+            return x
+
+        jobs = [Job(func=mock.Mock(side_effect=_sleep), args=[x])
+                for x in range(4)]
+        p = Processor(jobs=jobs, number_of_processes=2)
+
+        # When
+        started = p.start()
+
+        # Then
+        self.assertTrue(started)
+        self.assertEqual(p.status, 'running')
+        self.assertFalse(p.start())
+
+        # When
+        p.wait()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(p.completed), 4)
+        self.assertEqual(p.number_of_jobs, 4)
+        self.assertEqual(p.jobs_done, 4)
+        self.assertTrue(p.throughput > 0)
+        self.assertEqual(p.eta, 0.0)
+
+    def test_progress_counts_failed_jobs(self):
+        # Given
+        def bomb():
+            assert 1 == 2
+
+        jobs = [Job(func=bomb)]
+        p = Processor(jobs=jobs)
+
+        # When
+        p.start()
+        p.wait()
+
+        # Then
+        self.assertEqual(p.status, 'error')
+        self.assertEqual(len(p.errored_jobs), 1)
+        self.assertEqual(p.number_of_jobs, 1)
+        self.assertEqual(p.jobs_done, 1)
+
+    def _make_stage_jobs(self, order, files):
+        jobs = []
+        for name in files:
+            jobs.append(Job(
+                func=order.append, args=['make ' + name],
+                outputs=[name + '.out']
+            ))
+        for name in files:
+            jobs.append(Job(
+                func=order.append, args=['tag ' + name],
+                inputs=[name + '.out']
+            ))
+        return jobs
+
+    def test_jobs_wait_for_the_jobs_making_their_inputs(self):
+        # Given
+        order = []
+        jobs = self._make_stage_jobs(order, ['a', 'b', 'c'])
+        # Run the second stage first in the list to check the ordering.
+        jobs.reverse()
+        p = Processor(jobs=jobs, number_of_processes=1)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(p.completed), 6)
+        for name in 'abc':
+            self.assertTrue(
+                order.index('make ' + name) < order.index('tag ' + name)
+            )
+
+    def test_files_are_streamed_through_the_pipeline(self):
+        # Given
+        order = []
+        jobs = self._make_stage_jobs(order, ['a', 'b', 'c'])
+        p = Processor(jobs=jobs, number_of_processes=1)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(
+            order, ['make a', 'tag a', 'make b', 'tag b', 'make c', 'tag c']
+        )
+
+    def test_jobs_are_not_run_when_their_inputs_fail(self):
+        # Given
+        def bomb():
+            assert 1 == 2
+
+        order = []
+        jobs = self._make_stage_jobs(order, ['a', 'b'])
+        jobs[0].func = bomb
+        jobs[0].args = []
+        p = Processor(jobs=jobs, number_of_processes=1)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'error')
+        self.assertEqual(jobs[2].status, 'none')
+        self.assertNotIn('tag a', order)
+
+        # When
+        jobs[0].func = order.append
+        jobs[0].args = ['make a']
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(order[-2:], ['make a', 'tag a'])
+
+    def test_jobs_from_job_source_are_made_as_needed(self):
+        # Given
+        made = []
+        seen = []
+
+        def _make_jobs():
+            for i in range(50):
+                made.append(i)
+                yield Job(func=lambda: seen.append(len(made)))
+
+        p = Processor(job_source=_make_jobs(), queue_size=2)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(seen), 50)
+        self.assertTrue(seen[0] < 50)
+        # At most queue_size jobs are made ahead of the running job, one is
+        # being put on the queue and one is being taken from it.
+        self.assertTrue(max(n - i for i, n in enumerate(seen)) <= 5)
+        self.assertEqual(p.number_of_jobs, 50)
+        self.assertEqual(p.jobs_done, 50)
+        self.assertEqual(len(p.completed), 0)
+        self.assertFalse(p.making_jobs)
+        self.assertIsNone(p.job_source)
+
+    def test_job_records_are_shown_as_jobs_when_run(self):
+        # Given
+        running = []
+
+        def bomb():
+            assert 1 == 2
+
+        p = Processor(number_of_processes=2)
+        records = [
+            JobRecord(func=lambda: running.append(list(p.running)))
+            for i in range(5)
+        ]
+        records.append(JobRecord(func=bomb, info='bomb'))
+        p.job_source = iter(records)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'error')
+        for jobs in running:
+            for job in jobs:
+                self.assertIsInstance(job, Job)
+        self.assertEqual(len(p.errored_jobs), 1)
+        job = p.errored_jobs[0]
+        self.assertIsInstance(job, Job)
+        self.assertEqual(job.info, 'bomb')
+        self.assertIn('AssertionError', job.error)
+        self.assertEqual(records[-1].status, 'error')
+        self.assertEqual(len(p.completed), 0)
+
+        # When
+        job.func = mock.Mock()
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(p.errored_jobs, [])
+
+    def test_stopping_stops_making_jobs(self):
+        # Given
+        made = []
+
+        def _make_jobs():
+            for i in range(1000):
+                made.append(i)
+                yield Job(func=time.sleep, args=[0.01])
+
+        p = Processor(job_source=_make_jobs(), queue_size=5)
+        t = Thread(target=p.process)
+        t.start()
+
+        # When
+        time.sleep(0.05)
+        p.stop()
+        t.join()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertFalse(p.making_jobs)
+        self.assertTrue(len(made) < 100)
+
+    def test_errors_in_making_jobs_are_reported(self):
+        # Given
+        def _make_jobs():
+            yield Job(func=mock.Mock())
+            raise RuntimeError('bad job')
+
+        p = Processor(job_source=_make_jobs())
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'error')
+        self.assertFalse(p.making_jobs)
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        # Given
+        times = []
+
+        def flaky():
+            times.append(time.time())
+            assert len(times) > 2
+
+        p = Processor(jobs=[Job(func=flaky)], retries=2, retry_delay=0.05)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(times), 3)
+        self.assertTrue(times[1] - times[0] >= 0.05)
+        self.assertTrue(times[2] - times[1] >= 0.1)
+        self.assertEqual(len(p.completed), 1)
+        self.assertEqual(p.jobs_done, 1)
+
+    def test_retries_do_not_hold_up_other_jobs(self):
+        # Given
+        order = []
+
+        def flaky():
+            order.append('flaky')
+            assert order.count('flaky') > 1
+
+        jobs = [Job(func=flaky)]
+        jobs.extend(Job(func=order.append, args=[x]) for x in range(3))
+        p = Processor(jobs=jobs, retries=1, retry_delay=0.2)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(order, ['flaky', 0, 1, 2, 'flaky'])
+
+    def test_jobs_failing_after_all_retries_are_errors(self):
+        # Given
+        f = mock.Mock(side_effect=ValueError)
+        p = Processor(jobs=[Job(func=f)], retries=1, retry_delay=0.01)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'error')
+        self.assertEqual(f.call_count, 2)
+        self.assertEqual(len(p.errored_jobs), 1)
+
+    def test_continue_on_error_runs_all_jobs(self):
+        # Given
+        def bomb():
+            assert 1 == 2
+
+        jobs = [Job(func=bomb)]
+        jobs.extend(
+            Job(func=mock.Mock(return_value=x), args=[x]) for x in range(5)
+        )
+        jobs.append(Job(func=bomb))
+        p = Processor(jobs=jobs, continue_on_error=True)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'error')
+        self.assertEqual(len(p.completed), 5)
+        self.assertEqual(len(p.errored_jobs), 2)
+        self.assertEqual(p.jobs_done, 7)
+
+    def test_jobs_waiting_for_a_worker_have_queue_wait(self):
+        # Given
+        jobs = [Job(func=time.sleep, args=[0.2]) for x in range(2)]
+        p = Processor(jobs=jobs, number_of_processes=1)
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(p.job_stats), 2)
+        first, second = p.job_stats
+        self.assertEqual(first[0], 'jobs')
+        self.assertLess(first[4], 0.1)
+        self.assertGreater(second[4], 0.15)
+        for row in p.job_stats:
+            self.assertGreaterEqual(row[5], 0.2)
+        summary = p.summary
+        self.assertEqual(summary['jobs'], 2)
+        self.assertEqual(summary['errors'], 0)
+        self.assertGreater(summary['elapsed'], 0.4)
+        self.assertLess(summary['cpu_use'], 0.5)
+        self.assertEqual(list(summary['groups']), ['jobs'])
+
+    def test_inline_backend_runs_jobs_in_calling_thread(self):
+        # Given
+        from threading import current_thread
+        jobs = [Job(func=current_thread) for x in range(3)]
+        p = Processor(jobs=jobs, backend='inline')
+
+        # When
+        p.process()
+
+        # Then
+        self.assertEqual(p.status, 'success')
+        self.assertEqual(len(p.completed), 3)
+        for j in jobs:
+            self.assertIs(j.result, current_thread())
+
 
 class TestFactoryBase(unittest.TestCase):
     def setUp(self):
@@ -191,6 +606,23 @@ class TestFactoryBase(unittest.TestCase):
     def tearDown(self):
         shutil.rmtree(self._temp)
 
+    def _make_tagger(self, code):
+        """Write the code to a script and return the command running it."""
+        script = os.path.join(self._temp, 'tagger.py')
+        with open(script, 'w') as fp:
+            fp.write(code)
+        return "python %s" % script
+
+    def _run_jobs(self, jobs, check=True):
+        """Run the jobs one after the other, checking that they succeed if
+        `check` is True.
+        """
+        for job in jobs:
+            job.run()
+            job.thread.join()
+            if check:
+                self.assertEqual(job.status, 'success')
+
 
 class TestCommandFactory(TestFactoryBase):
 
@@ -252,45 +684,417 @@ class TestCommandFactory(TestFactoryBase):
         cf1 = load(data)
 
         # Then.
+        self.assertIsNone(cf1._cache_memo)
         for attr in cf.__dict__.keys():
-            self.assertEqual(getattr(cf1, attr), getattr(cf, attr))
+            if attr != '_cache_memo':
+                self.assertEqual(getattr(cf1, attr), getattr(cf, attr))
 
-    def test_command_factory_ignores_non_existing_paths(self):
+    def _make_copy_factory(self, **kw):
+        import sys
+        command = """\
+        %r -c 'import shutil;shutil.copy("$input", "$output")'\
+        """ % sys.executable
+        return CommandFactory(dest=self.root1, input_extension='.py',
+                              output_extension='.rst', command=command, **kw)
+
+    def test_command_factory_reruns_only_stale_inputs(self):
         # Given.
-        cf = CommandFactory(dest=self.root1, input_extension='.py',
-                            output_extension='.rst',
-                            command="echo $input $output")
         p = Project(name='test', path=self.root)
         p.scan()
-        os.remove(os.path.join(self.root, 'hello.py'))
+        self._run_jobs(self._make_copy_factory().make_jobs(p.keys(), p))
+        src = os.path.join(self.root, 'hello.py')
+        dest = os.path.join(self.root1, 'hello.rst')
 
         # When
+        cf = self._make_copy_factory()
         jobs = cf.make_jobs(p.keys(), p)
 
         # Then.
         self.assertEqual(len(jobs), 0)
+        self.assertTrue(cf._done[dest])
+
+        # When
+        with open(src, 'w') as fp:
+            fp.write('print(1)\n')
+        os.utime(src, (0, 0))
+        cf = self._make_copy_factory()
+        jobs = cf.make_jobs(p.keys(), p)
+        self._run_jobs(jobs)
 
+        # Then.
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].kw, dict(stale=True))
+        with open(dest) as fp:
+            self.assertEqual(fp.read(), 'print(1)\n')
+        self.assertEqual(len(cf.make_jobs(p.keys(), p)), 0)
 
-class TestPythonFunctionFactory(TestFactoryBase):
+        # When
+        cf = self._make_copy_factory()
+        cf.command += ' '
+        jobs = cf.make_jobs(p.keys(), p)
 
-    def test_python_function_factory(self):
+        # Then.
+        self.assertEqual(len(jobs), 1)
+
+    def test_command_factory_with_hash_ignores_touched_inputs(self):
         # Given.
-        from textwrap import dedent
-        code = dedent("""
-        def process(relpath, media, dest):
-            media.tags['completed'] = True
-            media.tags['args'] = "%s %s"%(relpath, dest)
-        """)
-        factory = PythonFunctionFactory(code=code, dest=self.root1)
         p = Project(name='test', path=self.root)
-        p.add_tags([TagInfo(name='args', type='string')])
         p.scan()
+        cf = self._make_copy_factory(use_hash=True)
+        self._run_jobs(cf.make_jobs(p.keys(), p))
+        src = os.path.join(self.root, 'hello.py')
 
         # When
-        jobs = factory.make_jobs(p.keys(), p)
-        for job in jobs:
-            job.run()
-            job.thread.join()
+        os.utime(src, (0, 0))
+        cf = self._make_copy_factory(use_hash=True)
+        jobs = cf.make_jobs(p.keys(), p)
+
+        # Then.
+        self.assertEqual(len(jobs), 0)
+
+        # When
+        with open(src, 'w') as fp:
+            fp.write('print(2)\n')
+        os.utime(src, (0, 0))
+        jobs = self._make_copy_factory(use_hash=True).make_jobs(p.keys(), p)
+
+        # Then.
+        self.assertEqual(len(jobs), 1)
+
+    def test_command_factory_cache_is_kept_per_factory(self):
+        # Given.
+        p = Project(name='test', path=self.root)
+        p.scan()
+        cf = self._make_copy_factory(use_hash=True)
+        self._run_jobs(cf.make_jobs(p.keys(), p))
+        src = os.path.join(self.root, 'hello.py')
+        cf1 = self._make_copy_factory(use_hash=True)
+        entry = cf1._read_cache()['hello.rst']
+        old = dict(entry)
+
+        # When
+        os.utime(src, (0, 0))
+        jobs = cf1.make_jobs(p.keys(), p)
+
+        # Then.
+        self.assertEqual(len(jobs), 0)
+        self.assertIsNot(cf._read_cache(), cf1._read_cache())
+        self.assertEqual(entry, old)
+        self.assertEqual(cf1._read_cache()['hello.rst']['mtime'], 0)
+
+    def test_command_factory_kills_commands_after_timeout(self):
+        # Given.
+        import sys
+        command = "%r -c 'import time; time.sleep(10)'" % sys.executable
+        cf = CommandFactory(dest=self.root1, input_extension='.py',
+                            output_extension='.rst', command=command,
+                            timeout=0.2)
+        p = Project(name='test', path=self.root)
+        p.scan()
+        jobs = cf.make_jobs(p.keys(), p)
+
+        # When
+        start = time.time()
+        jobs[0].execute()
+
+        # Then.
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(jobs[0].status, 'error')
+        self.assertIn('JobTimeout', jobs[0].error)
+
+    @unittest.skipIf(os.name != 'posix', 'needs a POSIX shell')
+    def test_timeout_kills_the_processes_started_by_the_command(self):
+        # Given.
+        # The shell waits for sleep which keeps the output pipes open.
+        command = "sh -c 'sleep 30; echo done'"
+        cf = CommandFactory(dest=self.root1, input_extension='.py',
+                            output_extension='.rst', command=command,
+                            timeout=0.5)
+        p = Project(name='test', path=self.root)
+        p.scan()
+        jobs = cf.make_jobs(p.keys(), p)
+
+        # When
+        start = time.time()
+        jobs[0].execute()
+
+        # Then.
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(jobs[0].status, 'error')
+        self.assertIn('JobTimeout', jobs[0].error)
+
+    def test_command_factory_ignores_non_existing_paths(self):
+        # Given.
+        cf = CommandFactory(dest=self.root1, input_extension='.py',
+                            output_extension='.rst',
+                            command="echo $input $output")
+        p = Project(name='test', path=self.root)
+        p.scan()
+        os.remove(os.path.join(self.root, 'hello.py'))
+
+        # When
+        jobs = cf.make_jobs(p.keys(), p)
+
+        # Then.
+        self.assertEqual(len(jobs), 0)
+
+
+class TestPipeline(TestFactoryBase):
+
+    def test_processor_uses_output_of_its_source(self):
+        # Given.
+        import sys
+        command = """\
+        %r -c 'import shutil;shutil.copy("$input", "$output")'\
+        """ % sys.executable
+        cf = CommandFactory(dest=self.root1, input_extension='.py',
+                            output_extension='.rst', command=command)
+        code = 'import sys; print("args:"+sys.argv[1])'
+        tf = TaggerFactory(command="python -c %r" % code, source=0)
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='args', type='string')])
+        p.scan()
+
+        # When
+        jobs = make_pipeline_jobs([cf, tf], p.keys(), p)
+
+        # Then.
+        self.assertEqual(len(jobs), 2)
+        dest = os.path.join(self.root1, 'hello.rst')
+        self.assertEqual(jobs[0].outputs, [dest])
+        self.assertEqual(jobs[1].inputs, [dest])
+
+        # When
+        processor = Processor(jobs=jobs)
+        processor.process()
+
+        # Then.
+        self.assertEqual(processor.status, 'success')
+        self.assertEqual(p.get('hello.py').tags['args'], dest)
+        self.assertEqual(p.get('root.txt').tags['args'], '')
+
+        # When
+        jobs = make_pipeline_jobs([cf, tf], p.keys(), p)
+
+        # Then.
+        self.assertEqual(len(jobs), 0)
+
+    def test_pipeline_jobs_are_made_in_chunks(self):
+        # Given.
+        import sys
+        command = """\
+        %r -c 'import shutil;shutil.copy("$input", "$output")'\
+        """ % sys.executable
+        cf = CommandFactory(dest=self.root1, input_extension='.txt',
+                            output_extension='.rst', command=command)
+        code = 'import sys; print("args:"+sys.argv[1])'
+        tf = TaggerFactory(command="python -c %r" % code, source=0)
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='args', type='string')])
+        p.scan()
+        keys = sorted(k for k in p.keys() if k.endswith('.txt'))
+        self.assertEqual(len(keys), 4)
+
+        # When
+        jobs = iter_pipeline_jobs([cf, tf], keys, p, chunk_size=2)
+        first = [next(jobs) for i in range(4)]
+
+        # Then.
+        self.assertEqual(first[0].inputs[0], p.get(keys[0]).path)
+        self.assertEqual(first[2].inputs, first[0].outputs)
+        self.assertEqual(first[3].inputs, first[1].outputs)
+
+        # When
+        processor = Processor(
+            job_source=chain(first, jobs), number_of_processes=2
+        )
+        processor.process()
+
+        # Then.
+        self.assertEqual(processor.status, 'success')
+        self.assertEqual(processor.jobs_done, 8)
+        for key in keys:
+            media = p.get(key)
+            self.assertEqual(media.tags['args'], cf.get_output(media))
+
+    def test_ledger_records_jobs_and_resumes_interrupted_run(self):
+        # Given.
+        code = 'import sys; print("args:"+sys.argv[1])'
+        tf = TaggerFactory(command="python -c %r" % code)
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='args', type='string')])
+        p.scan()
+        path = os.path.join(self._temp, 'test.vxn.jobs')
+        ledger = JobLedger(path)
+        processor = Processor(
+            job_source=iter_pipeline_jobs([tf], p.keys(), p), ledger=ledger
+        )
+
+        # When
+        processor.process()
+
+        # Then.
+        self.assertEqual(processor.status, 'success')
+        self.assertEqual(len(ledger.states), 5)
+        self.assertEqual(set(ledger.states.values()), set(['done']))
+        states = [x['state'] for x in ledger.journal.read()]
+        self.assertEqual(states.count('queued'), 5)
+        self.assertEqual(states.count('running'), 5)
+        self.assertEqual(states.count('done'), 5)
+
+        # Given
+        # A fresh copy of the project as if ViXeN was killed before saving
+        # and one job was still running.
+        key = [k for k in ledger.states if 'root.txt' in k][0]
+        ledger.journal.append([dict(key=key, state='running')])
+        tf = TaggerFactory(command="python -c %r" % code)
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='args', type='string')])
+        p.scan()
+        ledger = JobLedger(path)
+
+        # When
+        ledger.load()
+        jobs = list(ledger.resume(
+            iter_pipeline_jobs([tf], p.keys(), p), [tf], p
+        ))
+
+        # Then.
+        self.assertEqual(ledger.resumed, 4)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].key, key)
+        for key in p.keys():
+            media = p.get(key)
+            if key == 'root.txt':
+                self.assertEqual(media.tags['args'], '')
+                self.assertNotIn(media.path, tf._done)
+            else:
+                self.assertEqual(media.tags['args'], media.path)
+                self.assertTrue(tf._done[media.path])
+
+        # When
+        # The command is changed or the factory is removed.
+        ledger.resumed = 0
+        changed = TaggerFactory(command="python -c %r" % (code + ';'))
+        jobs = list(ledger.resume(
+            iter_pipeline_jobs([changed], p.keys(), p), [changed], p
+        ))
+        tf = TaggerFactory(command="python -c %r" % code)
+        jobs1 = list(ledger.resume(
+            iter_pipeline_jobs([tf], p.keys(), p), [], p
+        ))
+
+        # Then.
+        self.assertEqual(ledger.resumed, 0)
+        self.assertEqual(len(jobs), 5)
+        self.assertEqual(len(jobs1), 5)
+
+        # When
+        # An input is changed after its job was done.
+        with open(os.path.join(self.root, 'hello.py'), 'a') as fp:
+            fp.write('# changed\n')
+        jobs = list(ledger.resume(
+            iter_pipeline_jobs([tf], p.keys(), p), [tf], p
+        ))
+
+        # Then.
+        self.assertEqual(ledger.resumed, 3)
+        self.assertEqual(len(jobs), 2)
+        self.assertIn('hello.py', ' '.join(job.key for job in jobs))
+
+        # When
+        ledger.clear()
+
+        # Then.
+        self.assertFalse(os.path.exists(path))
+
+    def test_processor_measures_commands_and_exports_report(self):
+        # Given.
+        import csv
+        import json
+        import sys
+        command = """\
+        %r -c 'import shutil;shutil.copy("$input", "$output")'\
+        """ % sys.executable
+        cf = CommandFactory(dest=self.root1, input_extension='.py',
+                            output_extension='.rst', command=command)
+        code = 'import sys; print("args:"+sys.argv[1])'
+        tf = TaggerFactory(command="python -c %r" % code, source=0)
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='args', type='string')])
+        p.scan()
+        processor = Processor(
+            job_source=iter_pipeline_jobs([cf, tf], p.keys(), p)
+        )
+
+        # When
+        processor.process()
+
+        # Then.
+        self.assertEqual(processor.status, 'success')
+        self.assertEqual(len(processor.job_stats), 2)
+        groups = processor.summary['groups']
+        self.assertEqual(
+            sorted(groups), ['0:CommandFactory', '1:TaggerFactory']
+        )
+        self.assertEqual(groups['0:CommandFactory']['jobs'], 1)
+        self.assertEqual(groups['1:TaggerFactory']['jobs'], 1)
+        for row in processor.job_stats:
+            self.assertEqual(row[2], 'success')
+            self.assertGreater(row[5], 0.0)
+        if hasattr(os, 'wait4'):
+            for row in processor.job_stats:
+                self.assertGreater(row[7], 0.0)
+                self.assertGreater(row[8], 0)
+
+        # When
+        fname = os.path.join(self._temp, 'report.json')
+        processor.export_report(fname)
+
+        # Then.
+        with open(fname) as fp:
+            data = json.load(fp)
+        self.assertEqual(data['summary']['jobs'], 2)
+        self.assertEqual(len(data['jobs']), 2)
+        self.assertEqual(data['jobs'][0]['group'], '0:CommandFactory')
+
+        # When
+        fname = os.path.join(self._temp, 'report.csv')
+        processor.export_report(fname)
+
+        # Then.
+        with open(fname) as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0][:3], ['group', 'info', 'status'])
+        self.assertEqual(rows[1][0], '0:CommandFactory')
+
+
+class TestPythonFunctionFactory(TestFactoryBase):
+
+    def test_python_function_factory(self):
+        # Given.
+        from textwrap import dedent
+        code = dedent("""
+        def process(relpath, media, dest):
+            media.tags['completed'] = True
+            media.tags['args'] = "%s %s"%(relpath, dest)
+        """)
+        factory = PythonFunctionFactory(code=code, dest=self.root1)
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='args', type='string')])
+        p.scan()
+
+        # When
+        jobs = factory.make_jobs(p.keys(), p)
+
+        # Then.
+        self.assertEqual(len(p._live_media), 0)
+
+        # When
+        for job in jobs:
+            job.run()
+            job.thread.join()
 
         # Then.
         self.assertEqual(len(jobs), 5)
@@ -319,6 +1123,86 @@ class TestPythonFunctionFactory(TestFactoryBase):
         for attr in ['code', '_done']:
             self.assertEqual(getattr(f1, attr), getattr(f, attr))
 
+    def test_python_function_factory_with_process_backend(self):
+        # Given.
+        from textwrap import dedent
+        code = dedent("""
+        import os
+        def process(relpath, media, dest):
+            media.tags['completed'] = True
+            media.tags['args'] = "%s %d" % (relpath, os.getpid())
+        """)
+        factory = PythonFunctionFactory(code=code, dest=self.root1)
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='args', type='string')])
+        p.scan()
+        jobs = factory.make_jobs(p.keys(), p)
+        processor = Processor(
+            jobs=jobs, backend='process', number_of_processes=2
+        )
+
+        # When
+        processor.process()
+
+        # Then.
+        self.assertEqual(processor.status, 'success')
+        self.assertEqual(len(processor.completed), 5)
+        for key in p.keys():
+            media = p.get(key)
+            self.assertEqual(media.tags['completed'], True)
+            relpath, pid = media.tags['args'].split()
+            self.assertEqual(relpath, key)
+            self.assertNotEqual(int(pid), os.getpid())
+            self.assertTrue(factory._done[media.path])
+        self.assertEqual(len(factory.make_jobs(p.keys(), p)), 0)
+
+    def test_process_backend_only_merges_changed_tags(self):
+        # Given.
+        code = "def process(relpath, media, dest):\n" \
+               "    media.tags[%r] = True\n"
+        f1 = PythonFunctionFactory(code=code % 'a', dest=self.root1)
+        f2 = PythonFunctionFactory(code=code % 'b', dest=self.root1)
+        p = Project(name='test', path=self.root)
+        p.add_tags(
+            [TagInfo(name='a', type='bool'), TagInfo(name='b', type='bool')]
+        )
+        p.scan()
+        jobs = f1.make_jobs(p.keys(), p) + f2.make_jobs(p.keys(), p)
+        processor = Processor(
+            jobs=jobs, backend='process', number_of_processes=2
+        )
+
+        # When
+        processor.process()
+
+        # Then.
+        self.assertEqual(processor.status, 'success')
+        for key in p.keys():
+            media = p.get(key)
+            self.assertEqual(media.tags['a'], True)
+            self.assertEqual(media.tags['b'], True)
+
+    def test_errors_in_worker_processes_are_reported(self):
+        # Given.
+        code = "def process(relpath, media, dest):\n    assert 1 == 2\n"
+        factory = PythonFunctionFactory(code=code, dest=self.root1)
+        p = Project(name='test', path=self.root)
+        p.scan()
+        jobs = factory.make_jobs(['hello.py'], p)
+        processor = Processor(jobs=jobs, backend='process')
+
+        # When
+        processor.process()
+
+        # Then.
+        self.assertEqual(processor.status, 'error')
+        self.assertEqual(len(processor.errored_jobs), 1)
+        error = processor.errored_jobs[0].error
+        self.assertIn('RemoteError', error)
+        self.assertIn('in process', error)
+        self.assertIn('AssertionError', error)
+        self.assertEqual(factory._done, {})
+
 
 class TestTaggerFactory(TestFactoryBase):
 
@@ -340,14 +1224,16 @@ class TestTaggerFactory(TestFactoryBase):
 
         # When
         jobs = factory.make_jobs(p.keys(), p)
-        for job in jobs:
-            job.run()
-            job.thread.join()
+
+        # Then.
+        # The media are only made editable when the jobs are run.
+        self.assertEqual(len(p._live_media), 0)
+
+        # When
+        self._run_jobs(jobs)
 
         # Then.
         self.assertEqual(len(jobs), 5)
-        for job in jobs:
-            self.assertEqual(job.status, 'success')
         for key in p.keys():
             media = p.get(key)
             self.assertEqual(media.tags['completed'], True)
@@ -397,6 +1283,219 @@ class TestTaggerFactory(TestFactoryBase):
             self.assertTrue('xxx' not in media.tags)
             self.assertEqual(media.tags['completed'], False)
 
+    def test_tagger_factory_passes_batches_of_paths(self):
+        # Given.
+        code = (
+            'import sys\n'
+            'for path in sys.argv[1:]:\n'
+            '    print(path + ": args: " + str(len(sys.argv) - 1))\n'
+            '    print(path + ": length: " + str(len(path)))\n'
+            'print("unknown.txt: length: 1")\n'
+        )
+        factory = TaggerFactory(command=self._make_tagger(code), batch_size=2)
+        p = Project(name='test', path=self.root)
+        p.add_tags(
+            [
+                TagInfo(name='args', type='string'),
+                TagInfo(name='length', type='int')
+            ]
+        )
+        p.scan()
+
+        # When
+        jobs = factory.make_jobs(p.keys(), p)
+        for job in jobs:
+            job.run()
+            job.thread.join()
+
+        # Then.
+        self.assertEqual(len(jobs), 3)
+        for job in jobs:
+            self.assertEqual(job.status, 'success')
+        counts = sorted(p.get(key).tags['args'] for key in p.keys())
+        self.assertEqual(counts, ['1', '2', '2', '2', '2'])
+        for key in p.keys():
+            media = p.get(key)
+            self.assertEqual(media.tags['length'], len(media.path))
+            self.assertTrue(factory._done[media.path])
+
+        # When
+        jobs = factory.make_jobs(p.keys(), p)
+
+        # Then
+        self.assertEqual(len(jobs), 0)
+
+    def test_tagger_factory_reads_paths_from_stdin_and_writes_json(self):
+        # Given.
+        code = (
+            'import json, sys\n'
+            'for line in sys.stdin:\n'
+            '    path = line.strip()\n'
+            '    data = dict(path=path, completed=True, length=len(path),\n'
+            '                xxx=1)\n'
+            '    print(json.dumps(data))\n'
+            'print("not json")\n'
+        )
+        factory = TaggerFactory(
+            command=self._make_tagger(code), batch_size=10, use_stdin=True,
+            output_format='json'
+        )
+        p = Project(name='test', path=self.root)
+        p.add_tags([TagInfo(name='length', type='int')])
+        p.scan()
+
+        # When
+        jobs = factory.make_jobs(p.keys(), p)
+        for job in jobs:
+            job.run()
+            job.thread.join()
+
+        # Then.
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].status, 'success')
+        for key in p.keys():
+            media = p.get(key)
+            self.assertEqual(media.tags['completed'], True)
+            self.assertEqual(media.tags['length'], len(media.path))
+            self.assertTrue('xxx' not in media.tags)
+
+
+class TestPersistentTagger(TestFactoryBase):
+
+    def test_persistent_tagger_is_started_once(self):
+        # Given.
+        starts = os.path.join(self._temp, 'starts')
+        code = (
+            'import os, sys\n'
+            'open(%r, "a").write("x")\n'
+            'count = 0\n'
+            'for line in iter(sys.stdin.readline, ""):\n'
+            '    count += 1\n'
+            '    print("count: %%d" %% count)\n'
+            '    print("length: %%d" %% len(line.strip()))\n'
+            '    print("---")\n'
+            '    sys.stdout.flush()\n'
+        ) % starts
+        factory = TaggerFactory(
+            command=self._make_tagger(code), persistent=True
+        )
+        p = Project(name='test', path=self.root)
+        p.add_tags(
+            [
+                TagInfo(name='count', type='int'),
+                TagInfo(name='length', type='int')
+            ]
+        )
+        p.scan()
+
+        # When
+        jobs = factory.make_jobs(p.keys(), p)
+        self._run_jobs(jobs)
+
+        # Then.
+        self.assertEqual(len(jobs), 5)
+        for job in jobs:
+            self.assertEqual(job.status, 'success')
+        with open(starts) as fp:
+            self.assertEqual(fp.read(), 'x')
+        counts = sorted(p.get(key).tags['count'] for key in p.keys())
+        self.assertEqual(counts, [1, 2, 3, 4, 5])
+        for key in p.keys():
+            media = p.get(key)
+            self.assertEqual(media.tags['length'], len(media.path))
+
+        # When
+        process = factory._workers[0].process
+        factory.close()
+
+        # Then
+        self.assertEqual(factory._workers, [])
+        self.assertIsNotNone(process.poll())
+        self.assertNotIn('_workers', dump(factory)[1])
+
+    def test_persistent_tagger_crashes_are_retried(self):
+        # Given.
+        crashed = os.path.join(self._temp, 'crashed')
+        code = (
+            'import os, sys\n'
+            'for line in iter(sys.stdin.readline, ""):\n'
+            '    if line.strip().endswith("root.txt"):\n'
+            '        if not os.path.exists(%r):\n'
+            '            open(%r, "w").close()\n'
+            '            sys.exit(1)\n'
+            '        if "always" in sys.argv:\n'
+            '            sys.stderr.write("bad file")\n'
+            '            sys.exit(1)\n'
+            '    print("completed: yes")\n'
+            '    print("---")\n'
+            '    sys.stdout.flush()\n'
+        ) % (crashed, crashed)
+        factory = TaggerFactory(
+            command=self._make_tagger(code), persistent=True
+        )
+        self.addCleanup(factory.close)
+        p = Project(name='test', path=self.root)
+        p.scan()
+
+        # When
+        jobs = factory.make_jobs(p.keys(), p)
+        self._run_jobs(jobs)
+
+        # Then.
+        for job in jobs:
+            self.assertEqual(job.status, 'success')
+        for key in p.keys():
+            self.assertEqual(p.get(key).tags['completed'], True)
+        self.assertEqual(len(factory._workers), 1)
+
+        # Given
+        factory.close()
+        factory.clear()
+        factory.command += ' always'
+        os.remove(crashed)
+
+        # When
+        jobs = factory.make_jobs(p.keys(), p)
+        self._run_jobs(jobs, check=False)
+
+        # Then.
+        errors = [job for job in jobs if job.status == 'error']
+        self.assertEqual(len(errors), 1)
+        self.assertIn('WorkerError', errors[0].error)
+        self.assertIn('bad file', errors[0].error)
+
+    def test_taggers_are_killed_after_timeout(self):
+        # Given.
+        code = (
+            'import sys, time\n'
+            'for line in iter(sys.stdin.readline, ""):\n'
+            '    if line.strip().endswith("root.txt"):\n'
+            '        time.sleep(10)\n'
+            '    print("completed: yes")\n'
+            '    print("---")\n'
+            '    sys.stdout.flush()\n'
+        )
+        for persistent in (True, False):
+            factory = TaggerFactory(
+                command=self._make_tagger(code), persistent=persistent,
+                use_stdin=True, timeout=0.5
+            )
+            self.addCleanup(factory.close)
+            p = Project(name='test', path=self.root)
+            p.scan()
+
+            # When
+            start = time.time()
+            jobs = factory.make_jobs(p.keys(), p)
+            self._run_jobs(jobs, check=False)
+
+            # Then.
+            self.assertTrue(time.time() - start < 5)
+            errors = [job for job in jobs if job.status == 'error']
+            self.assertEqual(len(errors), 1)
+            self.assertIn('JobTimeout', errors[0].error)
+            self.assertTrue(errors[0].inputs[0].endswith('root.txt'))
+
 
 if __name__ == '__main__':
     unittest.main()
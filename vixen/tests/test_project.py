@@ -9,11 +9,15 @@ import time
 import shutil
 import sys
 
+import mock
 import unittest
 from whoosh.fields import TEXT
 
+from vixen import directory, storage
+from vixen.columns import TypedColumn
 from vixen.tests.test_directory import make_data, create_dummy_file
 from vixen.project import Project, TagInfo, get_non_existing_filename, INT
+from vixen.media import get_media_data
 from vixen.processor import CommandFactory
 
 if sys.version_info >= (3, 0):
@@ -74,6 +78,40 @@ class TestProject(TestProjectBase):
         d = p.root.directories[0]
         self.assertEqual(d.relpath, d.name)
 
+    def test_version_2_loads_and_converts_correctly(self):
+        # Given
+        tags = [TagInfo(name='completed', type='bool'),
+                TagInfo(name='comment', type='string')]
+        p = Project(name='test', path=self.root, tags=tags)
+        p.scan()
+        p.get('root.txt').tags['comment'] = 'hello'
+        fname = join(self.root, 'test.vxn')
+        p._save_as_v2(fname)
+
+        # When
+        p1 = Project()
+        p1.load(fname)
+
+        # Then
+        self.assertEqual(p1.number_of_files, 5)
+        self.assertEqual(p1._data, p._data)
+        self.assertEqual(p1._tag_data, p._tag_data)
+        self.assertEqual(p1.get('root.txt').tags['comment'], 'hello')
+
+        # When
+        p1.save_as(fname)
+        p2 = Project()
+        p2.load(fname)
+
+        # Then
+        with open(fname, 'rb') as fp:
+            self.assertEqual(fp.read(5), b'VIXEN')
+        self.assertEqual(p2.number_of_files, 5)
+        self.assertEqual(p2._data, p._data)
+        self.assertEqual(p2._tag_data, p._tag_data)
+        self.assertEqual(p2._relpath2index, p._relpath2index)
+        self.assertEqual(len(p2.root.directories), 2)
+
     def test_project_scan_works(self):
         # Given
         p = Project(name='test', path=self.root)
@@ -91,6 +129,43 @@ class TestProject(TestProjectBase):
         self.assertEqual(len(m.tags), 1)
         self.assertIn('completed', m.tags)
 
+    def test_update_many_appends_and_updates_media(self):
+        # Given
+        tags = [TagInfo(name='completed', type='bool'),
+                TagInfo(name='comment', type='string')]
+        p = Project(name='test', path=self.root, tags=tags, index_text=True)
+        p.scan()
+        p.get('root.txt').tags['comment'] = 'hola'
+        root = p.view('root.txt').to_dict()
+        data = get_media_data(join(self.root, 'root.txt'), 'root.txt')
+        path = join(self.root, 'new.txt')
+        old = data._replace(path=path, relpath='new.txt', file_name='new.txt')
+        new = old._replace(size=42)
+        other = data._replace(
+            path=join(self.root, 'other.txt'), relpath='other.txt',
+            file_name='other.txt'
+        )
+        changed = data._replace(size=1)
+
+        # When
+        with mock.patch('vixen.project.INSERT_BATCH_SIZE', 2):
+            p.update_many([old, changed, new, other])
+
+        # Then
+        self.assertEqual(len(p._relpath2index), 7)
+        self.assertEqual(p.get('new.txt').size, 42)
+        self.assertEqual(p.get('new.txt').tags,
+                         dict(completed=False, comment=''))
+        self.assertEqual(p.view('other.txt').relpath, 'other.txt')
+        self.assertEqual(p.view('root.txt').size, 1)
+        self.assertEqual(p.view('root.txt').tags['comment'], 'hola')
+        self.assertEqual(p.view('root.txt').mtime, root['mtime'])
+        self.assertEqual(
+            sorted(x[1] for x in p.search('new OR other')),
+            ['new.txt', 'other.txt']
+        )
+        self.assertEqual([x[1] for x in p.search('size:42')], ['new.txt'])
+
     def test_project_copy_does_not_copy_data(self):
         # Given
         tags = [TagInfo(name='completed', type='bool'),
@@ -173,6 +248,97 @@ class TestProject(TestProjectBase):
         self.assertEqual(p.get('root.txt')._mtime,
                          p1.get('root.txt')._mtime)
 
+    def test_typed_tags_are_saved_and_loaded(self):
+        # Given
+        tags = [TagInfo(name='completed', type='bool'),
+                TagInfo(name='count', type='int'),
+                TagInfo(name='score', type='float')]
+        p = Project(name='test', path=self.root, tags=tags)
+        p.scan()
+        p.get('root.txt').tags['count'] = 5
+        p.get('hello.py').tags['score'] = None
+        p.get(join('sub', 'sub.txt')).tags['completed'] = 'maybe'
+        self.assertIsInstance(p._tag_data['count'], TypedColumn)
+        fname = join(self._temp, 'test.vxn')
+
+        # When
+        p.save_as(fname)
+        p1 = Project()
+        p1.load(fname)
+
+        # Then
+        for tag in ('completed', 'count', 'score'):
+            self.assertIsInstance(p1._tag_data[tag], TypedColumn)
+        self.assertEqual(p1._tag_data, p._tag_data)
+        self.assertEqual(p1.get('root.txt').tags['count'], 5)
+        self.assertIsNone(p1.get('hello.py').tags['score'])
+        self.assertEqual(
+            p1.get(join('sub', 'sub.txt')).tags['completed'], 'maybe'
+        )
+        self.assertIs(p1.get('root.txt').tags['completed'], False)
+        self.assertEqual([x[1] for x in p1.search('count:5')], ['root.txt'])
+        self.assertEqual(len(list(p1.search('score:>=0'))), 4)
+
+    def test_values_not_fitting_a_typed_tag_are_saved_and_loaded(self):
+        # Given
+        tags = [TagInfo(name='count', type='int')]
+        p = Project(name='test', path=self.root, tags=tags)
+        p.scan()
+        p.get('root.txt').tags['count'] = 7
+        p.get('hello.py').tags['count'] = 2.5
+        fname = join(self._temp, 'test.vxn')
+
+        # When
+        p.save_as(fname)
+        p1 = Project()
+        p1.load(fname)
+
+        # Then
+        self.assertEqual(p1._tag_data['count'], p._tag_data['count'])
+        for key in p.keys():
+            value = p1.get(key).tags['count']
+            self.assertEqual(value, p.get(key).tags['count'])
+            self.assertIs(type(value), type(p.get(key).tags['count']))
+        self.assertIs(type(p1.get('root.txt').tags['count']), int)
+        self.assertIs(type(p1.get('hello.py').tags['count']), float)
+
+    def test_removing_many_media_compacts_the_data(self):
+        # Given
+        p = Project(name='test', path=self.root, index_text=True)
+        p.scan()
+        p.add_tags([TagInfo(name='comment', type='string')])
+        p.set_tags({'comment': dict((k, k) for k in p.keys())})
+        keys = sorted(p.keys())
+        removed = keys[::2]
+        cached = [p.get(k) for k in keys]
+        order = [x for x in p._data['relpath'] if x not in removed]
+
+        # When
+        p.remove(removed)
+
+        # Then
+        self.assertEqual(p._data['relpath'], order)
+        self.assertEqual(len(p._relpath2index), len(order))
+        for key in removed:
+            self.assertFalse(p.has_media(key))
+            self.assertNotIn(key, p._media)
+        for key in keys[1::2]:
+            index = p._relpath2index[key]
+            self.assertEqual(p._data['relpath'][index], key)
+            self.assertEqual(p._tag_data['comment'][index], key)
+            self.assertEqual(p.view(key).file_name, basename(key))
+            self.assertEqual([x[1] for x in p.search('comment:%s' % key)],
+                             [key])
+        for column in list(p._data.values()) + list(p._tag_data.values()):
+            self.assertEqual(len(column), len(order))
+        self.assertEqual(list(p.search('comment:%s' % removed[0])), [])
+
+        # When
+        cached[1].tags['completed'] = True
+
+        # Then
+        self.assertTrue(p.view(keys[1]).tags['completed'])
+
     def test_refresh_removes_non_existing_file_entries(self):
         # Given
         p = Project(name='test', path=self.root)
@@ -199,6 +365,96 @@ class TestProject(TestProjectBase):
             m = p.get(rp)
             self.assertEqual(m.relpath, rp)
 
+    def _make_old(self, path):
+        for root, dirs, files in os.walk(path):
+            t = time.time() - 100
+            os.utime(root, (t, t))
+
+    def test_refresh_only_updates_changed_media(self):
+        # Given
+        self._make_old(self.root)
+        p = Project(name='test', path=self.root)
+        p.scan()
+        m = p.get('hello.py')
+        mtime = os.stat(m.path).st_mtime
+        # Modifying a file does not change the mtime of its directory.
+        with open(m.path, 'w') as fp:
+            fp.write('print("hello world")\n')
+        os.utime(m.path, (mtime + 10, mtime + 10))
+        os.remove(join(self.root, 'sub2', 'sub2.txt'))
+        create_dummy_file(join(self.root, 'sub2', 'new.txt'))
+        self._make_old(join(self.root, 'sub2'))
+        list_directory = mock.Mock(side_effect=directory._list_directory)
+
+        # When
+        with mock.patch('vixen.directory._list_directory', list_directory):
+            result = p.refresh()
+
+        # Then
+        self.assertEqual(result, dict(added=1, removed=1, modified=1))
+        listed = [x[0][0] for x in list_directory.call_args_list]
+        self.assertEqual(listed, [join(self.root, 'sub2')])
+        self.assertEqual(p.number_of_files, 5)
+        self.assertEqual(p.get('hello.py').size, os.stat(m.path).st_size)
+        self.assertTrue(p.has_media(join('sub2', 'new.txt')))
+        self.assertFalse(p.has_media(join('sub2', 'sub2.txt')))
+        self.assertEqual(
+            [x.name for x in p.root.directories if x.name == 'sub2'], ['sub2']
+        )
+        sub2 = [x for x in p.root.directories if x.name == 'sub2'][0]
+        self.assertEqual([x.name for x in sub2.files], ['new.txt'])
+
+        # When
+        result = p.refresh()
+
+        # Then
+        self.assertEqual(result, dict(added=0, removed=0, modified=0))
+
+    def test_refresh_handles_removed_directories(self):
+        # Given
+        self._make_old(self.root)
+        p = Project(name='test', path=self.root)
+        p.scan()
+
+        # When
+        shutil.rmtree(join(self.root, 'sub'))
+        result = p.refresh()
+
+        # Then
+        self.assertEqual(result, dict(added=0, removed=2, modified=0))
+        self.assertEqual(p.number_of_files, 3)
+        self.assertEqual(sorted(x.name for x in p.root.directories),
+                         ['sub2'])
+
+    def test_update_paths_updates_media_and_tree(self):
+        # Given
+        p = Project(name='test', path=self.root)
+        p.scan()
+        os.makedirs(join(self.root, 'new', 'deep'))
+        create_dummy_file(join(self.root, 'new', 'deep', 'a.txt'))
+        create_dummy_file(join(self.root, 'b.txt'))
+        shutil.rmtree(join(self.root, 'sub'))
+
+        # When
+        result = p.update_paths([
+            'sub', join('sub', 'sub.txt'), 'new', join('new', 'deep'),
+            join('new', 'deep', 'a.txt'), 'b.txt', 'root.txt'
+        ])
+
+        # Then
+        self.assertEqual(result, dict(added=2, removed=2, modified=0))
+        self.assertEqual(p.number_of_files, 5)
+        self.assertTrue(p.has_media(join('new', 'deep', 'a.txt')))
+        self.assertTrue(p.has_media('b.txt'))
+        self.assertFalse(p.has_media(join('sub', 'subsub', 'subsub.txt')))
+        self.assertIsNone(p.root.find('sub'))
+        self.assertEqual(
+            [f.name for f in p.root.find(join('new', 'deep')).files],
+            ['a.txt']
+        )
+        self.assertEqual(sorted(f.name for f in p.root.files),
+                         ['b.txt', 'hello.py', 'root.txt'])
+
     def test_export_to_csv_with_unicode(self):
         # Given
         tags = [TagInfo(name='completed', type='bool'),
@@ -267,6 +523,152 @@ class TestProject(TestProjectBase):
         m = p.get(join('sub', 'sub1.txt'))
         self.assertEqual(m.tags['completed'], False)
 
+    def test_view_reads_the_media_data(self):
+        # Given
+        p = Project(name='test', path=self.root)
+        p.scan()
+        cached = len(p._media)
+
+        # When
+        v = p.view('root.txt')
+
+        # Then
+        self.assertEqual(len(p._media), cached)
+        m = p.get('root.txt')
+        for attr in ('path', 'relpath', 'file_name', 'size', 'type', 'mtime',
+                     'ctime', '_mtime', '_ctime', 'tags'):
+            self.assertEqual(getattr(v, attr), getattr(m, attr))
+        self.assertEqual(v.to_dict(), m.to_dict())
+
+        # When
+        m.tags['completed'] = True
+
+        # Then
+        self.assertEqual(v.tags['completed'], True)
+        with self.assertRaises(AttributeError):
+            v.path = 'xxx'
+        with self.assertRaises(AttributeError):
+            v.xxx = 1
+        with self.assertRaises(KeyError):
+            p.view('xxx')
+
+    def test_media_cache_is_bounded(self):
+        # Given
+        p = Project(name='test', path=self.root, media_cache_size=2)
+        p.scan()
+        keys = sorted(p.keys())
+
+        # When
+        media = [p.get(key) for key in keys[:3]]
+
+        # Then
+        self.assertEqual(list(p._media), keys[1:3])
+        self.assertIs(p.get(keys[1]), media[1])
+        self.assertEqual(list(p._media), [keys[2], keys[1]])
+
+        # When
+        # Changes to the tags of an evicted media are still saved.
+        media[0].tags['completed'] = True
+
+        # Then
+        # The same instance is returned while it is in use.
+        self.assertIs(p.get(keys[0]), media[0])
+        self.assertEqual(p.view(keys[0]).tags['completed'], True)
+        self.assertEqual(len(p._media), 2)
+
+        # When
+        p.get(keys[3])
+        p.get(keys[4])
+        p.add_tags([TagInfo(name='rating', type='int')])
+        p.set_tags(dict(rating=2), [keys[0]])
+
+        # Then
+        # Evicted media in use are kept in step with the project.
+        self.assertNotIn(keys[0], p._media)
+        self.assertEqual(media[0].tags['rating'], 2)
+
+        # When
+        p.update_tags([TagInfo(name='rating', type='int')])
+
+        # Then
+        self.assertNotIn('completed', media[0].tags)
+
+        # When
+        media[0].tags['completed'] = False
+
+        # Then
+        self.assertEqual(p.view(keys[0]).tags, dict(rating=2))
+
+        # When
+        del media[:]
+
+        # Then
+        self.assertEqual(sorted(p._live_media.keys()), sorted(p._media))
+
+    def test_set_tags_updates_many_media_at_once(self):
+        # Given
+        p = Project(name='test', path=self.root, index_text=True)
+        p.scan()
+        p.add_tags([TagInfo(name='comment', type='string')])
+        cached = p.get('root.txt')
+        events = []
+
+        def _updated(value):
+            events.append(value)
+
+        p.on_trait_change(_updated, 'tags_updated')
+
+        # When
+        n = p.set_tags({'completed': True, 'comment': 'hi'}, 'txt')
+
+        # Then
+        self.assertEqual(n, 4)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(sorted(events[0]['tags']), ['comment', 'completed'])
+        self.assertEqual(len(events[0]['relpaths']), 4)
+        self.assertEqual(cached.tags['completed'], True)
+        self.assertEqual(cached.tags['comment'], 'hi')
+        self.assertEqual(p.view('hello.py').tags['completed'], False)
+        hits = sorted(x[1] for x in p.search('comment:hi'))
+        self.assertEqual(hits, sorted(k for k in p.keys() if k != 'hello.py'))
+        self.assertEqual(len(list(p.search('completed:1'))), 4)
+
+        # When
+        n = p.set_tags({'completed': False}, p.search('hello OR root'))
+
+        # Then
+        self.assertEqual(n, 2)
+        self.assertEqual(cached.tags['completed'], False)
+        self.assertEqual(len(list(p.search('completed:1'))), 3)
+
+        # When
+        mask = [x.endswith('.py') for x in p._data['relpath']]
+        n = p.set_tags({'comment': 'python'}, mask)
+
+        # Then
+        self.assertEqual(n, 1)
+        self.assertEqual(p.view('hello.py').tags['comment'], 'python')
+
+        # When
+        n = p.set_tags({'comment': {'root.txt': 'a', 'hello.py': 'b'}},
+                       ['root.txt', 'xxx'])
+
+        # Then
+        self.assertEqual(n, 1)
+        self.assertEqual(cached.tags['comment'], 'a')
+        self.assertEqual(p.view('hello.py').tags['comment'], 'python')
+
+        # When
+        n = p.set_tags({'comment': {'root.txt': 'c', 'hello.py': 'd'}})
+
+        # Then
+        self.assertEqual(n, 2)
+        self.assertEqual(cached.tags['comment'], 'c')
+        self.assertEqual(p.view('hello.py').tags['comment'], 'd')
+        self.assertEqual(len(events), 5)
+        self.assertRaises(ValueError, p.set_tags, {'xxx': 1})
+        self.assertRaises(ValueError, p.set_tags, {'comment': 'x'}, [True])
+
     def test_update_tags_updates_existing_media(self):
         # Given
         p = Project(name='test', path=self.root)
@@ -692,5 +1094,237 @@ class TestSearchMedia(TestProjectBase):
         self.assertEqual(result[0][0], 'root.txt')
 
 
+class TestIndexedSearch(TestProjectBase):
+    def _make_project(self):
+        tags = [TagInfo(name='completed', type='bool'),
+                TagInfo(name='comment', type='string')]
+        p = Project(name='test', path=self.root, tags=tags, index_text=True)
+        p.scan()
+        return p
+
+    def _search(self, p, q):
+        return sorted(x[1] for x in p.search(q))
+
+    def test_indexed_search_matches_unindexed_search(self):
+        # Given
+        p = self._make_project()
+        p.get('root.txt').tags['comment'] = 'Hola how are you?'
+        queries = [
+            'hello', 'sub', 'hello OR subsub', 'NOT .txt',
+            'type:text AND NOT sub2', 'comment:"hola how"', 'file_name:t',
+            'completed:0'
+        ]
+
+        for q in queries:
+            # When
+            p.index_text = True
+            indexed = self._search(p, q)
+            p.index_text = False
+            expected = self._search(p, q)
+
+            # Then
+            self.assertEqual(indexed, expected, q)
+
+    def test_index_is_updated_with_the_project(self):
+        # Given
+        p = self._make_project()
+        self.assertEqual(self._search(p, 'comment:hola'), [])
+
+        # When
+        p.get('root.txt').tags['comment'] = 'hola'
+
+        # Then
+        self.assertEqual(self._search(p, 'comment:hola'), ['root.txt'])
+
+        # When
+        p.remove(['root.txt', 'hello.py'])
+
+        # Then
+        self.assertEqual(self._search(p, 'comment:hola'), [])
+        self.assertEqual(self._search(p, 'hello'), [])
+        self.assertEqual(
+            self._search(p, 'sub'),
+            [join('sub', 'sub.txt'), join('sub', 'subsub', 'subsub.txt'),
+             join('sub2', 'sub2.txt')]
+        )
+
+        # When
+        p.add_tags([TagInfo(name='note', type='text')])
+        p.get(join('sub2', 'sub2.txt')).tags['note'] = 'A Fox'
+
+        # Then
+        self.assertEqual(self._search(p, 'note:fox'),
+                         [join('sub2', 'sub2.txt')])
+
+    def test_index_is_saved_and_loaded(self):
+        # Given
+        p = self._make_project()
+        p.get('root.txt').tags['comment'] = 'hola'
+        self.assertEqual(self._search(p, 'comment:hola'), ['root.txt'])
+        fname = join(self._temp, 'test.vxn')
+
+        # When
+        p.save_as(fname)
+        p1 = Project()
+        p1.load(fname)
+
+        # Then
+        self.assertTrue(p1.index_text)
+        self.assertIsNotNone(p1._text_index)
+        self.assertEqual(self._search(p1, 'comment:hola'), ['root.txt'])
+
+    def test_range_searches_are_updated_with_the_project(self):
+        # Given
+        tags = [TagInfo(name='fox', type='int')]
+        p = Project(name='test', path=self.root, tags=tags)
+        p.scan()
+        self.assertEqual(self._search(p, 'fox:>=1'), [])
+        self.assertEqual(len(self._search(p, 'size:<1000')), 5)
+
+        # When
+        p.get('root.txt').tags['fox'] = 2
+        p.get('hello.py').tags['fox'] = 1
+
+        # Then
+        self.assertEqual(self._search(p, 'fox:>=1'), ['hello.py', 'root.txt'])
+        self.assertEqual(self._search(p, 'fox:>1'), ['root.txt'])
+
+        # When
+        with open(join(self.root, 'root.txt'), 'w') as fp:
+            fp.write('x'*2000)
+        p.refresh()
+
+        # Then
+        self.assertEqual(self._search(p, 'size:>1000'), ['root.txt'])
+        self.assertEqual(self._search(p, 'fox:>1'), ['root.txt'])
+
+        # When
+        p.remove(['hello.py'])
+
+        # Then
+        self.assertEqual(self._search(p, 'fox:>=1'), ['root.txt'])
+        self.assertEqual(len(self._search(p, 'size:<1000')), 3)
+
+
+class TestJournal(TestProjectBase):
+    def _make_project(self):
+        save_file = join(self._temp, 'test.vxn')
+        tags = [TagInfo(name='completed', type='bool'),
+                TagInfo(name='comment', type='string')]
+        p = Project(name='test', path=self.root, tags=tags, journal=True,
+                    save_file=save_file)
+        p.scan()
+        p.save()
+        return p
+
+    def test_changes_are_saved_to_the_journal(self):
+        # Given
+        p = self._make_project()
+        self.assertFalse(exists(p.journal_file))
+        mtime = os.stat(p.save_file).st_mtime
+
+        # When
+        p.get('root.txt').tags['comment'] = 'hola'
+        p.get('hello.py').tags['completed'] = True
+        p.remove([join('sub', 'sub.txt')])
+        p.save()
+
+        # Then
+        self.assertTrue(exists(p.journal_file))
+        self.assertEqual(os.stat(p.save_file).st_mtime, mtime)
+
+        # When
+        p1 = Project(name='test', save_file=p.save_file)
+        p1.load()
+
+        # Then
+        self.assertTrue(p1.journal)
+        self.assertEqual(p1.number_of_files, 4)
+        self.assertFalse(p1.has_media(join('sub', 'sub.txt')))
+        self.assertEqual(p1.get('root.txt').tags['comment'], 'hola')
+        self.assertTrue(p1.get('hello.py').tags['completed'])
+        self.assertEqual(
+            [x[1] for x in p1.search('comment:hola')], ['root.txt']
+        )
+
+    def test_bulk_tag_changes_are_saved_to_the_journal(self):
+        # Given
+        p = self._make_project()
+
+        # When
+        p.set_tags({'completed': True, 'comment': 'bulk'}, 'txt')
+        p.save()
+
+        # Then
+        self.assertTrue(exists(p.journal_file))
+        self.assertEqual(len(storage.Journal(p.journal_file).read()), 2)
+
+        # When
+        p1 = Project(name='test', save_file=p.save_file)
+        p1.load()
+
+        # Then
+        for key in p1.keys():
+            tags = p1.view(key).tags
+            self.assertEqual(tags['completed'], key != 'hello.py')
+            self.assertEqual(tags['comment'],
+                             '' if key == 'hello.py' else 'bulk')
+
+    def test_journal_is_compacted(self):
+        # Given
+        p = self._make_project()
+        p.journal_limit = 1
+
+        # When
+        p.get('root.txt').tags['comment'] = 'hola'
+        p.save()
+
+        # Then
+        self.assertTrue(exists(p.journal_file))
+
+        # When
+        p.get('hello.py').tags['comment'] = 'hello'
+        p.save()
+
+        # Then
+        self.assertFalse(exists(p.journal_file))
+        p1 = Project(name='test', save_file=p.save_file)
+        p1.load()
+        self.assertEqual(p1.get('root.txt').tags['comment'], 'hola')
+        self.assertEqual(p1.get('hello.py').tags['comment'], 'hello')
+
+    def test_settings_changes_do_a_full_save(self):
+        # Given
+        p = self._make_project()
+        p.get('root.txt').tags['comment'] = 'hola'
+        p.save()
+        self.assertTrue(exists(p.journal_file))
+
+        # When
+        p.description = 'new description'
+        p.save()
+
+        # Then
+        self.assertFalse(exists(p.journal_file))
+        p1 = Project(name='test', save_file=p.save_file)
+        p1.load()
+        self.assertEqual(p1.description, 'new description')
+        self.assertEqual(p1.get('root.txt').tags['comment'], 'hola')
+
+    def test_journal_is_moved_when_name_changes(self):
+        # Given
+        p = self._make_project()
+        p.get('root.txt').tags['comment'] = 'hola'
+        p.save()
+        old_journal = p.journal_file
+
+        # When
+        p.name = 'new'
+
+        # Then
+        self.assertFalse(exists(old_journal))
+        self.assertTrue(exists(p.journal_file))
+
+
 if __name__ == '__main__':
     unittest.main()
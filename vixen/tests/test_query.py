@@ -0,0 +1,113 @@
+import unittest
+
+from whoosh import query
+
+from vixen.query import compile_query
+
+
+class TestCompileQuery(unittest.TestCase):
+    def setUp(self):
+        self.columns = dict(
+            path=['/a/hello.py', '/a/root.txt', '/a/sub/Hello.txt',
+                  '/b/other.md'],
+            size=[10, 200, 3000, 40000],
+            completed=[False, True, True, False],
+        )
+        self.n = 4
+
+    def _search(self, expr):
+        plan = compile_query(expr)
+        return plan(self.columns.get, self.n)
+
+    def test_term_matches_substrings_ignoring_case(self):
+        # When
+        result = self._search(query.Term('path', 'hello'))
+
+        # Then
+        self.assertEqual(result, set([0, 2]))
+
+    def test_term_with_non_string_value_checks_equality(self):
+        # When
+        result = self._search(query.Term('completed', True))
+
+        # Then
+        self.assertEqual(result, set([1, 2]))
+
+    def test_phrase_matches_joined_words(self):
+        # Given
+        self.columns['path'][3] = 'Hola how are you'
+
+        # When
+        result = self._search(query.Phrase('path', ['hola', 'how']))
+
+        # Then
+        self.assertEqual(result, set([3]))
+
+    def test_numeric_ranges(self):
+        # When
+        result = self._search(query.NumericRange('size', 200, None))
+
+        # Then
+        self.assertEqual(result, set([1, 2, 3]))
+
+        # When
+        result = self._search(
+            query.NumericRange('size', 200, 3000, startexcl=True)
+        )
+
+        # Then
+        self.assertEqual(result, set([2]))
+
+        # When
+        result = self._search(
+            query.NumericRange('size', None, 3000, endexcl=True)
+        )
+
+        # Then
+        self.assertEqual(result, set([0, 1]))
+
+    def test_logical_operations(self):
+        # Given
+        hello = query.Term('path', 'hello')
+        txt = query.Term('path', '.txt')
+
+        # When
+        result = self._search(query.And([hello, txt]))
+
+        # Then
+        self.assertEqual(result, set([2]))
+
+        # When
+        result = self._search(query.Or([hello, txt]))
+
+        # Then
+        self.assertEqual(result, set([0, 1, 2]))
+
+        # When
+        result = self._search(query.And([hello, query.Not(txt)]))
+
+        # Then
+        self.assertEqual(result, set([0]))
+
+        # When
+        result = self._search(query.Not(query.Or([hello, txt])))
+
+        # Then
+        self.assertEqual(result, set([3]))
+
+        # When
+        result = self._search(query.And([query.Not(hello)]))
+
+        # Then
+        self.assertEqual(result, set([1, 3]))
+
+    def test_unsupported_terms_match_nothing(self):
+        # When
+        result = self._search(query.Prefix('path', 'hel'))
+
+        # Then
+        self.assertEqual(result, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
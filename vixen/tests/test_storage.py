@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from vixen import storage
+
+
+class TestColumns(unittest.TestCase):
+    def _check_round_trip(self, values, kind):
+        # When
+        encoded_kind, sections = storage.encode_column(values)
+        result = storage.decode_column(encoded_kind, sections)
+
+        # Then
+        self.assertEqual(encoded_kind, kind)
+        self.assertEqual(result, values)
+        self.assertEqual([type(x) for x in result],
+                         [type(x) for x in values])
+
+    def test_typed_columns_round_trip(self):
+        self._check_round_trip([True, False, True], 'bool')
+        self._check_round_trip([1, -2, 2**40], 'int')
+        self._check_round_trip([1.5, -2.0, 0.0], 'float')
+        self._check_round_trip([u'a', u'', u'न Kévin', u'a'], 'str')
+
+    def test_other_columns_are_stored_as_json(self):
+        self._check_round_trip([], 'json')
+        self._check_round_trip([u'a', None], 'json')
+        self._check_round_trip([u'a\0b'], 'json')
+        self._check_round_trip([2**70, 1], 'json')
+        self._check_round_trip([7, 2.5, 0], 'json')
+        self._check_round_trip([True, 1], 'json')
+
+    def test_strings_are_pooled(self):
+        # When
+        kind, sections = storage.encode_column([u'video'] * 100)
+        result = storage.decode_column(kind, sections)
+
+        # Then
+        self.assertEqual(len(set(id(x) for x in result)), 1)
+
+
+class TestFile(unittest.TestCase):
+    def setUp(self):
+        self._temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp)
+
+    def _make_data(self):
+        return dict(
+            name=u'test', tags=[[u'completed', u'bool']],
+            media_data=dict(relpath=[u'a.txt', u'b/c.txt'], size=[10, 20]),
+            tag_data=dict(completed=[True, False])
+        )
+
+    def test_dump_and_load_file(self):
+        # Given
+        data = self._make_data()
+        fname = os.path.join(self._temp, 'test.vxn')
+
+        # When
+        with open(fname, 'wb') as fp:
+            storage.dump(data, fp)
+        with open(fname, 'rb') as fp:
+            self.assertTrue(storage.is_columnar(fp))
+            self.assertEqual(fp.tell(), 0)
+            result = storage.load(fp)
+
+        # Then
+        self.assertEqual(result['version'], 3)
+        self.assertEqual(result['name'], u'test')
+        self.assertEqual(result['tags'], data['tags'])
+        self.assertEqual(result['media_data'], data['media_data'])
+        self.assertEqual(result['tag_data'], data['tag_data'])
+        self.assertEqual(result['relpath2index'], {u'a.txt': 0, u'b/c.txt': 1})
+
+    def test_dump_and_load_file_object_without_fileno(self):
+        # Given
+        data = self._make_data()
+        fp = io.BytesIO()
+
+        # When
+        storage.dump(data, fp)
+        fp.seek(0)
+        result = storage.load(fp)
+
+        # Then
+        self.assertEqual(result['media_data'], data['media_data'])
+
+    def test_is_columnar_is_false_for_other_files(self):
+        self.assertFalse(storage.is_columnar(io.BytesIO(b'{"version": 2}')))
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self._temp = tempfile.mkdtemp()
+        self.journal = storage.Journal(os.path.join(self._temp, 'journal'))
+
+    def tearDown(self):
+        shutil.rmtree(self._temp)
+
+    def test_append_and_read(self):
+        # Given
+        self.assertFalse(self.journal.exists())
+        self.assertEqual(self.journal.read(), [])
+
+        # When
+        self.journal.append([['tag', u'a.txt', u'comment', u'न Kévin']])
+        self.journal.append([['remove', [u'b.txt']]])
+
+        # Then
+        self.assertEqual(
+            self.journal.read(),
+            [['tag', u'a.txt', u'comment', u'न Kévin'],
+             ['remove', [u'b.txt']]]
+        )
+
+        # When
+        self.journal.clear()
+
+        # Then
+        self.assertFalse(self.journal.exists())
+
+    def test_partially_written_entries_are_skipped(self):
+        # Given
+        self.journal.append([['remove', [u'a.txt']]])
+        with open(self.journal.path, 'a') as fp:
+            fp.write('["remove", ["b.t')
+
+        # When
+        result = self.journal.read()
+
+        # Then
+        self.assertEqual(result, [['remove', [u'a.txt']]])
+
+        # When
+        self.journal.append([['remove', [u'c.txt']]])
+
+        # Then
+        self.assertEqual(
+            self.journal.read(),
+            [['remove', [u'a.txt']], ['remove', [u'c.txt']]]
+        )
+
+    def test_rewrite_replaces_the_journal(self):
+        # Given
+        self.journal.append([['remove', [u'a.txt']]])
+
+        # When
+        self.journal.rewrite([['remove', [u'b.txt']]])
+        self.journal.append([['remove', [u'c.txt']]])
+
+        # Then
+        self.assertEqual(
+            self.journal.read(),
+            [['remove', [u'b.txt']], ['remove', [u'c.txt']]]
+        )
+        self.assertEqual(os.listdir(self._temp), ['journal'])
+
+
+if __name__ == '__main__':
+    unittest.main()
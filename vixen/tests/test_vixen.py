@@ -8,6 +8,7 @@ from vixen.processor import PythonFunctionFactory
 from vixen.project import Project, TagInfo
 from vixen.vixen import VixenUI, Vixen, UIErrorHandler, is_valid_tag
 from vixen.vixen_ui import get_html, get_html_file
+from vixen.watcher import Watcher
 
 from vixen.tests.test_project import TestProjectBase
 
@@ -338,6 +339,23 @@ class TestProjectEditor(TestVixenBase):
         # Then
         self.assertEqual(len(editor.processors), 0)
 
+    def test_remove_processor_updates_sources(self):
+        # Given
+        ui = self.ui
+        editor = ui.editor
+        ui.edit(self.p)
+        for name in ['command', 'tagger', 'python', 'tagger']:
+            editor.add_processor(name)
+        editor.processors[1].source = 0
+        editor.processors[3].source = 2
+
+        # When
+        editor.remove_processor(0)
+
+        # Then
+        sources = [proc.source for proc in editor.processors]
+        self.assertEqual(sources, [-1, -1, 1])
+
 
 class TestVixenUI(TestVixenBase):
 
@@ -538,6 +556,7 @@ class TestVixenUI(TestVixenBase):
         ui.viewer.search = 'root.txt'
         ui.viewer.do_search()
         ui.process(p)
+        ui.processor.wait()
 
         # Then
         self.assertEqual(p.get('root.txt').tags['completed'], True)
@@ -546,11 +565,84 @@ class TestVixenUI(TestVixenBase):
         # When
         ui.viewer.clear_search()
         ui.process(p)
+        ui.processor.wait()
 
         # Then
         for m in p.keys():
             self.assertEqual(p.get(m).tags['completed'], True)
 
+    def test_process_resumes_jobs_done_before_project_was_saved(self):
+        # Given
+        ui = VixenUI()
+        vixen = ui.vixen
+        ui.add_project()
+        p = vixen.projects[0]
+        p.path = self.root
+        p.scan()
+        from textwrap import dedent
+        code = dedent("""
+        def process(relpath, media, dest):
+            media.tags['completed'] = True
+        """)
+        p.processors = [PythonFunctionFactory(code=code, dest=self.root)]
+        p.save()
+        ui.process(p)
+        ui.processor.wait()
+        self.assertTrue(os.path.exists(p.ledger_file))
+
+        # When
+        # The project is loaded again as if ViXeN was killed.
+        p1 = Project(name=p.name, save_file=p.save_file)
+        p1.load()
+        self.assertEqual(p1.get('root.txt').tags['completed'], False)
+        ui.process(p1)
+        ui.processor.wait()
+
+        # Then
+        self.assertEqual(ui.processor.status, 'success')
+        self.assertEqual(ui.processor.number_of_jobs, 0)
+        self.assertEqual(ui.processor.ledger.resumed, 5)
+        for m in p1.keys():
+            self.assertEqual(p1.get(m).tags['completed'], True)
+
+        # When
+        p1.save()
+
+        # Then
+        self.assertFalse(os.path.exists(p1.ledger_file))
+        self.assertEqual(len(p1.processors[0].make_jobs(p1.keys(), p1)), 0)
+
+    def test_viewer_starts_one_watcher_for_the_project(self):
+        # Given
+        ui = VixenUI()
+        vixen = ui.vixen
+        ui.add_project()
+        p = vixen.projects[0]
+        p.path = self.root
+        p.scan()
+        p.watch = True
+        p.save()
+        p1 = Project(name=p.name, save_file=p.save_file)
+
+        # When
+        with mock.patch.object(Watcher, 'start') as start, \
+                mock.patch.object(Watcher, 'stop') as stop:
+            ui.view(p1)
+
+            # Then
+            self.assertTrue(p1.watch)
+            self.assertEqual(start.call_count, 1)
+            self.assertEqual(stop.call_count, 0)
+            self.assertIs(ui.viewer.watcher.project, p1)
+
+            # When
+            p1.watch = False
+
+            # Then
+            self.assertEqual(start.call_count, 1)
+            self.assertEqual(stop.call_count, 1)
+            self.assertIsNone(ui.viewer.watcher)
+
     def test_viewer_rescan(self):
         # Given
         ui = VixenUI()
@@ -0,0 +1,162 @@
+import os
+from os.path import join
+import shutil
+import tempfile
+import time
+import unittest
+
+from vixen.project import Project
+from vixen.tests.test_directory import make_data, create_dummy_file
+from vixen import watcher
+from vixen.watcher import Inotify, Poller, Watcher, REFRESH_ALL
+
+
+def wait_for(condition, timeout=5.0):
+    start = time.time()
+    while not condition() and time.time() - start < timeout:
+        time.sleep(0.02)
+    return condition()
+
+
+class TestWatcherBase(unittest.TestCase):
+    def setUp(self):
+        self._temp = tempfile.mkdtemp()
+        self.root = join(self._temp, 'test')
+        make_data(self._temp)
+        self.project = Project(name='test', path=self.root)
+        self.project.scan()
+        self.batches = []
+
+    def tearDown(self):
+        shutil.rmtree(self._temp)
+
+    def _on_changed(self, counts):
+        self.batches.append(counts)
+
+    def _make_watcher(self, **kw):
+        w = Watcher(project=self.project, delay=0.1, **kw)
+        w.on_trait_change(self._on_changed, 'changed')
+        self.addCleanup(w.stop)
+        return w
+
+
+class TestPolling(TestWatcherBase):
+    def test_poller_asks_for_refresh(self):
+        # Given
+        poller = Poller(0.1)
+
+        # When/Then
+        self.assertEqual(poller.read(0.01), [])
+        time.sleep(0.1)
+        self.assertIs(poller.read(0.01), REFRESH_ALL)
+
+    def test_watcher_refreshes_project(self):
+        # Given
+        w = self._make_watcher(backend='poll', poll_interval=0.1)
+        w.start()
+
+        # When
+        create_dummy_file(join(self.root, 'sub', 'new.txt'))
+        os.remove(join(self.root, 'root.txt'))
+
+        # Then
+        p = self.project
+        self.assertTrue(wait_for(lambda: len(self.batches) > 0))
+        self.assertTrue(p.has_media(join('sub', 'new.txt')))
+        self.assertFalse(p.has_media('root.txt'))
+
+        # When
+        w.stop()
+
+        # Then
+        self.assertFalse(w.running)
+
+    def test_watcher_dispatches_the_changes(self):
+        # Given
+        pending = []
+        w = self._make_watcher(
+            backend='poll', poll_interval=0.1, dispatch=pending.append
+        )
+        w.start()
+        p = self.project
+
+        # When
+        create_dummy_file(join(self.root, 'sub', 'new.txt'))
+
+        # Then
+        # The changes are only applied when the dispatched function is run.
+        self.assertTrue(wait_for(lambda: len(pending) > 0))
+        self.assertFalse(p.has_media(join('sub', 'new.txt')))
+
+        # When
+        pending.pop(0)()
+
+        # Then
+        self.assertTrue(p.has_media(join('sub', 'new.txt')))
+        self.assertEqual(self.batches, [dict(added=1, removed=0, modified=0)])
+
+        # When
+        os.remove(join(self.root, 'root.txt'))
+        self.assertTrue(wait_for(lambda: len(pending) > 0))
+        w.stop()
+        pending[-1]()
+
+        # Then
+        # Nothing is applied once the watcher is stopped.
+        self.assertTrue(p.has_media('root.txt'))
+
+
+@unittest.skipIf(watcher._load_libc() is None, 'inotify is not available')
+class TestInotify(TestWatcherBase):
+    def test_inotify_reports_changed_paths(self):
+        # Given
+        source = Inotify(self.root)
+        self.addCleanup(source.close)
+
+        # When
+        create_dummy_file(join(self.root, 'sub', 'new.txt'))
+        os.mkdir(join(self.root, 'new'))
+        os.remove(join(self.root, 'root.txt'))
+
+        # Then
+        paths = set()
+        for i in range(5):
+            paths.update(source.read(0.1))
+        self.assertEqual(paths, set([join('sub', 'new.txt'), 'new',
+                                     'root.txt']))
+
+        # When
+        create_dummy_file(join(self.root, 'new', 'x.txt'))
+
+        # Then
+        self.assertEqual(set(source.read(1.0)), set([join('new', 'x.txt')]))
+
+    def test_watcher_applies_changes_in_batches(self):
+        # Given
+        w = self._make_watcher(backend='inotify')
+        w.start()
+        time.sleep(0.1)
+        p = self.project
+
+        # When
+        os.mkdir(join(self.root, 'new'))
+        for i in range(200):
+            create_dummy_file(join(self.root, 'new', '%d.txt' % i))
+        create_dummy_file(join(self.root, 'sub', 'sub.txt'))
+        os.utime(join(self.root, 'sub', 'sub.txt'), (0, 0))
+        shutil.move(join(self.root, 'sub2'), join(self.root, 'sub3'))
+
+        # Then
+        self.assertTrue(wait_for(lambda: p.number_of_files == 205))
+        time.sleep(0.3)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.batches[0],
+                         dict(added=201, removed=1, modified=1))
+        self.assertTrue(p.has_media(join('sub3', 'sub2.txt')))
+        self.assertFalse(p.has_media(join('sub2', 'sub2.txt')))
+        names = sorted(d.name for d in p.root.directories)
+        self.assertEqual(names, ['new', 'sub', 'sub3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,15 +10,18 @@ from random import shuffle
 import subprocess
 import sys
 from traits.api import (Any, Bool, DelegatesTo, Dict, Enum, HasTraits,
-                        Instance, Int, List, Property, Str, Tuple)
+                        Instance, Int, List, Property, Str, Tuple,
+                        on_trait_change)
 from whoosh.fields import Schema, TEXT, FieldConfigurationError
 
 from .project import Project, TagInfo, get_project_dir
 from .directory import File, Directory
 from .media import Media
 from .processor import (FactoryBase, CommandFactory, Processor,
-                        PythonFunctionFactory, TaggerFactory, Job)
+                        PythonFunctionFactory, TaggerFactory, Job,
+                        JobLedger, iter_pipeline_jobs)
 from .ui_utils import askopenfilename, askdirectory, asksaveasfilename
+from .watcher import Watcher
 
 
 logger = logging.getLogger(__name__)
@@ -37,6 +40,14 @@ def is_valid_tag(tag):
         return True, 'OK'
 
 
+def call_in_ui_thread(func):
+    """Run the function later in the thread running the UI's ioloop.  This
+    may be called from any thread.
+    """
+    from tornado.ioloop import IOLoop
+    IOLoop.instance().add_callback(func)
+
+
 class UIErrorHandler(Handler):
     """Simple logging handler to let the user know if there was
     an internal error.
@@ -85,6 +96,10 @@ class Vixen(HasTraits):
     def remove(self, project):
         if exists(project.save_file):
             os.remove(project.save_file)
+        if exists(project.journal_file):
+            os.remove(project.journal_file)
+        if exists(project.ledger_file):
+            os.remove(project.ledger_file)
         self.projects.remove(project)
         self.save()
 
@@ -106,6 +121,7 @@ class ProjectEditor(HasTraits):
     name = Str
     description = Str
     path = Str
+    watch = Bool
     tags = List(TagInfo)
 
     extensions = List(Str)
@@ -184,6 +200,11 @@ class ProjectEditor(HasTraits):
     def remove_processor(self, index):
         logger.info('Removing processor: %s', self.processors[index].name)
         del self.processors[index]
+        for proc in self.processors[index:]:
+            if proc.source == index:
+                proc.source = -1
+            elif proc.source > index:
+                proc.source -= 1
 
     def select_path(self):
         initialdir = self.path if len(self.path) > 0 else None
@@ -219,6 +240,7 @@ class ProjectEditor(HasTraits):
                 cp.name = self.name
                 cp.description = self.description
                 cp.path = self.path
+                cp.watch = self.watch
                 cp.extensions = self.extensions
                 cp.processors = self.processors
                 cp.update_tags(self.tags)
@@ -231,12 +253,21 @@ class ProjectEditor(HasTraits):
         with self.ui.busy():
             proj = self.project
             jobs = []
+            index = self.processors.index(proc)
+            source = None
+            if 0 <= proc.source < index:
+                source = self.processors[proc.source]
             for key in proj.keys():
                 test_media = [key]
-                jobs = proc.make_jobs(test_media, proj)
+                if source is None:
+                    jobs = proc.make_jobs(test_media, proj)
+                else:
+                    path = source.get_output(proj.view(key))
+                    if path is None or not os.path.exists(path):
+                        continue
+                    jobs = proc.make_jobs(test_media, proj, {key: path})
                 if len(jobs) > 0:
                     break
-            index = self.processors.index(proc)
             self.clear_test_info(index)
             if len(jobs) == 0:
                 self.test_job_status[index] = 'Error'
@@ -246,6 +277,7 @@ class ProjectEditor(HasTraits):
                 job.run()
                 job.thread.join()
                 proc.clear()
+                proc.close()
 
     def clear_test_info(self, index):
         if index in self.test_job:
@@ -261,6 +293,7 @@ class ProjectEditor(HasTraits):
                 self.name = proj.name
                 self.description = proj.description
                 self.path = proj.path
+                self.watch = proj.watch
                 self.tags = copy.deepcopy(proj.tags)
                 self.extensions = list(proj.extensions)
                 self.processors = proj.processors
@@ -417,6 +450,9 @@ class ProjectViewer(HasTraits):
 
     type = Enum("unknown", "image", "video", "audio")
 
+    # Watches the project directory when the project's watch option is set.
+    watcher = Instance(Watcher)
+
     def go_to_parent(self):
         if self.parent is not None and not self.is_searching:
             self.current_dir = self.parent
@@ -471,7 +507,11 @@ class ProjectViewer(HasTraits):
         with self.ui.busy():
             proj = self.project
             if proj is not None:
-                proj.refresh()
+                counts = proj.refresh()
+                self.ui.info(
+                    'Rescan found %(added)d new, %(modified)d modified and '
+                    '%(removed)d removed files.' % counts
+                )
                 self.current_dir = proj.root
                 self._current_dir_changed(proj.root)
 
@@ -495,6 +535,25 @@ class ProjectViewer(HasTraits):
                 self.current_file = None
                 self.clear_search()
 
+    # This is also called when the project changes, after it is loaded above.
+    @on_trait_change('project.watch')
+    def _update_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        proj = self.project
+        if proj is not None and proj.watch:
+            # The changes are applied in the UI thread which uses the
+            # project and updates the traits of the viewer.
+            watcher = Watcher(project=proj, dispatch=call_in_ui_thread)
+            watcher.on_trait_change(self._watcher_changed, 'changed')
+            watcher.start()
+            self.watcher = watcher
+
+    def _watcher_changed(self, counts):
+        if self.current_dir is not None and not self.is_searching:
+            self._current_dir_changed(self.current_dir)
+
     def _current_dir_changed(self, d):
         self.parent = d.parent
         self.pager.data = d.directories + d.files
@@ -552,6 +611,12 @@ class VixenUI(HasTraits):
     # Private trait to generate message counts.
     _message_count = Int
 
+    # The processor factories of the jobs being processed.
+    _factories = List
+
+    # The name of the project being processed.
+    _processing = Str
+
     def setup_logging_handler(self):
         handler = UIErrorHandler(self)
         handler.setLevel(logging.ERROR)
@@ -609,28 +674,47 @@ class VixenUI(HasTraits):
         self.info('Remember to "Save" if you edit any tags.')
 
     def process(self, project):
-        jobs = []
-        for proc in project.processors:
-            if self.viewer.is_searching:
-                to_process = [x[1] for x in self.viewer.search_pager.data]
-            else:
-                to_process = project.keys()
-            jobs.extend(proc.make_jobs(to_process, project))
-        self.processor.jobs = jobs
-        njobs = len(jobs)
-        if njobs > 0:
-            logger.info(
-                'Processing project: %s having %d jobs', project.name, njobs
-            )
-            self.processor.process()
-            self.info(
-                "Processing complete. Save the project to persist changes."
-            )
+        """Process the project in the background.
+
+        The progress is available from the `processor`.  The jobs done by an
+        earlier run which was interrupted before the project was saved are
+        not run again, their results are restored from the project's ledger.
+        """
+        if self.processor.status == 'running':
+            self.info('Processing is already running.')
+            return
+        if self.viewer.is_searching:
+            to_process = [x[1] for x in self.viewer.search_pager.data]
         else:
-            self.info(
-                'Nothing to process for project: %s.\n'
-                'Processing already completed.' % project.name
-            )
+            to_process = project.keys()
+        self.processor.jobs = []
+        source = iter_pipeline_jobs(project.processors, to_process, project)
+        ledger = None
+        if len(project.ledger_file) > 0:
+            ledger = JobLedger(project.ledger_file)
+            ledger.load()
+            source = ledger.resume(source, project.processors, project)
+            if len(ledger.states) > 0:
+                logger.info(
+                    'Resuming processing with the ledger: %s', ledger
+                )
+        self.processor.ledger = ledger
+        self.processor.job_source = source
+        self._factories = list(project.processors)
+        self._processing = project.name
+        logger.info('Processing project: %s', project.name)
+        self.processor.start()
+
+    def export_report(self):
+        """Export the measurements of the last processing run.
+        """
+        fname = asksaveasfilename(
+            title='Enter report file to create (.json or .csv)',
+            defaultextension='.json'
+        )
+        if len(fname) > 0:
+            self.processor.export_report(fname)
+            self.success('Processing report saved to %s' % fname)
 
     def remove(self, project):
         name = project.name
@@ -709,7 +793,38 @@ class VixenUI(HasTraits):
         return ProjectViewer(ui=self)
 
     def _processor_default(self):
-        return Processor()
+        processor = Processor()
+        processor.on_trait_change(self._processor_status_changed, 'status')
+        return processor
+
+    def _processor_status_changed(self, old, new):
+        if old == 'running':
+            for factory in self._factories:
+                factory.close()
+        ledger = self.processor.ledger
+        resumed = ledger.resumed if ledger is not None else 0
+        if old == 'running' and new == 'success':
+            if resumed > 0:
+                self.info(
+                    "Processing complete, restored the results of %d jobs "
+                    "from an earlier run. Save the project to persist "
+                    "changes." % resumed
+                )
+            elif self.processor.number_of_jobs == 0:
+                self.info(
+                    'Nothing to process for project: %s.\n'
+                    'Processing already completed.' % self._processing
+                )
+            else:
+                self.info(
+                    "Processing complete. Save the project to persist "
+                    "changes."
+                )
+        elif old == 'running' and new == 'error':
+            self.error(
+                "Processing failed for %d jobs, see the errors below." %
+                len(self.processor.errored_jobs)
+            )
 
     def _version_default(self):
         import vixen
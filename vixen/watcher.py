@@ -0,0 +1,357 @@
+"""Watch the directory of a project and update the project when files are
+created, removed, modified or renamed.
+
+On Linux, inotify is used through ctypes.  Elsewhere, or if inotify cannot be
+used, the project is refreshed periodically which only lists the directories
+that changed (see `Project.refresh`).
+
+The changes are debounced: they are collected until nothing changes for a
+short while and are then applied to the project in one batch so copying a
+large number of files into the tree does not update the project and the UI
+for every single file.  The changes are found in a background thread and
+each batch is handed to `Watcher.dispatch` so it can be applied in the thread
+using the project.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+from functools import partial
+import logging
+import os
+from os.path import abspath, expanduser, join
+import select
+import struct
+import sys
+import threading
+import time
+
+from traits.api import (Any, Bool, Callable, Enum, Event, Float, HasTraits,
+                        Instance)
+
+
+logger = logging.getLogger(__name__)
+
+# Constants from <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+              IN_ONLYDIR)
+
+# The header of each inotify event: wd, mask, cookie and length of the name.
+EVENT_HEADER = struct.Struct('iIII')
+
+# Returned by the sources instead of a list of paths when the whole project
+# must be refreshed.
+REFRESH_ALL = None
+
+# Maximum time in seconds the watcher blocks waiting for changes, this is
+# how long it takes to notice that it has been stopped.
+READ_TIMEOUT = 0.2
+
+if sys.version_info[0] > 2:
+    _encode = os.fsencode
+    _decode = os.fsdecode
+else:
+    def _encode(path):
+        if isinstance(path, unicode):  # noqa: F821
+            return path.encode(sys.getfilesystemencoding())
+        return path
+
+    def _decode(name):
+        return name.decode(sys.getfilesystemencoding())
+
+
+def _load_libc():
+    """Return the C library with the inotify functions set up or None if
+    inotify is not available.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True
+        )
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _oserror():
+    code = ctypes.get_errno()
+    return OSError(code, os.strerror(code))
+
+
+class Inotify(object):
+    """Watch a directory tree using inotify.
+
+    `read` returns the paths, relative to the root, of the files and
+    directories that changed.
+    """
+
+    def __init__(self, root):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.root = root
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise _oserror()
+        # watch descriptor -> relative path of the directory and back.
+        self._paths = {}
+        self._wds = {}
+        try:
+            self.add_tree('')
+        except OSError:
+            self.close()
+            raise
+
+    def __repr__(self):
+        return 'Inotify(root=%r)' % self.root
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def add_tree(self, relpath):
+        """Watch the directory and all its subdirectories."""
+        top = join(self.root, relpath) if relpath else self.root
+        for path, dirs, files in os.walk(top, followlinks=True):
+            rpath = os.path.relpath(path, self.root)
+            self._add_watch('' if rpath == os.curdir else rpath)
+
+    def remove_tree(self, relpath):
+        """Stop watching the directory and all its subdirectories."""
+        prefix = relpath + os.sep
+        paths = [x for x in self._wds if x == relpath or x.startswith(prefix)]
+        for path in paths:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read(self, timeout):
+        """Wait at most `timeout` seconds for changes and return the list of
+        changed paths or `REFRESH_ALL` if some changes were lost.
+        """
+        ready = select.select([self._fd], [], [], timeout)[0]
+        if len(ready) == 0:
+            return []
+        data = os.read(self._fd, 65536)
+        paths = []
+        lost = False
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                lost = True
+                continue
+            dir_path = self._paths.get(wd)
+            if dir_path is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._paths[wd]
+                if self._wds.get(dir_path) == wd:
+                    del self._wds[dir_path]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # The parent directory reports this as a change of the
+                # directory, except for the root.
+                lost = lost or len(dir_path) == 0
+                continue
+            if len(name) == 0:
+                continue
+            name = _decode(name)
+            path = join(dir_path, name) if dir_path else name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+                elif mask & IN_MOVED_FROM:
+                    self.remove_tree(path)
+            paths.append(path)
+        return REFRESH_ALL if lost else paths
+
+    def _add_watch(self, relpath):
+        path = join(self.root, relpath) if relpath else self.root
+        wd = self._libc.inotify_add_watch(self._fd, _encode(path), WATCH_MASK)
+        if wd < 0:
+            error = _oserror()
+            if error.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                # The directory is gone or cannot be read.
+                return
+            raise error
+        old = self._paths.get(wd)
+        if old is not None and self._wds.get(old) == wd:
+            del self._wds[old]
+        self._paths[wd] = relpath
+        self._wds[relpath] = wd
+
+
+class Poller(object):
+    """Ask for the whole project to be refreshed at regular intervals.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = time.time() + interval
+
+    def __repr__(self):
+        return 'Poller(interval=%r)' % self.interval
+
+    def close(self):
+        pass
+
+    def read(self, timeout):
+        wait = self._next - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._next = time.time() + self.interval
+        return REFRESH_ALL
+
+
+def _call(func):
+    func()
+
+
+class Watcher(HasTraits):
+    """Watch the directory of a project in a background thread and apply
+    the changes to the project in batches.
+    """
+
+    project = Instance('vixen.project.Project')
+
+    # How the changes are found, 'auto' uses inotify if it is available and
+    # polling otherwise.
+    backend = Enum('auto', 'inotify', 'poll')
+
+    # The changes are applied once nothing has changed for this many seconds.
+    delay = Float(1.0)
+
+    # The changes are applied at least this often (in seconds) while things
+    # keep changing.
+    max_delay = Float(10.0)
+
+    # Seconds between refreshes of the project when polling.
+    poll_interval = Float(10.0)
+
+    # Fired with a dictionary of the number of 'added', 'removed' and
+    # 'modified' files after a batch of changes is applied.
+    changed = Event
+
+    # Called from the watcher thread with a function without arguments which
+    # applies a batch of changes to the project.  It should run the function
+    # in the thread which uses the project, the UI thread for example.  By
+    # default it is run right away in the watcher thread, which is only safe
+    # if nothing else uses the project meanwhile.
+    dispatch = Callable
+
+    running = Bool(False)
+
+    _thread = Instance(threading.Thread)
+
+    _stop = Any
+
+    def start(self):
+        if self.running:
+            return
+        logger.info('Watching project: %s', self.project.name)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self.running = True
+        self._thread.start()
+
+    def stop(self):
+        if self.running:
+            logger.info('Stop watching project: %s', self.project.name)
+            self._stop.set()
+            if threading.current_thread() is not self._thread:
+                self._thread.join()
+
+    # #### Private protocol ################################################
+
+    def _dispatch_default(self):
+        return _call
+
+    def _make_source(self):
+        root = abspath(expanduser(self.project.path))
+        if self.backend != 'poll':
+            try:
+                return Inotify(root)
+            except OSError as e:
+                if self.backend == 'inotify':
+                    raise
+                logger.info('Cannot use inotify (%s), polling instead.', e)
+        return Poller(self.poll_interval)
+
+    def _run(self):
+        try:
+            source = self._make_source()
+            try:
+                self._watch(source)
+            finally:
+                source.close()
+        except Exception:
+            logger.exception('Error watching project: %s', self.project.name)
+        finally:
+            self.running = False
+
+    def _watch(self, source):
+        paths = set()
+        refresh = False
+        first = last = None
+        while not self._stop.is_set():
+            changes = source.read(READ_TIMEOUT)
+            now = time.time()
+            if changes is REFRESH_ALL:
+                # This does not postpone the changes any further so regular
+                # polling does not keep postponing the refresh.
+                refresh = True
+                last = now if last is None else last
+            elif len(changes) > 0:
+                paths.update(changes)
+                last = now
+            if first is None:
+                first = last
+            if first is not None and (now - last >= self.delay or
+                                      now - first >= self.max_delay):
+                self.dispatch(partial(self._apply, paths, refresh))
+                paths = set()
+                refresh = False
+                first = last = None
+
+    def _apply(self, paths, refresh):
+        if self._stop.is_set():
+            # Dispatched before the watcher was stopped.
+            return
+        project = self.project
+        if refresh:
+            counts = project.refresh()
+        else:
+            counts = project.update_paths(paths)
+        if any(counts.values()):
+            self.changed = counts